@@ -0,0 +1,169 @@
+"""Filtered audit-log queries over a hot table plus monthly archive partitions.
+
+``audit_logs`` only holds the most recent ``AUDIT_HOT_MONTHS`` months. Older rows are
+moved by ``rollover_audit_logs`` into per-month tables named ``audit_logs_YYYYMM``
+with the same columns and ids, and archive months older than
+``AUDIT_RETENTION_MONTHS`` are dropped. ``query_audit_logs`` fans a filter out over
+the hot table and every partition overlapping the requested time range, and pages
+with a keyset on ``id`` (ids stay globally unique across partitions).
+"""
+import os
+import re
+from datetime import datetime, timezone
+
+from app.db import get_conn
+from app.responses import fetch_records
+
+AUDIT_HOT_MONTHS = int(os.getenv('AUDIT_HOT_MONTHS', '1'))
+AUDIT_RETENTION_MONTHS = int(os.getenv('AUDIT_RETENTION_MONTHS', '24'))
+AUDIT_MAX_PAGE = 500
+
+_PARTITION_RE = re.compile(r'^audit_logs_(\d{4})(\d{2})$')
+_COLUMNS = 'id, actor_user_id, action, target_type, target_id, metadata, created_at'
+
+# same indexes as the hot table (see init_db); secondary indexes carry the rowid (= id),
+# so each of them also serves the ORDER BY id DESC keyset scan
+_INDEXES = (
+    ('actor', 'actor_user_id'),
+    ('action', 'action'),
+    ('target', 'target_type, target_id'),
+    ('created', 'created_at'),
+)
+
+
+def _create_partition(conn, table: str) -> None:
+    conn.execute(
+        f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+          id INTEGER PRIMARY KEY,
+          actor_user_id INTEGER,
+          action TEXT NOT NULL,
+          target_type TEXT,
+          target_id INTEGER,
+          metadata TEXT,
+          created_at DATETIME
+        )
+        '''
+    )
+    for suffix, columns in _INDEXES:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_{suffix} ON {table}({columns})')
+
+
+def parse_timestamp(value: str | None) -> str | None:
+    """Normalise an ISO date/datetime to the ``YYYY-MM-DD HH:MM:SS`` UTC text SQLite stores."""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _month_start(year: int, month: int) -> str:
+    return f'{year:04d}-{month:02d}-01 00:00:00'
+
+
+def _shift_month(year: int, month: int, delta: int) -> tuple[int, int]:
+    index = year * 12 + (month - 1) + delta
+    return index // 12, index % 12 + 1
+
+
+def list_partitions(conn) -> list[tuple[str, int, int]]:
+    rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'audit_logs_%'").fetchall()
+    partitions = []
+    for row in rows:
+        match = _PARTITION_RE.match(row['name'])
+        if match:
+            partitions.append((row['name'], int(match.group(1)), int(match.group(2))))
+    return sorted(partitions, key=lambda p: (p[1], p[2]), reverse=True)
+
+
+def _overlapping_tables(conn, since: str | None, until: str | None) -> list[str]:
+    tables = ['audit_logs']
+    for name, year, month in list_partitions(conn):
+        start = _month_start(year, month)
+        end = _month_start(*_shift_month(year, month, 1))
+        if since and end <= since:
+            continue
+        if until and start >= until:
+            continue
+        tables.append(name)
+    return tables
+
+
+def query_audit_logs(
+    actor_user_id: int | None = None,
+    action: str | None = None,
+    target_type: str | None = None,
+    target_id: int | None = None,
+    since: str | None = None,
+    until: str | None = None,
+    before_id: int | None = None,
+    limit: int = 100,
+) -> tuple[list[dict], int | None]:
+    """Return ``(rows, next_before_id)`` newest first; pass ``next_before_id`` back to get the next page.
+
+    ``since`` is inclusive and ``until`` exclusive, both as normalised by ``parse_timestamp``.
+    """
+    limit = min(max(limit, 1), AUDIT_MAX_PAGE)
+    where = []
+    params: list = []
+    for column, value in (('actor_user_id', actor_user_id), ('action', action), ('target_type', target_type), ('target_id', target_id)):
+        if value is not None:
+            where.append(f'{column} = ?')
+            params.append(value)
+    if since:
+        where.append('created_at >= ?')
+        params.append(since)
+    if until:
+        where.append('created_at < ?')
+        params.append(until)
+    if before_id is not None:
+        where.append('id < ?')
+        params.append(before_id)
+    where_sql = f"WHERE {' AND '.join(where)}" if where else ''
+
+    with get_conn(db='audit') as conn:
+        tables = _overlapping_tables(conn, since, until)
+        parts = [f'SELECT * FROM (SELECT {_COLUMNS} FROM {table} {where_sql} ORDER BY id DESC LIMIT ?)' for table in tables]
+        sql = ' UNION ALL '.join(parts) + ' ORDER BY id DESC LIMIT ?'
+        data = fetch_records(conn, sql, [*(params + [limit]) * len(tables), limit])
+
+    next_before_id = data[-1]['id'] if len(data) == limit else None
+    return data, next_before_id
+
+
+def rollover_audit_logs(now: datetime | None = None, hot_months: int = AUDIT_HOT_MONTHS, retention_months: int = AUDIT_RETENTION_MONTHS) -> dict:
+    """Move rows older than the hot window into monthly partitions and drop expired partitions."""
+    now = now or datetime.now(timezone.utc)
+    cutoff = _month_start(*_shift_month(now.year, now.month, -(hot_months - 1)))
+    oldest_kept = _shift_month(now.year, now.month, -retention_months)
+    moved: dict[str, int] = {}
+    dropped: list[str] = []
+
+    with get_conn(db='audit') as conn:
+        months = [row['m'] for row in conn.execute(
+            'SELECT DISTINCT substr(created_at, 1, 7) m FROM audit_logs WHERE created_at < ? ORDER BY m', (cutoff,)
+        ).fetchall()]
+
+    for month in months:
+        year, mon = int(month[:4]), int(month[5:7])
+        table = f'audit_logs_{year:04d}{mon:02d}'
+        start, end = _month_start(year, mon), _month_start(*_shift_month(year, mon, 1))
+        # one short write transaction per month keeps the lock window small
+        with get_conn(immediate=True, db='audit') as conn:
+            _create_partition(conn, table)
+            cur = conn.execute(
+                f'INSERT OR IGNORE INTO {table} ({_COLUMNS}) SELECT {_COLUMNS} FROM audit_logs WHERE created_at >= ? AND created_at < ?',
+                (start, end),
+            )
+            conn.execute('DELETE FROM audit_logs WHERE created_at >= ? AND created_at < ?', (start, end))
+            moved[table] = cur.rowcount
+
+    with get_conn(immediate=True, db='audit') as conn:
+        for name, year, month in list_partitions(conn):
+            if (year, month) < oldest_kept:
+                conn.execute(f'DROP TABLE {name}')
+                dropped.append(name)
+
+    return {'cutoff': cutoff, 'moved': moved, 'dropped': dropped}
@@ -6,6 +6,10 @@ import secrets
 import time
 from typing import Optional
 
+CSRF_TTL_SECONDS = int(os.getenv('APP_CSRF_TTL_SECONDS', str(4 * 3600)))
+# issue times are rounded down to this step, so a page rendered twice in one step carries the same token
+CSRF_TIME_STEP_SECONDS = 600
+
 
 def get_secret_key() -> str:
     secret = os.getenv('APP_SECRET_KEY', '').strip()
@@ -50,3 +54,19 @@ def verify_session_token(token: str) -> Optional[dict]:
         return {'user_id': int(user_id), 'user_type': user_type}
     except Exception:
         return None
+
+
+def create_csrf_token(subject: str) -> str:
+    """A stateless CSRF token for ``subject`` (a session or anonymous-visitor id): ``issued.hmac``."""
+    issued = int(time.time()) // CSRF_TIME_STEP_SECONDS * CSRF_TIME_STEP_SECONDS
+    sig = hmac.new(get_secret_key().encode(), f'csrf:{subject}:{issued}'.encode(), hashlib.sha256).hexdigest()
+    return f'{issued}.{sig}'
+
+
+def verify_csrf_token(token: str, subject: str) -> bool:
+    try:
+        issued, sig = token.split('.', 1)
+        expected = hmac.new(get_secret_key().encode(), f'csrf:{subject}:{int(issued)}'.encode(), hashlib.sha256).hexdigest()
+    except (ValueError, RuntimeError):
+        return False
+    return hmac.compare_digest(sig, expected) and 0 <= time.time() - int(issued) <= CSRF_TTL_SECONDS
@@ -0,0 +1,254 @@
+"""Online snapshots of the database files through the SQLite backup API.
+
+Each file is copied ``APP_BACKUP_PAGES_PER_STEP`` pages at a time with a
+``APP_BACKUP_STEP_SLEEP_MS`` pause between steps. The source is only read-locked
+during a step, so message and payment writes slip in between steps. A write from
+another connection makes SQLite restart the copy. After ``MAX_RESTARTS`` restarts
+at one step size, the step grows ``STEP_GROWTH``-fold, so a snapshot still finishes
+under steady writes, at the cost of longer (still bounded) steps.
+
+A snapshot is a directory ``APP_BACKUP_DIR/<UTC timestamp>/`` holding one file per
+database (main plus the split messages/audit files) and a ``manifest.json``. The
+manifest records per-file size, SHA-256, step count, duration, throughput, restarts and
+the ``PRAGMA integrity_check`` result. Snapshots are built under a ``.partial``
+name and renamed when complete. Only the newest ``APP_BACKUP_RETENTION`` are kept.
+
+One backup runs at a time across every worker process and the CLI: each holds an
+exclusive ``flock`` on ``APP_BACKUP_DIR/.lock`` for the whole copy, verification
+and retention pass, and the kernel drops it if the holder dies.
+"""
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from app.db import DB_PATHS, is_split
+
+BACKUP_DIR = os.getenv('APP_BACKUP_DIR', 'backups')
+BACKUP_RETENTION = int(os.getenv('APP_BACKUP_RETENTION', '14'))
+BACKUP_INTERVAL_SECONDS = float(os.getenv('APP_BACKUP_INTERVAL_SECONDS', str(24 * 3600)))
+BACKUP_PAGES_PER_STEP = int(os.getenv('APP_BACKUP_PAGES_PER_STEP', '256'))
+BACKUP_STEP_SLEEP_MS = float(os.getenv('APP_BACKUP_STEP_SLEEP_MS', '10'))
+MAX_RESTARTS = 2
+STEP_GROWTH = 4
+_SNAPSHOT_NAME = re.compile(r'\d{8}T\d{9}Z')
+LOCK_FILE = '.lock'
+
+
+class BackupBusy(RuntimeError):
+    pass
+
+
+class _RestartLimit(Exception):
+    pass
+
+
+@contextmanager
+def _backup_lock():
+    """Hold the cross-process backup lock, or raise ``BackupBusy`` if another backup has it."""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    with open(os.path.join(BACKUP_DIR, LOCK_FILE), 'a') as fh:
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise BackupBusy('A backup is already running') from None
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _backup_running() -> bool:
+    try:
+        with _backup_lock():
+            return False
+    except BackupBusy:
+        return True
+
+
+def _backed_up_dbs() -> list[str]:
+    return [db for db in DB_PATHS if db == 'main' or is_split(db)]
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _integrity(path: str) -> str:
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        return '; '.join(row[0] for row in conn.execute('PRAGMA integrity_check').fetchall())
+    finally:
+        conn.close()
+
+
+def _copy(source_path: str, target_path: str, pages: int, sleep_s: float) -> dict:
+    """Copy one file; returns step/restart counts and the step size that finished."""
+    stats = {'steps': 0, 'restarts': 0, 'pages_per_step': pages}
+    while True:
+        state = {'remaining': None, 'restarts': 0}
+
+        def progress(status, remaining, total):
+            stats['steps'] += 1
+            # ``remaining`` only grows when a write from another connection restarted the copy
+            if state['remaining'] is not None and remaining > state['remaining']:
+                state['restarts'] += 1
+                stats['restarts'] += 1
+                if state['restarts'] > MAX_RESTARTS:
+                    raise _RestartLimit
+            state['remaining'] = remaining
+            # the backup's own ``sleep`` only applies after SQLITE_BUSY; the pause between
+            # steps (source lock released) is what lets writers in
+            if remaining:
+                time.sleep(sleep_s)
+
+        source = sqlite3.connect(source_path)
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target, pages=pages, progress=progress, sleep=sleep_s)
+            return stats
+        except _RestartLimit:
+            pages *= STEP_GROWTH
+            stats['pages_per_step'] = pages
+        finally:
+            target.close()
+            source.close()
+
+
+def create_backup(pages_per_step: int = BACKUP_PAGES_PER_STEP, step_sleep_ms: float = BACKUP_STEP_SLEEP_MS) -> dict:
+    """Take a verified snapshot of every database file and apply retention; returns its manifest."""
+    with _backup_lock():
+        started = time.time()
+        name = time.strftime('%Y%m%dT%H%M%S', time.gmtime(started)) + f'{int(started * 1000) % 1000:03d}Z'
+        partial = os.path.join(BACKUP_DIR, f'{name}.partial')
+        os.makedirs(partial)
+        try:
+            manifest = _write_snapshot(name, partial, started, pages_per_step, step_sleep_ms / 1000)
+        except BaseException:
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+        os.rename(partial, os.path.join(BACKUP_DIR, name))
+        manifest['pruned'] = _apply_retention()
+        return manifest
+
+
+def _write_snapshot(name: str, partial: str, started: float, pages_per_step: int, sleep_s: float) -> dict:
+    files = {}
+    for db in _backed_up_dbs():
+        target = os.path.join(partial, f'{db}.db')
+        copy_started = time.perf_counter()
+        copy = _copy(DB_PATHS[db], target, pages_per_step, sleep_s)
+        duration = time.perf_counter() - copy_started
+        size = os.path.getsize(target)
+        files[db] = {
+            'file': f'{db}.db',
+            'bytes': size,
+            'duration_ms': round(duration * 1000, 2),
+            'throughput_mb_s': round(size / 1_048_576 / duration, 2) if duration else None,
+            **copy,
+            'sha256': _sha256(target),
+            'integrity': _integrity(target),
+        }
+    manifest = {
+        'name': name,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(started)),
+        'duration_ms': round((time.time() - started) * 1000, 2),
+        'bytes': sum(f['bytes'] for f in files.values()),
+        'ok': all(f['integrity'] == 'ok' for f in files.values()),
+        'files': files,
+    }
+    with open(os.path.join(partial, 'manifest.json'), 'w', encoding='utf-8') as fh:
+        json.dump(manifest, fh, indent=2)
+    return manifest
+
+
+def _snapshot_names() -> list[str]:
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    return sorted(name for name in os.listdir(BACKUP_DIR) if _SNAPSHOT_NAME.fullmatch(name))
+
+
+def _apply_retention() -> list[str]:
+    names = _snapshot_names()
+    pruned = names[:-max(BACKUP_RETENTION, 1)]
+    for name in pruned:
+        shutil.rmtree(os.path.join(BACKUP_DIR, name), ignore_errors=True)
+    return pruned
+
+
+def load_manifest(name: str) -> dict | None:
+    if not _SNAPSHOT_NAME.fullmatch(name):
+        return None
+    try:
+        with open(os.path.join(BACKUP_DIR, name, 'manifest.json'), encoding='utf-8') as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
+def list_backups() -> list[dict]:
+    """Snapshot manifests, newest first."""
+    return [m for m in (load_manifest(name) for name in reversed(_snapshot_names())) if m is not None]
+
+
+def verify_backup(name: str) -> dict | None:
+    """Re-check a stored snapshot against its manifest: checksum and integrity of every file."""
+    manifest = load_manifest(name)
+    if manifest is None:
+        return None
+    results = {}
+    for db, info in manifest['files'].items():
+        path = os.path.join(BACKUP_DIR, name, info['file'])
+        if not os.path.exists(path):
+            results[db] = {'ok': False, 'error': 'missing'}
+            continue
+        checksum_ok = _sha256(path) == info['sha256']
+        integrity = _integrity(path)
+        results[db] = {'ok': checksum_ok and integrity == 'ok', 'checksum_ok': checksum_ok, 'integrity': integrity}
+    return {'name': name, 'ok': all(r['ok'] for r in results.values()), 'files': results}
+
+
+def backup_settings() -> dict:
+    return {
+        'dir': BACKUP_DIR,
+        'retention': BACKUP_RETENTION,
+        'interval_seconds': BACKUP_INTERVAL_SECONDS,
+        'pages_per_step': BACKUP_PAGES_PER_STEP,
+        'step_sleep_ms': BACKUP_STEP_SLEEP_MS,
+        'running': _backup_running(),
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description='Take, list or verify online snapshots of the configured databases.')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--list', action='store_true', help='list stored snapshots')
+    group.add_argument('--verify', metavar='NAME', help='re-verify a stored snapshot')
+    parser.add_argument('--pages-per-step', type=int, default=BACKUP_PAGES_PER_STEP)
+    parser.add_argument('--step-sleep-ms', type=float, default=BACKUP_STEP_SLEEP_MS)
+    args = parser.parse_args(argv)
+    if args.list:
+        result = list_backups()
+    elif args.verify:
+        result = verify_backup(args.verify)
+        if result is None:
+            parser.error(f'no snapshot named {args.verify}')
+    else:
+        result = create_backup(args.pages_per_step, args.step_sleep_ms)
+    print(json.dumps(result, indent=2))
+    if isinstance(result, dict) and not result.get('ok', True):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
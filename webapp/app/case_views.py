@@ -0,0 +1,70 @@
+"""Single-query loaders for the case pages.
+
+The case row, both participants' display names, its payments and a bounded
+window of recent messages come back from one statement. Related rows are folded
+in with correlated ``json_group_array`` subqueries, and only the columns the
+templates render are selected (never ``users.*``).
+"""
+import json
+
+MESSAGE_WINDOW = 100
+
+_PAYMENTS_SUBQUERY = '''
+    (SELECT json_group_array(json_object('id', p.id, 'amount', p.amount, 'status', p.status, 'escrow_status', p.escrow_status, 'created_at', p.created_at))
+     FROM (SELECT id, amount, status, escrow_status, created_at FROM payments WHERE case_id = c.id ORDER BY id DESC) p) AS payments_json
+'''
+
+_MESSAGES_SUBQUERY = '''
+    (SELECT json_group_array(json_object('id', m.id, 'sender_user_id', m.sender_user_id, 'receiver_user_id', m.receiver_user_id, 'content', m.content, 'created_at', m.created_at))
+     FROM (SELECT id, sender_user_id, receiver_user_id, content, created_at FROM messages WHERE case_id = c.id ORDER BY id DESC LIMIT ?) m) AS messages_json
+'''
+
+
+def load_case_view(conn, case_id: int, include_payments: bool = False, message_limit: int = 0, reader_user_id: int | None = None) -> dict | None:
+    """Return ``case``/``client``/``lawyer`` (plus ``payments``/``messages`` when asked) in one query.
+
+    Messages are the newest ``message_limit`` rows of the thread, returned oldest first.
+    With ``reader_user_id`` the view also carries that user's ``unread_count`` for the thread.
+    """
+    columns = [
+        'c.id, c.client_user_id, c.lawyer_user_id, c.title, c.case_type, c.description, c.status, c.created_at',
+        'client.full_name AS client_name',
+        'lawyer.full_name AS lawyer_name',
+    ]
+    params: list = []
+    if include_payments:
+        columns.append(_PAYMENTS_SUBQUERY)
+    if message_limit:
+        columns.append(_MESSAGES_SUBQUERY)
+        params.append(message_limit)
+    if reader_user_id is not None:
+        columns.append('(SELECT unread_count FROM case_read_state WHERE user_id = ? AND case_id = c.id) AS unread_count')
+        params.append(reader_user_id)
+    params.append(case_id)
+
+    row = conn.execute(
+        f'''
+        SELECT {', '.join(columns)}
+        FROM cases c
+        LEFT JOIN users client ON client.id = c.client_user_id
+        LEFT JOIN users lawyer ON lawyer.id = c.lawyer_user_id
+        WHERE c.id = ?
+        ''',
+        params,
+    ).fetchone()
+    if not row:
+        return None
+
+    case = {k: row[k] for k in ('id', 'client_user_id', 'lawyer_user_id', 'title', 'case_type', 'description', 'status', 'created_at')}
+    view = {
+        'case': case,
+        'client': {'id': case['client_user_id'], 'full_name': row['client_name']} if row['client_name'] is not None else None,
+        'lawyer': {'id': case['lawyer_user_id'], 'full_name': row['lawyer_name']} if row['lawyer_name'] is not None else None,
+    }
+    if include_payments:
+        view['payments'] = json.loads(row['payments_json'])
+    if message_limit:
+        view['messages'] = json.loads(row['messages_json'])[::-1]
+    if reader_user_id is not None:
+        view['unread_count'] = row['unread_count'] or 0
+    return view
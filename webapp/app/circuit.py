@@ -0,0 +1,101 @@
+"""Circuit breaker for calls to slow or unreliable upstream providers.
+
+Outcomes are kept in a rolling time window. Once enough calls have been seen and
+the share of failed or too-slow calls crosses the threshold, the breaker opens and
+callers skip the upstream entirely. After ``open_seconds`` a single half-open probe
+is let through: success closes the breaker, failure re-opens it.
+"""
+import threading
+import time
+from collections import deque
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = 0.5,
+        slow_call_seconds: float = 5.0,
+        min_calls: int = 5,
+        window_seconds: float = 60.0,
+        open_seconds: float = 30.0,
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.transitions = {f'{CLOSED}->{OPEN}': 0, f'{OPEN}->{HALF_OPEN}': 0, f'{HALF_OPEN}->{CLOSED}': 0, f'{HALF_OPEN}->{OPEN}': 0}
+        self.short_circuited = 0
+        self._outcomes: deque = deque()  # (timestamp, failed)
+        self._probe_started_at: float | None = None
+        self._lock = threading.Lock()
+
+    def _move(self, state: str) -> None:
+        self.transitions[f'{self.state}->{state}'] += 1
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        if state != HALF_OPEN:
+            self._probe_started_at = None
+        if state == CLOSED:
+            self._outcomes.clear()
+
+    def allow(self) -> bool:
+        """Return True if the caller may hit the upstream now."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+                self._move(HALF_OPEN)
+            if self.state == CLOSED:
+                return True
+            # a probe that never reported back (caller crashed) must not wedge the breaker half-open
+            if self.state == HALF_OPEN and (self._probe_started_at is None or time.monotonic() - self._probe_started_at > self.open_seconds):
+                self._probe_started_at = time.monotonic()
+                return True
+            self.short_circuited += 1
+            return False
+
+    def record(self, ok: bool, latency_s: float) -> None:
+        failed = not ok or latency_s > self.slow_call_seconds
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._move(OPEN if failed else CLOSED)
+                return
+            if self.state == OPEN:
+                return
+            self._outcomes.append((now, failed))
+            while self._outcomes and self._outcomes[0][0] < now - self.window_seconds:
+                self._outcomes.popleft()
+            calls = len(self._outcomes)
+            failures = sum(1 for _, f in self._outcomes if f)
+            if calls >= self.min_calls and failures / calls >= self.failure_rate:
+                self._move(OPEN)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            calls = len(self._outcomes)
+            failures = sum(1 for _, f in self._outcomes if f)
+            return {
+                'name': self.name,
+                'state': self.state,
+                'window_calls': calls,
+                'window_failures': failures,
+                'open_for_s': round(time.monotonic() - self.opened_at, 3) if self.state == OPEN else 0,
+                'short_circuited': self.short_circuited,
+                'transitions': dict(self.transitions),
+                'config': {
+                    'failure_rate': self.failure_rate,
+                    'slow_call_seconds': self.slow_call_seconds,
+                    'min_calls': self.min_calls,
+                    'window_seconds': self.window_seconds,
+                    'open_seconds': self.open_seconds,
+                },
+            }
@@ -1,8 +1,28 @@
+import hashlib
 import os
 import sqlite3
 from contextlib import contextmanager
+from contextvars import ContextVar
+
+from app.facets import rebuild_facets
+from app.search import CASES_FTS_SCHEMA, MESSAGES_FTS_SCHEMA, backfill_fts
 
 DB_PATH = os.getenv('APP_DB_PATH', 'hoqouqi.db')
+# messages and audit_logs can be moved to their own files so their writes don't queue
+# behind (or block) payment/case writes on the main file's single writer lock
+DB_PATHS = {
+    'main': DB_PATH,
+    'messages': os.getenv('APP_MESSAGES_DB_PATH', '').strip() or DB_PATH,
+    'audit': os.getenv('APP_AUDIT_DB_PATH', '').strip() or DB_PATH,
+}
+# schema name each split file is attached under on main connections
+ATTACH_AS = {'messages': 'messages_db', 'audit': 'audit_db'}
+
+VERSIONED_TABLES = ('users', 'lawyers')
+# versioned by earlier revisions; their triggers are dropped on upgrade
+UNVERSIONED_TABLES = ('cases', 'payments', 'lawyer_verification_requests')
+
+_query_log: ContextVar[list | None] = ContextVar('query_log', default=None)
 
 SCHEMA = '''
 CREATE TABLE IF NOT EXISTS users (
@@ -29,6 +49,19 @@ CREATE TABLE IF NOT EXISTS lawyers (
   FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
+-- bumped by triggers on every write to the tables in VERSIONED_TABLES (fragment cache keys)
+CREATE TABLE IF NOT EXISTS data_versions (
+  name TEXT PRIMARY KEY,
+  version INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS lawyer_facets (
+  facet TEXT NOT NULL,
+  value TEXT NOT NULL,
+  lawyer_count INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (facet, value)
+);
+
 CREATE TABLE IF NOT EXISTS cases (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   client_user_id INTEGER NOT NULL,
@@ -57,16 +90,6 @@ CREATE TABLE IF NOT EXISTS payments (
   FOREIGN KEY (case_id) REFERENCES cases(id)
 );
 
-CREATE TABLE IF NOT EXISTS messages (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  case_id INTEGER NOT NULL,
-  sender_user_id INTEGER NOT NULL,
-  receiver_user_id INTEGER NOT NULL,
-  content TEXT NOT NULL,
-  created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-  FOREIGN KEY (case_id) REFERENCES cases(id)
-);
-
 CREATE TABLE IF NOT EXISTS lawyer_verification_requests (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   lawyer_user_id INTEGER NOT NULL,
@@ -79,6 +102,89 @@ CREATE TABLE IF NOT EXISTS lawyer_verification_requests (
   FOREIGN KEY (lawyer_user_id) REFERENCES users(id)
 );
 
+CREATE TABLE IF NOT EXISTS jobs (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  kind TEXT NOT NULL,
+  payload TEXT NOT NULL DEFAULT '{}',
+  priority INTEGER NOT NULL DEFAULT 0,
+  status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued','running','done','failed')),
+  attempts INTEGER NOT NULL DEFAULT 0,
+  max_attempts INTEGER NOT NULL DEFAULT 5,
+  run_after REAL NOT NULL,
+  locked_until REAL,
+  result TEXT,
+  last_error TEXT,
+  enqueued_at REAL NOT NULL,
+  started_at REAL,
+  finished_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS maintenance_runs (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  trigger TEXT NOT NULL,
+  full INTEGER NOT NULL,
+  started_at REAL NOT NULL,
+  duration_ms REAL NOT NULL,
+  steps TEXT NOT NULL
+);
+
+-- every write that can change a lawyer's recommendation entry; each worker process
+-- replays rows past its cursor into its in-memory index (see app.matching)
+CREATE TABLE IF NOT EXISTS matching_changes (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  lawyer_user_id INTEGER NOT NULL,
+  changed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_lawyers_insert_matching AFTER INSERT ON lawyers
+BEGIN INSERT INTO matching_changes (lawyer_user_id) VALUES (NEW.user_id); END;
+CREATE TRIGGER IF NOT EXISTS trg_lawyers_update_matching AFTER UPDATE ON lawyers
+BEGIN INSERT INTO matching_changes (lawyer_user_id) VALUES (NEW.user_id); END;
+CREATE TRIGGER IF NOT EXISTS trg_lawyers_delete_matching AFTER DELETE ON lawyers
+BEGIN INSERT INTO matching_changes (lawyer_user_id) VALUES (OLD.user_id); END;
+CREATE TRIGGER IF NOT EXISTS trg_users_update_matching AFTER UPDATE OF full_name, is_verified, is_active, user_type ON users
+WHEN OLD.user_type = 'lawyer' OR NEW.user_type = 'lawyer'
+BEGIN INSERT INTO matching_changes (lawyer_user_id) VALUES (NEW.id); END;
+CREATE TRIGGER IF NOT EXISTS trg_cases_insert_matching AFTER INSERT ON cases
+WHEN NEW.lawyer_user_id IS NOT NULL
+BEGIN INSERT INTO matching_changes (lawyer_user_id) VALUES (NEW.lawyer_user_id); END;
+CREATE TRIGGER IF NOT EXISTS trg_cases_update_matching AFTER UPDATE OF lawyer_user_id, status, case_type ON cases
+BEGIN
+  INSERT INTO matching_changes (lawyer_user_id) SELECT NEW.lawyer_user_id WHERE NEW.lawyer_user_id IS NOT NULL;
+  INSERT INTO matching_changes (lawyer_user_id)
+  SELECT OLD.lawyer_user_id WHERE OLD.lawyer_user_id IS NOT NULL AND OLD.lawyer_user_id IS NOT NEW.lawyer_user_id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_cases_delete_matching AFTER DELETE ON cases
+WHEN OLD.lawyer_user_id IS NOT NULL
+BEGIN INSERT INTO matching_changes (lawyer_user_id) VALUES (OLD.lawyer_user_id); END;
+'''
+
+# high-write tables; each may live in its own database file (see DB_PATHS)
+MESSAGES_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS messages (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  case_id INTEGER NOT NULL,
+  sender_user_id INTEGER NOT NULL,
+  receiver_user_id INTEGER NOT NULL,
+  content TEXT NOT NULL,
+  created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+  FOREIGN KEY (case_id) REFERENCES cases(id)
+);
+
+-- per-(user, case) read cursor and thread summary, maintained on every message insert
+CREATE TABLE IF NOT EXISTS case_read_state (
+  user_id INTEGER NOT NULL,
+  case_id INTEGER NOT NULL,
+  unread_count INTEGER NOT NULL DEFAULT 0,
+  last_read_message_id INTEGER NOT NULL DEFAULT 0,
+  last_message_id INTEGER NOT NULL DEFAULT 0,
+  last_message_preview TEXT,
+  last_message_at DATETIME,
+  PRIMARY KEY (user_id, case_id)
+);
+'''
+
+AUDIT_SCHEMA = '''
 CREATE TABLE IF NOT EXISTS audit_logs (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   actor_user_id INTEGER,
@@ -92,16 +198,69 @@ CREATE TABLE IF NOT EXISTS audit_logs (
 '''
 
 
+# bump when init_db's migration steps change without a change to the schema text above
+MIGRATION_REVISION = 2
+
+
+def _schema_version() -> int:
+    """Fingerprint of the schema, the migration steps and the file layout, stored as PRAGMA user_version."""
+    layout = ','.join(db for db in DB_PATHS if is_split(db))
+    source = '\n'.join((
+        str(MIGRATION_REVISION), layout, ','.join(VERSIONED_TABLES),
+        SCHEMA, MESSAGES_SCHEMA, AUDIT_SCHEMA, CASES_FTS_SCHEMA, MESSAGES_FTS_SCHEMA,
+    ))
+    return int.from_bytes(hashlib.sha256(source.encode()).digest()[:4], 'big') & 0x7FFFFFFF
+
+
+def _db_files() -> list[str]:
+    return list(dict.fromkeys(DB_PATHS.values()))
+
+
+def schema_is_current() -> bool:
+    """True when every database file was last initialised with this exact schema and layout."""
+    expected = _schema_version()
+    for path in _db_files():
+        if not os.path.exists(path):
+            return False
+        with sqlite3.connect(path) as conn:
+            if conn.execute('PRAGMA user_version').fetchone()[0] != expected:
+                return False
+    return True
+
+
+def ensure_schema(fast: bool = True) -> bool:
+    """Run ``init_db`` unless ``fast`` and the schema is already current; returns whether it ran."""
+    if fast and schema_is_current():
+        return False
+    init_db()
+    return True
+
+
+def warm_connections() -> None:
+    """Open a connection the way requests do so schema parsing and the first file pages are paid up front."""
+    with get_conn() as conn:
+        conn.execute('SELECT name FROM sqlite_master').fetchall()
+        for alias in {ATTACH_AS[db] for db in ATTACH_AS if is_split(db)}:
+            conn.execute(f'SELECT name FROM {alias}.sqlite_master').fetchall()
+
+
+def is_split(db: str) -> bool:
+    return DB_PATHS[db] != DB_PATHS['main']
+
+
 def init_db() -> None:
     with sqlite3.connect(DB_PATH) as conn:
+        # only takes effect on a new file; existing ones are converted by app.maintenance
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
         conn.executescript(SCHEMA)
+        conn.executescript(CASES_FTS_SCHEMA)
+        backfill_fts(conn, 'cases_fts', 'cases')
         # safe evolutions for existing DBs
         conn.execute('CREATE INDEX IF NOT EXISTS idx_cases_client ON cases(client_user_id)')
         conn.execute('CREATE INDEX IF NOT EXISTS idx_cases_lawyer ON cases(lawyer_user_id)')
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_case ON messages(case_id)')
         conn.execute('CREATE INDEX IF NOT EXISTS idx_payments_case ON payments(case_id)')
-        conn.execute('CREATE INDEX IF NOT EXISTS idx_audit_actor ON audit_logs(actor_user_id)')
         conn.execute('CREATE INDEX IF NOT EXISTS idx_verification_status ON lawyer_verification_requests(status)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs(status, priority DESC, run_after)')
 
         cols = [row[1] for row in conn.execute('PRAGMA table_info(payments)').fetchall()]
         if 'transaction_ref' not in cols:
@@ -110,15 +269,157 @@ def init_db() -> None:
             conn.execute('ALTER TABLE payments ADD COLUMN notes TEXT')
         if 'updated_at' not in cols:
             conn.execute("ALTER TABLE payments ADD COLUMN updated_at DATETIME DEFAULT CURRENT_TIMESTAMP")
+        for table in VERSIONED_TABLES:
+            conn.execute('INSERT OR IGNORE INTO data_versions (name, version) VALUES (?, 0)', (table,))
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                conn.execute(
+                    f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version AFTER {event} ON {table}
+                    BEGIN UPDATE data_versions SET version = version + 1 WHERE name = '{table}'; END
+                    '''
+                )
+        for table in UNVERSIONED_TABLES:
+            for event in ('insert', 'update', 'delete'):
+                conn.execute(f'DROP TRIGGER IF EXISTS trg_{table}_{event}_version')
+            conn.execute('DELETE FROM data_versions WHERE name = ?', (table,))
+        if not conn.execute('SELECT 1 FROM lawyer_facets LIMIT 1').fetchone():
+            rebuild_facets(conn)
         conn.commit()
 
+    with sqlite3.connect(DB_PATHS['messages']) as conn:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.executescript(MESSAGES_SCHEMA)
+        conn.executescript(MESSAGES_FTS_SCHEMA)
+        backfill_fts(conn, 'messages_fts', 'messages')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_messages_case ON messages(case_id)')
+        conn.commit()
+
+    with sqlite3.connect(DB_PATHS['audit']) as conn:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.executescript(AUDIT_SCHEMA)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_audit_actor ON audit_logs(actor_user_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_audit_action ON audit_logs(action)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_audit_target ON audit_logs(target_type, target_id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_audit_created ON audit_logs(created_at)')
+        conn.commit()
+
+    if is_split('messages'):
+        # read state travels with its messages: a copy left in main would shadow the split one
+        _migrate_tables_out('messages', lambda name: name in ('messages', 'case_read_state'))
+        with sqlite3.connect(DB_PATH) as conn:
+            # the split file has its own index; one left in main would shadow it on attached connections
+            conn.execute('DROP TABLE IF EXISTS main.messages_fts')
+            conn.execute('DROP VIEW IF EXISTS main.messages_fts_source')
+    with sqlite3.connect(DB_PATHS['messages']) as conn:
+        # after the move, so a freshly split file is backfilled from the messages it now holds
+        _backfill_read_state(conn)
+        conn.commit()
+    if is_split('audit'):
+        # audit_logs plus its monthly archive partitions (audit_logs_YYYYMM)
+        _migrate_tables_out('audit', lambda name: name == 'audit_logs' or name.startswith('audit_logs_'))
+
+    version = _schema_version()
+    for path in _db_files():
+        with sqlite3.connect(path) as conn:
+            conn.execute(f'PRAGMA user_version = {version}')
+
+
+def _backfill_read_state(conn) -> None:
+    """Summaries for threads written before read state existed; history counts as read."""
+    if conn.execute('SELECT 1 FROM case_read_state LIMIT 1').fetchone():
+        return
+    conn.execute(
+        '''
+        INSERT OR IGNORE INTO case_read_state
+          (user_id, case_id, unread_count, last_read_message_id, last_message_id, last_message_preview, last_message_at)
+        SELECT p.user_id, p.case_id, 0, m.id, m.id, substr(m.content, 1, 120), m.created_at
+        FROM (
+          SELECT case_id, sender_user_id AS user_id FROM messages
+          UNION
+          SELECT case_id, receiver_user_id FROM messages
+        ) p
+        JOIN messages m ON m.id = (SELECT MAX(id) FROM messages WHERE case_id = p.case_id)
+        '''
+    )
+
+
+def _migrate_tables_out(db: str, wanted) -> None:
+    """Move tables matching ``wanted`` from an existing main database into the ``db`` file, then drop them from main.
+
+    Covers deployments that ran with everything in hoqouqi.db before the split paths were configured.
+    """
+    with sqlite3.connect(DB_PATH) as src:
+        tables = [(name, sql) for name, sql in src.execute("SELECT name, sql FROM sqlite_master WHERE type = 'table'").fetchall() if wanted(name)]
+        if not tables:
+            return
+        indexes = src.execute("SELECT tbl_name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL").fetchall()
+
+    with sqlite3.connect(DB_PATHS[db]) as dst:
+        existing = {row[0] for row in dst.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()}
+        for name, sql in tables:
+            if name not in existing:
+                dst.execute(sql)
+            for tbl_name, index_sql in indexes:
+                if tbl_name == name:
+                    dst.execute(index_sql.replace('CREATE INDEX', 'CREATE INDEX IF NOT EXISTS', 1))
+        dst.commit()
 
-@contextmanager
-def get_conn():
     conn = sqlite3.connect(DB_PATH)
+    try:
+        conn.execute('ATTACH DATABASE ? AS split_target', (DB_PATHS[db],))
+        conn.execute('BEGIN IMMEDIATE')
+        for name, _ in tables:
+            columns = ', '.join(row[1] for row in conn.execute(f'PRAGMA main.table_info({name})').fetchall())
+            conn.execute(f'INSERT OR IGNORE INTO split_target.{name} ({columns}) SELECT {columns} FROM main.{name}')
+            conn.execute(f'DROP TABLE main.{name}')
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@contextmanager
+def get_conn(immediate: bool = False, check_same_thread: bool = True, db: str = 'main'):
+    """Open a connection to one of DB_PATHS.
+
+    ``db='main'`` connections also attach the split messages/audit files, so unqualified
+    ``messages``/``audit_logs`` references keep working for reads and joins. Immediate
+    transactions skip the attach because BEGIN IMMEDIATE would reserve every attached file;
+    write split tables through their own ``db=`` connection instead.
+    """
+    # check_same_thread=False is for connections driven from a streaming generator,
+    # which Starlette may resume on a different threadpool thread for each chunk
+    conn = sqlite3.connect(DB_PATHS[db], check_same_thread=check_same_thread)
     conn.row_factory = sqlite3.Row
+    query_log = _query_log.get()
+    if query_log is not None:
+        conn.set_trace_callback(lambda sql: _record_query(query_log, sql))
+    if db == 'main' and not immediate:
+        attached = {DB_PATHS['main']}
+        for split_db, alias in ATTACH_AS.items():
+            if DB_PATHS[split_db] not in attached:
+                conn.execute(f'ATTACH DATABASE ? AS {alias}', (DB_PATHS[split_db],))
+                attached.add(DB_PATHS[split_db])
+    if immediate:
+        # take the write lock up front instead of upgrading a read lock mid-transaction
+        conn.execute('BEGIN IMMEDIATE')
     try:
         yield conn
         conn.commit()
     finally:
         conn.close()
+
+
+@contextmanager
+def track_queries():
+    """Collect the SQL statements run by connections opened inside this block (BEGIN/COMMIT excluded)."""
+    statements: list[str] = []
+    token = _query_log.set(statements)
+    try:
+        yield statements
+    finally:
+        _query_log.reset(token)
+
+
+def _record_query(query_log: list, sql: str) -> None:
+    if not sql.lstrip().upper().startswith(('BEGIN', 'COMMIT', 'ROLLBACK', 'ATTACH')):
+        query_log.append(sql)
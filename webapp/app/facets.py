@@ -0,0 +1,117 @@
+"""Precomputed facet counts for the lawyer directory.
+
+``lawyer_facets`` holds one row per (facet, value) with the number of active lawyers
+in the directory carrying that value: governorate, city, verification status and
+consultation-fee bucket, plus a ``total`` row. Every write that can move a lawyer
+between facet values runs inside ``facets_maintained``, which applies the
+before/after difference in the same transaction, so the search page reads exact
+counts from a handful of rows instead of grouping over every lawyer.
+"""
+from contextlib import contextmanager
+
+DEFAULT_FEE = 400
+# (label, low, high) inclusive; high None means open-ended
+FEE_BUCKETS = (
+    ('0-300', 0, 300),
+    ('301-500', 301, 500),
+    ('501-1000', 501, 1000),
+    ('1001-2000', 1001, 2000),
+    ('2001+', 2001, None),
+)
+FACETS = ('governorate', 'city', 'verified', 'fee')
+
+_DIRECTORY_SQL = f'''
+    SELECT u.id, u.is_verified, l.governorate, l.city, COALESCE(l.min_consultation_fee, {DEFAULT_FEE}) AS fee
+    FROM users u JOIN lawyers l ON l.user_id = u.id
+    WHERE u.user_type = 'lawyer' AND u.is_active = 1
+'''
+
+
+def fee_bucket(fee: int) -> str:
+    for label, low, high in FEE_BUCKETS:
+        if high is None or fee <= high:
+            return label
+    return FEE_BUCKETS[-1][0]
+
+
+def fee_bucket_bounds(label: str) -> tuple[int, int | None] | None:
+    for name, low, high in FEE_BUCKETS:
+        if name == label:
+            return low, high
+    return None
+
+
+def _facet_values(row) -> list[tuple[str, str]]:
+    values = [('total', ''), ('verified', '1' if row['is_verified'] else '0'), ('fee', fee_bucket(row['fee']))]
+    for facet in ('governorate', 'city'):
+        value = (row[facet] or '').strip()
+        if value:
+            values.append((facet, value))
+    return values
+
+
+def _directory_rows(conn, user_ids: list[int]) -> list:
+    placeholders = ','.join('?' * len(user_ids))
+    return conn.execute(f'{_DIRECTORY_SQL} AND u.id IN ({placeholders})', user_ids).fetchall()
+
+
+@contextmanager
+def facets_maintained(conn, user_ids):
+    """Wrap writes to these lawyers' users/lawyers rows; facet counts follow in the same transaction."""
+    user_ids = sorted({uid for uid in user_ids if uid is not None})
+    before = _directory_rows(conn, user_ids) if user_ids else []
+    yield
+    if not user_ids:
+        return
+    deltas: dict[tuple[str, str], int] = {}
+    for sign, rows in ((-1, before), (1, _directory_rows(conn, user_ids))):
+        for row in rows:
+            for key in _facet_values(row):
+                deltas[key] = deltas.get(key, 0) + sign
+    changed = [(facet, value, delta) for (facet, value), delta in deltas.items() if delta]
+    if changed:
+        conn.executemany(
+            '''
+            INSERT INTO lawyer_facets (facet, value, lawyer_count) VALUES (?, ?, ?)
+            ON CONFLICT (facet, value) DO UPDATE SET lawyer_count = lawyer_count + excluded.lawyer_count
+            ''',
+            changed,
+        )
+        conn.execute('DELETE FROM lawyer_facets WHERE lawyer_count <= 0')
+
+
+def rebuild_facets(conn) -> None:
+    """Recount every facet from scratch (backfill, or repair after out-of-band edits)."""
+    bucket_sql = 'CASE ' + ' '.join(
+        f"WHEN fee <= {high} THEN '{label}'" for label, _, high in FEE_BUCKETS if high is not None
+    ) + f" ELSE '{FEE_BUCKETS[-1][0]}' END"
+    conn.execute('DELETE FROM lawyer_facets')
+    conn.execute(
+        f'''
+        WITH d AS ({_DIRECTORY_SQL})
+        INSERT INTO lawyer_facets (facet, value, lawyer_count)
+        SELECT facet, value, COUNT(*) FROM (
+          SELECT 'total' AS facet, '' AS value FROM d
+          UNION ALL SELECT 'verified', CASE WHEN is_verified THEN '1' ELSE '0' END FROM d
+          UNION ALL SELECT 'fee', {bucket_sql} FROM d
+          UNION ALL SELECT 'governorate', trim(governorate) FROM d WHERE trim(COALESCE(governorate, '')) != ''
+          UNION ALL SELECT 'city', trim(city) FROM d WHERE trim(COALESCE(city, '')) != ''
+        )
+        GROUP BY facet, value
+        '''
+    )
+
+
+def load_facets(conn) -> dict:
+    """``{'total': n, 'governorate': [{'value', 'count'}, ...], ...}``, values by count then name."""
+    facets: dict = {'total': 0, **{facet: [] for facet in FACETS}}
+    rows = conn.execute('SELECT facet, value, lawyer_count FROM lawyer_facets ORDER BY facet, lawyer_count DESC, value').fetchall()
+    for row in rows:
+        if row[0] == 'total':
+            facets['total'] = row[2]
+        elif row[0] in facets:
+            facets[row[0]].append({'value': row[1], 'count': row[2]})
+    # fee buckets read better in price order than by size
+    order = {label: i for i, (label, _, _) in enumerate(FEE_BUCKETS)}
+    facets['fee'].sort(key=lambda item: order.get(item['value'], len(order)))
+    return facets
@@ -0,0 +1,123 @@
+"""Group commit: many callers' small inserts share one transaction and one fsync.
+
+Callers ``submit`` an item and block until the transaction holding it has committed,
+so each still gets its own result (e.g. the new row id) with the same durability as
+committing alone. A single writer thread per committer collects items for up to
+``max_wait_ms`` after the first arrives, or until ``max_batch`` are queued, then
+writes them all on one connection.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from typing import Callable
+
+from app.db import get_conn
+
+logger = logging.getLogger('hoqouqi.group_commit')
+
+
+class GroupCommitter:
+    def __init__(self, name: str, write_one: Callable, db: str = 'main', max_batch: int = 64, max_wait_ms: float = 2.0):
+        """``write_one(conn, item)`` performs one item's statements and returns its result."""
+        self.name = name
+        self.write_one = write_one
+        self.db = db
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.fallbacks = 0
+        self.batch_sizes: Counter = Counter()
+        self.commit_ms_total = 0.0
+        self.commit_ms_max = 0.0
+
+    def submit(self, item, timeout: float = 30.0):
+        """Queue ``item`` and wait until it is committed; returns ``write_one``'s result or raises its error."""
+        self._ensure_thread()
+        future: Future = Future()
+        self._queue.put((item, future))
+        return future.result(timeout)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name=f'hq-group-commit-{self.name}', daemon=True)
+                self._thread.start()
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            try:
+                with get_conn(db=self.db) as conn:
+                    results = [self.write_one(conn, item) for item, _ in batch]
+            except Exception:
+                # one bad item must not fail its neighbours: retry each in its own transaction
+                self._write_individually(batch)
+                continue
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+            self._record(len(batch), elapsed_ms)
+
+    def _write_individually(self, batch: list) -> None:
+        with self._stats_lock:
+            self.fallbacks += 1
+        for item, future in batch:
+            started = time.perf_counter()
+            try:
+                with get_conn(db=self.db) as conn:
+                    result = self.write_one(conn, item)
+            except Exception as exc:
+                logger.warning('%s write failed: %s', self.name, exc)
+                future.set_exception(exc)
+                continue
+            future.set_result(result)
+            self._record(1, (time.perf_counter() - started) * 1000)
+
+    def _record(self, size: int, elapsed_ms: float) -> None:
+        with self._stats_lock:
+            self.batches += 1
+            self.items += size
+            self.batch_sizes[size] += 1
+            self.commit_ms_total += elapsed_ms
+            self.commit_ms_max = max(self.commit_ms_max, elapsed_ms)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                'name': self.name,
+                'db': self.db,
+                'max_batch': self.max_batch,
+                'max_wait_ms': self.max_wait_ms,
+                'queued': self._queue.qsize(),
+                'batches': self.batches,
+                'items': self.items,
+                'avg_batch_size': round(self.items / self.batches, 2) if self.batches else 0,
+                'batch_sizes': dict(sorted(self.batch_sizes.items())),
+                'avg_commit_ms': round(self.commit_ms_total / self.batches, 3) if self.batches else 0,
+                'max_commit_ms': round(self.commit_ms_max, 3),
+                'fallbacks': self.fallbacks,
+            }
@@ -0,0 +1,59 @@
+"""Unread counters and the per-user inbox.
+
+``case_read_state`` holds one row per (user, case) with an unread count, a read cursor
+and the latest message preview. It lives beside ``messages`` and is updated in the
+same transaction as each insert, so the inbox is a single indexed read instead of a
+scan of every thread.
+"""
+PREVIEW_CHARS = 120
+INBOX_LIMIT = 100
+
+
+def record_message(conn, message_id: int, case_id: int, sender_user_id: int, receiver_user_id: int, content: str) -> None:
+    """Bump the receiver's unread count and refresh both participants' thread summary."""
+    preview = content[:PREVIEW_CHARS]
+    conn.executemany(
+        '''
+        INSERT INTO case_read_state
+          (user_id, case_id, unread_count, last_read_message_id, last_message_id, last_message_preview, last_message_at)
+        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (user_id, case_id) DO UPDATE SET
+          -- replying means the thread has been read
+          unread_count = CASE WHEN excluded.unread_count = 0 THEN 0 ELSE unread_count + 1 END,
+          last_read_message_id = MAX(last_read_message_id, excluded.last_read_message_id),
+          last_message_id = excluded.last_message_id,
+          last_message_preview = excluded.last_message_preview,
+          last_message_at = excluded.last_message_at
+        ''',
+        [
+            (receiver_user_id, case_id, 1, 0, message_id, preview),
+            (sender_user_id, case_id, 0, message_id, message_id, preview),
+        ],
+    )
+
+
+def mark_read(conn, user_id: int, case_id: int) -> bool:
+    """Move the user's read cursor to the newest message; returns False if nothing was unread."""
+    cur = conn.execute(
+        'UPDATE case_read_state SET unread_count = 0, last_read_message_id = last_message_id WHERE user_id = ? AND case_id = ? AND unread_count > 0',
+        (user_id, case_id),
+    )
+    return cur.rowcount > 0
+
+
+def load_inbox(conn, user_id: int, limit: int = INBOX_LIMIT) -> list[dict]:
+    """The user's cases, most recently active first, with unread counts and the latest message preview."""
+    rows = conn.execute(
+        '''
+        SELECT c.id, c.title, c.case_type, c.status, c.created_at, c.client_user_id, c.lawyer_user_id,
+               COALESCE(rs.unread_count, 0) AS unread_count,
+               rs.last_message_id, rs.last_message_preview, rs.last_message_at
+        FROM cases c
+        LEFT JOIN case_read_state rs ON rs.user_id = ? AND rs.case_id = c.id
+        WHERE c.client_user_id = ? OR c.lawyer_user_id = ?
+        ORDER BY COALESCE(rs.last_message_id, 0) DESC, c.id DESC
+        LIMIT ?
+        ''',
+        (user_id, user_id, user_id, limit),
+    ).fetchall()
+    return [dict(x) for x in rows]
@@ -0,0 +1,301 @@
+"""In-process background jobs backed by the SQLite ``jobs`` table.
+
+Jobs are rows, so they survive worker restarts: a worker claims a job by moving it
+to ``running`` with a ``locked_until`` visibility deadline, which it keeps renewing
+while the handler runs; a job whose deadline passes (its worker died) is picked up
+again by the next free worker. A claim is identified by ``(id, attempts)``, so a
+worker whose job was reclaimed finds its result discarded instead of overwriting the
+new claim's. Failures are retried with exponential backoff until ``max_attempts``.
+"""
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Callable
+
+from app.db import get_conn
+
+logger = logging.getLogger('hoqouqi.jobs')
+
+JOB_WORKERS = int(os.getenv('APP_JOB_WORKERS', '2'))
+JOB_POLL_SECONDS = float(os.getenv('APP_JOB_POLL_SECONDS', '0.5'))
+JOB_VISIBILITY_SECONDS = float(os.getenv('APP_JOB_VISIBILITY_SECONDS', '60'))
+# several renewals fit in one deadline, so a slow commit does not cost the lease
+JOB_HEARTBEAT_SECONDS = JOB_VISIBILITY_SECONDS / 3
+JOB_RETENTION_DAYS = float(os.getenv('APP_JOB_RETENTION_DAYS', '7'))
+JOB_PURGE_CHUNK = 5000
+JOB_BACKOFF_BASE_SECONDS = 2.0
+JOB_BACKOFF_MAX_SECONDS = 300.0
+
+HANDLERS: dict[str, Callable[[dict], object]] = {}
+RECURRING: dict[str, float] = {}
+
+
+def job_handler(kind: str, every_s: float | None = None):
+    """Register a handler; ``every_s`` makes the job re-queue itself that long after each final outcome."""
+    def register(fn):
+        HANDLERS[kind] = fn
+        if every_s:
+            RECURRING[kind] = every_s
+        return fn
+    return register
+
+
+def enqueue(kind: str, payload: dict | None = None, priority: int = 0, delay_s: float = 0, max_attempts: int = 5, conn=None) -> int:
+    """Queue a job and return its id; pass ``conn`` to enqueue inside the caller's transaction."""
+    if kind not in HANDLERS:
+        raise ValueError(f'Unknown job kind: {kind}')
+    now = time.time()
+    params = (kind, json.dumps(payload or {}, ensure_ascii=False), priority, max_attempts, now + delay_s, now)
+    sql = 'INSERT INTO jobs (kind, payload, priority, max_attempts, run_after, enqueued_at) VALUES (?, ?, ?, ?, ?, ?)'
+    if conn is not None:
+        job_id = conn.execute(sql, params).lastrowid
+    else:
+        with get_conn() as own_conn:
+            job_id = own_conn.execute(sql, params).lastrowid
+    RUNNER.wake()
+    return job_id
+
+
+def ensure_recurring_jobs() -> None:
+    """Queue one run of each recurring job kind that has nothing queued or running."""
+    active_sql = "SELECT DISTINCT kind FROM jobs WHERE status IN ('queued', 'running')"
+    # a restarting worker usually finds every kind queued: check without taking the write lock
+    with get_conn() as conn:
+        active = {row['kind'] for row in conn.execute(active_sql).fetchall()}
+    if active.issuperset(RECURRING):
+        return
+    now = time.time()
+    with get_conn(immediate=True) as conn:
+        active = {row['kind'] for row in conn.execute(active_sql).fetchall()}
+        for kind in RECURRING:
+            if kind not in active:
+                conn.execute(
+                    'INSERT INTO jobs (kind, payload, run_after, enqueued_at) VALUES (?, ?, ?, ?)',
+                    (kind, '{}', now, now),
+                )
+
+
+def get_job(job_id: int) -> dict | None:
+    with get_conn() as conn:
+        row = conn.execute('SELECT id, kind, payload, status, attempts, result, last_error, enqueued_at, finished_at FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    if not row:
+        return None
+    job = dict(row)
+    job['payload'] = json.loads(job['payload'])
+    job['result'] = json.loads(job['result']) if job['result'] is not None else None
+    return job
+
+
+def purge_finished_jobs(max_age_days: float = JOB_RETENTION_DAYS) -> int:
+    """Delete done/failed jobs older than ``max_age_days``, in short chunks; returns the number deleted."""
+    cutoff = time.time() - max_age_days * 86400
+    deleted = 0
+    while True:
+        with get_conn(immediate=True) as conn:
+            count = conn.execute(
+                '''
+                DELETE FROM jobs WHERE id IN (
+                  SELECT id FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ? LIMIT ?
+                )
+                ''',
+                (cutoff, JOB_PURGE_CHUNK),
+            ).rowcount
+        deleted += count
+        if count < JOB_PURGE_CHUNK:
+            return deleted
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(JOB_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), JOB_BACKOFF_MAX_SECONDS)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def _claim_next() -> dict | None:
+    now = time.time()
+    with get_conn(immediate=True) as conn:
+        row = conn.execute(
+            '''
+            UPDATE jobs
+            SET status = 'running', attempts = attempts + 1, locked_until = ?, started_at = ?
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE (status = 'queued' AND run_after <= ?) OR (status = 'running' AND locked_until < ?)
+                ORDER BY priority DESC, run_after ASC, id ASC
+                LIMIT 1
+            )
+            RETURNING id, kind, payload, attempts, max_attempts
+            ''',
+            (now + JOB_VISIBILITY_SECONDS, now, now, now),
+        ).fetchone()
+        return dict(row) if row else None
+
+
+def _renew_lease(job: dict) -> bool:
+    """Push the visibility deadline out again; False once the claim is no longer ours."""
+    with get_conn(immediate=True) as conn:
+        return conn.execute(
+            "UPDATE jobs SET locked_until = ? WHERE id = ? AND status = 'running' AND attempts = ?",
+            (time.time() + JOB_VISIBILITY_SECONDS, job['id'], job['attempts']),
+        ).rowcount > 0
+
+
+class _LeaseKeeper:
+    """Renews a claimed job's lease from a side thread for as long as its handler runs."""
+
+    def __init__(self, job: dict):
+        self.job = job
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"hq-job-lease-{job['id']}", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(JOB_HEARTBEAT_SECONDS):
+            try:
+                if not _renew_lease(self.job):
+                    logger.warning('job %s (%s) lost its lease; its result will be discarded', self.job['id'], self.job['kind'])
+                    return
+            except sqlite3.Error as exc:
+                # a busy database: the next beat still lands well inside the deadline
+                logger.warning('could not renew lease of job %s: %s', self.job['id'], exc)
+
+
+def _finish(job: dict, result=None, error: str | None = None) -> bool:
+    """Record the outcome of one claim; returns False when the job was reclaimed meanwhile."""
+    now = time.time()
+    final = error is None or job['attempts'] >= job['max_attempts']
+    claim = (job['id'], job['attempts'])
+    with get_conn(immediate=True) as conn:
+        if error is None:
+            cur = conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, locked_until = NULL, finished_at = ? WHERE id = ? AND status = 'running' AND attempts = ?",
+                (json.dumps(result, ensure_ascii=False), now, *claim),
+            )
+        elif final:
+            cur = conn.execute(
+                "UPDATE jobs SET status = 'failed', last_error = ?, locked_until = NULL, finished_at = ? WHERE id = ? AND status = 'running' AND attempts = ?",
+                (error, now, *claim),
+            )
+        else:
+            cur = conn.execute(
+                "UPDATE jobs SET status = 'queued', last_error = ?, locked_until = NULL, run_after = ? WHERE id = ? AND status = 'running' AND attempts = ?",
+                (error, now + _backoff(job['attempts']), *claim),
+            )
+        if not cur.rowcount:
+            logger.warning('job %s (%s) was reclaimed before attempt %s finished; outcome dropped', job['id'], job['kind'], job['attempts'])
+            return False
+        if final and job['kind'] in RECURRING:
+            # at most one pending run per kind, however many claims reach this point
+            conn.execute(
+                """
+                INSERT INTO jobs (kind, payload, run_after, enqueued_at)
+                SELECT ?, ?, ?, ?
+                WHERE NOT EXISTS (SELECT 1 FROM jobs WHERE kind = ? AND status IN ('queued', 'running'))
+                """,
+                (job['kind'], job['payload'], now + RECURRING[job['kind']], now, job['kind']),
+            )
+    return True
+
+
+def run_one() -> bool:
+    """Claim and run a single due job; returns False when nothing was due."""
+    job = _claim_next()
+    if not job:
+        return False
+    if job['attempts'] > job['max_attempts']:
+        # reclaimed after its visibility deadline with no attempts left
+        _finish(job, error='Visibility timeout expired on final attempt')
+        return True
+    handler = HANDLERS.get(job['kind'])
+    if handler is None:
+        _finish(job, error=f"No handler registered for {job['kind']}")
+        return True
+    try:
+        with _LeaseKeeper(job):
+            result = handler(json.loads(job['payload']))
+    except Exception as exc:
+        logger.warning('job %s (%s) failed on attempt %s: %s', job['id'], job['kind'], job['attempts'], exc)
+        _finish(job, error=f'{type(exc).__name__}: {exc}')
+    else:
+        _finish(job, result=result)
+    return True
+
+
+class JobRunner:
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.workers = workers
+        self._threads: list[threading.Thread] = []
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f'hq-job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if run_one():
+                    continue
+            except Exception:
+                logger.exception('job worker loop error')
+            self._wakeup.wait(JOB_POLL_SECONDS)
+            self._wakeup.clear()
+
+
+RUNNER = JobRunner()
+
+
+def queue_stats() -> dict:
+    now = time.time()
+    with get_conn() as conn:
+        by_status = conn.execute('SELECT kind, status, COUNT(*) c FROM jobs GROUP BY kind, status').fetchall()
+        oldest_queued = conn.execute("SELECT MIN(run_after) t FROM jobs WHERE status = 'queued' AND run_after <= ?", (now,)).fetchone()['t']
+        latency = conn.execute(
+            '''
+            SELECT kind, COUNT(*) c,
+                   AVG(started_at - enqueued_at) avg_wait_s, MAX(started_at - enqueued_at) max_wait_s,
+                   AVG(finished_at - started_at) avg_run_s, MAX(finished_at - started_at) max_run_s
+            FROM jobs
+            WHERE status = 'done' AND finished_at >= ?
+            GROUP BY kind
+            ''',
+            (now - 3600,),
+        ).fetchall()
+
+    depth: dict[str, dict[str, int]] = {}
+    for row in by_status:
+        depth.setdefault(row['kind'], {})[row['status']] = row['c']
+    return {
+        'workers': RUNNER.workers,
+        'handlers': sorted(HANDLERS),
+        'recurring': dict(RECURRING),
+        'depth': depth,
+        'oldest_due_age_s': round(now - oldest_queued, 3) if oldest_queued else 0,
+        'latency_last_hour': {row['kind']: {k: row[k] for k in row.keys() if k != 'kind'} for row in latency},
+    }
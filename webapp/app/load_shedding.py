@@ -0,0 +1,206 @@
+"""Per-route-group concurrency limits with bounded wait queues.
+
+Expensive routes (PBKDF2 login/registration, the AI assistant, admin pages and
+exports, the directory search) each get their own cap on concurrent requests. A
+request over the cap waits in a bounded FIFO queue; if the queue is full, or the
+wait exceeds the group's timeout, it is shed with ``503`` and ``Retry-After``
+instead of taking a worker thread from the cheap routes. Routes outside every
+group (health checks, message reads, ...) are never queued.
+
+The admin groups only count requests carrying a valid admin ``hq_session``, so
+anonymous traffic aimed at ``/admin`` cannot take the operators' slots; such
+requests pass straight through to the route, which rejects them. Streaming
+exports and the synchronous maintenance run hold a slot for their whole duration,
+so they have their own ``admin_long`` group and cannot starve the admin pages.
+
+Limits come from ``APP_ROUTE_LIMIT_<GROUP>`` as ``max_concurrent,max_queue,queue_timeout_s``.
+"""
+import asyncio
+import math
+import os
+import threading
+from collections import deque
+
+from fastapi.responses import JSONResponse
+from starlette.requests import cookie_parser
+
+from app.auth import verify_session_token
+
+DEFAULT_LIMITS = {
+    'auth': (4, 32, 5.0),
+    'ai': (4, 16, 10.0),
+    'admin': (4, 16, 10.0),
+    'admin_long': (2, 4, 5.0),
+    'search': (8, 32, 5.0),
+}
+
+# (group, method or None for any, path, prefix match)
+ROUTE_RULES = (
+    ('auth', 'POST', '/login', False),
+    ('auth', 'POST', '/register', False),
+    ('ai', 'POST', '/api/ai/assist', False),
+    ('search', 'GET', '/search', False),
+    ('admin_long', 'GET', '/api/admin/export/', True),
+    ('admin_long', 'POST', '/api/admin/maintenance/run', False),
+    ('admin', None, '/admin', True),
+    ('admin', None, '/api/admin/', True),
+)
+# always answered, so the metrics stay readable while admin routes are saturated
+EXEMPT_PATHS = {'/api/admin/load-shedding'}
+# groups whose slots are reserved for signed-in admins
+ADMIN_GROUPS = {'admin', 'admin_long'}
+
+
+def _limits_from_env(group: str) -> tuple[int, int, float]:
+    raw = os.getenv(f'APP_ROUTE_LIMIT_{group.upper()}', '').strip()
+    if not raw:
+        return DEFAULT_LIMITS[group]
+    max_concurrent, max_queue, queue_timeout_s = (part.strip() for part in raw.split(','))
+    return int(max_concurrent), int(max_queue), float(queue_timeout_s)
+
+
+def _wake(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class RouteLimiter:
+    """Slots are handed directly from a finishing request to the oldest waiter.
+
+    State is guarded by a thread lock rather than asyncio primitives because the app
+    can be driven from more than one event loop (WSGI adapter, test clients); waiters
+    are woken on their own loop with ``call_soon_threadsafe``.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout_s: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout_s = queue_timeout_s
+        self.retry_after = max(1, math.ceil(queue_timeout_s))
+        self._lock = threading.Lock()
+        self._waiters: deque[asyncio.Future] = deque()
+        self.active = 0
+        self.admitted = 0
+        self.queued = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+        self.peak_active = 0
+        self.peak_waiting = 0
+
+    async def acquire(self) -> str | None:
+        """Take a slot, waiting if needed; returns the shed reason instead when refused."""
+        with self._lock:
+            if self.active < self.max_concurrent and not self._waiters:
+                self._admit()
+                return None
+            if len(self._waiters) >= self.max_queue:
+                self.shed_queue_full += 1
+                return 'queue_full'
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            self.queued += 1
+            self.peak_waiting = max(self.peak_waiting, len(self._waiters))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout_s)
+            return None
+        except asyncio.TimeoutError:
+            with self._lock:
+                if future in self._waiters:
+                    self._waiters.remove(future)
+                    self.shed_timeout += 1
+                    return 'timeout'
+            # a slot was handed over just as the wait timed out: keep it
+            return None
+        except asyncio.CancelledError:
+            with self._lock:
+                if future in self._waiters:
+                    self._waiters.remove(future)
+                    raise
+            self.release()
+            raise
+
+    def _admit(self) -> None:
+        self.active += 1
+        self.admitted += 1
+        self.peak_active = max(self.peak_active, self.active)
+
+    def release(self) -> None:
+        with self._lock:
+            if self._waiters:
+                future = self._waiters.popleft()
+                # the slot passes to the waiter, so ``active`` is unchanged
+                self.admitted += 1
+                future.get_loop().call_soon_threadsafe(_wake, future)
+            else:
+                self.active -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'queue_timeout_s': self.queue_timeout_s,
+                'active': self.active,
+                'waiting': len(self._waiters),
+                'admitted': self.admitted,
+                'queued': self.queued,
+                'shed_queue_full': self.shed_queue_full,
+                'shed_timeout': self.shed_timeout,
+                'peak_active': self.peak_active,
+                'peak_waiting': self.peak_waiting,
+            }
+
+
+LIMITERS = {group: RouteLimiter(group, *_limits_from_env(group)) for group in DEFAULT_LIMITS}
+
+
+def limiter_for(method: str, path: str) -> RouteLimiter | None:
+    if path in EXEMPT_PATHS:
+        return None
+    for group, rule_method, rule_path, prefix in ROUTE_RULES:
+        if rule_method is not None and rule_method != method:
+            continue
+        if path == rule_path or (prefix and path.startswith(rule_path)):
+            return LIMITERS[group]
+    return None
+
+
+def _is_admin(scope) -> bool:
+    cookies = '; '.join(value.decode('latin-1') for name, value in scope['headers'] if name == b'cookie')
+    token = cookie_parser(cookies).get('hq_session') if cookies else None
+    user = verify_session_token(token) if token else None
+    return bool(user) and user['user_type'] == 'admin'
+
+
+def load_shedding_stats() -> dict:
+    return {group: limiter.stats() for group, limiter in LIMITERS.items()}
+
+
+class LoadSheddingMiddleware:
+    """Plain ASGI middleware, so streamed responses keep their slot until the last chunk."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        limiter = limiter_for(scope['method'], scope['path']) if scope['type'] == 'http' else None
+        if limiter is not None and limiter.name in ADMIN_GROUPS and not _is_admin(scope):
+            # not an admin: the route answers 401/403 (or the login redirect) cheaply
+            limiter = None
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+        reason = await limiter.acquire()
+        if reason is not None:
+            response = JSONResponse(
+                {'success': False, 'detail': 'Server is busy, please retry shortly', 'reason': reason},
+                status_code=503,
+                headers={'Retry-After': str(limiter.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
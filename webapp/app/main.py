@@ -1,34 +1,95 @@
+import hashlib
 import json
 import os
 import secrets
+import threading
 import time
-import urllib.error
-import urllib.request
 from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Literal
 
 from fastapi import FastAPI, Request, Form, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel, Field
 
-from app.db import init_db, get_conn
-from app.auth import hash_password, verify_password, create_session_token, verify_session_token, get_secret_key
+from app.audit import parse_timestamp, query_audit_logs, rollover_audit_logs
+from app.backups import BACKUP_INTERVAL_SECONDS, backup_settings, create_backup, list_backups, verify_backup
+from app.circuit import CircuitBreaker
+from app.case_views import MESSAGE_WINDOW, load_case_view
+from app.db import DB_PATHS, ensure_schema, get_conn, warm_connections
+from app.facets import DEFAULT_FEE, fee_bucket_bounds, facets_maintained, load_facets
+from app.group_commit import GroupCommitter
+from app.inbox import load_inbox, mark_read, record_message
+from app.load_shedding import LoadSheddingMiddleware, load_shedding_stats
+from app.jobs import RUNNER, enqueue, ensure_recurring_jobs, get_job, job_handler, queue_stats
+from app.maintenance import MAINTENANCE_INTERVAL_SECONDS, VACUUM_BUDGET_MS, database_status, recent_runs, run_maintenance
+from app.matching import LAWYER_INDEX, RECOMMEND_MAX
+from app.profiling import (
+    SETTINGS as PROFILING_SETTINGS, TOKEN_MAX_TTL_SECONDS, ProfiledRoute, ProfilingMiddleware, folded_stacks, issue_profile_token,
+    list_profiles, load_profile, merge_profiles, profiling_settings,
+)
+from app.responses import FastJSONResponse, fetch_records
+from app.search import SEARCH_MAX, search_cases
+from app.auth import (
+    create_csrf_token,
+    create_session_token,
+    get_secret_key,
+    hash_password,
+    verify_csrf_token,
+    verify_password,
+    verify_session_token,
+)
+from app.singleflight import SingleFlight
+from app.startup import FAST_START, STARTUP_REPORT, mark_ready, startup_phase
+from app.templating import FRAGMENTS, TEMPLATE_ENV, data_version, precompile_templates, template_cache_stats
+from app.transitions import TransitionError, assign_case_lawyer, transition_case_status, transition_payment
 
 app = FastAPI(title='Hoqouqi Python Edition')
+# set before any route is declared: sync endpoints join the profile of their request
+app.router.route_class = ProfiledRoute
+# added first so it sits inside load shedding: queued time is not sampled
+app.add_middleware(ProfilingMiddleware)
+app.add_middleware(LoadSheddingMiddleware)
 app.mount('/static', StaticFiles(directory='static'), name='static')
-templates = Jinja2Templates(directory='templates')
+templates = Jinja2Templates(env=TEMPLATE_ENV)
 
 RATE_BUCKETS: dict[str, deque] = defaultdict(deque)
 LOGIN_WINDOW_SECONDS = 60
 LOGIN_MAX_ATTEMPTS = 8
+AUDIT_ROLLOVER_INTERVAL_SECONDS = float(os.getenv('AUDIT_ROLLOVER_INTERVAL_SECONDS', str(24 * 3600)))
+MATCHING_REBUILD_INTERVAL_SECONDS = float(os.getenv('MATCHING_REBUILD_INTERVAL_SECONDS', '3600'))
+BATCH_MAX_ITEMS = 500
+# long-lived random id that anonymous CSRF tokens are bound to; set once, not on every render
+ANON_COOKIE = 'hq_anon'
+ANON_COOKIE_MAX_AGE = 60 * 60 * 24 * 365
+CSRF_PLACEHOLDER = '\x00csrf\x00'
+# explicit column lists for the JSON list endpoints
+CASE_COLUMNS = 'id, client_user_id, lawyer_user_id, title, case_type, description, status, created_at'
+PAYMENT_COLUMNS = 'id, case_id, client_user_id, lawyer_user_id, amount, status, escrow_status, transaction_ref, notes, created_at, updated_at'
+MESSAGE_COLUMNS = 'id, case_id, sender_user_id, receiver_user_id, content, created_at'
 AI_DEFAULT_POLICY = [
     'قدّم معلومات قانونية عامة داخل مصر فقط ولا تقدّم تمثيلاً قانونياً.',
     'لا تقدّم رأياً قانونياً نهائياً أو وعداً بنتيجة القضية.',
     'عند الحاجة يجب توجيه المستخدم لمحامٍ مرخّص داخل المنصة.',
     'احمِ خصوصية البيانات وتجنب طلب بيانات حساسة غير لازمة.',
 ]
+AI_REQUEST_DEADLINE_SECONDS = float(os.getenv('AI_REQUEST_DEADLINE_SECONDS', '8'))
+AI_BREAKER = CircuitBreaker(
+    'gemini',
+    failure_rate=float(os.getenv('AI_BREAKER_FAILURE_RATE', '0.5')),
+    slow_call_seconds=float(os.getenv('AI_BREAKER_SLOW_SECONDS', '5')),
+    min_calls=int(os.getenv('AI_BREAKER_MIN_CALLS', '5')),
+    open_seconds=float(os.getenv('AI_BREAKER_OPEN_SECONDS', '30')),
+)
+AI_SINGLE_FLIGHT = SingleFlight()
+# provider calls run here so the caller can stop waiting at the deadline whatever the socket does
+AI_CALL_WORKERS = 8
+AI_CALL_POOL = ThreadPoolExecutor(max_workers=AI_CALL_WORKERS, thread_name_prefix='ai-call')
+# one per pool worker, held until the fetch itself ends (even past a caller's timeout), so a
+# call is only submitted when a worker is free and its deadline never includes queueing
+AI_CALL_SLOTS = threading.BoundedSemaphore(AI_CALL_WORKERS)
 
 
 def is_secure_cookie_enabled() -> bool:
@@ -49,13 +110,18 @@ def _check_rate_limit(key: str, limit: int = LOGIN_MAX_ATTEMPTS, window_s: int =
     q.append(now)
 
 
-def issue_csrf_token() -> str:
-    return secrets.token_urlsafe(32)
+def _csrf_subject(request: Request) -> str | None:
+    """What CSRF tokens are bound to: the session when logged in, otherwise the anonymous visitor id."""
+    session = request.cookies.get('hq_session')
+    if session and verify_session_token(session):
+        return 'session:' + hashlib.sha256(session.encode()).hexdigest()
+    anon_id = request.cookies.get(ANON_COOKIE)
+    return f'anon:{anon_id}' if anon_id else None
 
 
 def verify_csrf(request: Request, form_token: str) -> None:
-    cookie_token = request.cookies.get('hq_csrf')
-    if not cookie_token or not form_token or cookie_token != form_token:
+    subject = _csrf_subject(request)
+    if not subject or not form_token or not verify_csrf_token(form_token, subject):
         raise HTTPException(status_code=403, detail='CSRF validation failed')
 
 
@@ -76,11 +142,59 @@ def require_user(request: Request, allowed=None):
 
 
 def log_action(actor_user_id: int | None, action: str, target_type: str | None = None, target_id: int | None = None, metadata: dict | None = None):
-    with get_conn() as conn:
-        conn.execute(
-            'INSERT INTO audit_logs (actor_user_id, action, target_type, target_id, metadata) VALUES (?, ?, ?, ?, ?)',
-            (actor_user_id, action, target_type, target_id, json.dumps(metadata or {}, ensure_ascii=False)),
-        )
+    with get_conn(db='audit') as conn:
+        log_actions(conn, [(actor_user_id, action, target_type, target_id, metadata)])
+
+
+def log_actions(conn, entries: list[tuple]) -> None:
+    """Write many audit rows with a single executemany; ``conn`` must be a ``get_conn(db='audit')`` connection."""
+    conn.executemany(
+        'INSERT INTO audit_logs (actor_user_id, action, target_type, target_id, metadata) VALUES (?, ?, ?, ?, ?)',
+        [
+            (actor_user_id, action, target_type, target_id, json.dumps(metadata or {}, ensure_ascii=False))
+            for actor_user_id, action, target_type, target_id, metadata in entries
+        ],
+    )
+
+
+def _insert_message(conn, row: tuple) -> int:
+    msg_id = conn.execute(
+        'INSERT INTO messages (case_id, sender_user_id, receiver_user_id, content) VALUES (?, ?, ?, ?)',
+        row,
+    ).lastrowid
+    record_message(conn, msg_id, *row)
+    return msg_id
+
+
+# a sent message and its audit row share one transaction when both tables live in the same file
+AUDIT_WITH_MESSAGES = DB_PATHS['audit'] == DB_PATHS['messages']
+
+
+def _send_message_row(conn, row: tuple) -> int:
+    msg_id = _insert_message(conn, row)
+    if AUDIT_WITH_MESSAGES:
+        log_actions(conn, [(row[1], 'message.sent', 'message', msg_id, {'case_id': row[0]})])
+    return msg_id
+
+
+def _insert_audit_row(conn, entry: tuple) -> None:
+    log_actions(conn, [entry])
+
+
+MESSAGE_WRITER = GroupCommitter(
+    'messages',
+    _send_message_row,
+    db='messages',
+    max_batch=int(os.getenv('APP_WRITE_BATCH_SIZE', '64')),
+    max_wait_ms=float(os.getenv('APP_WRITE_BATCH_WAIT_MS', '2')),
+)
+AUDIT_WRITER = GroupCommitter(
+    'audit',
+    _insert_audit_row,
+    db='audit',
+    max_batch=int(os.getenv('APP_WRITE_BATCH_SIZE', '64')),
+    max_wait_ms=float(os.getenv('APP_WRITE_BATCH_WAIT_MS', '2')),
+)
 
 
 def is_case_participant(conn, case_id: int, user_id: int) -> bool:
@@ -91,17 +205,46 @@ def is_case_participant(conn, case_id: int, user_id: int) -> bool:
 
 
 def _render_with_csrf(template_name: str, request: Request, context: dict | None = None):
-    payload = {'request': request, 'user': current_user(request)}
-    if context:
-        payload.update(context)
-    payload.setdefault('user', current_user(request))
-    csrf_token = issue_csrf_token()
-    payload['csrf_token'] = csrf_token
-    response = templates.TemplateResponse(template_name, payload)
-    response.set_cookie('hq_csrf', csrf_token, httponly=True, samesite='lax', secure=is_secure_cookie_enabled(), max_age=3600)
+    user = current_user(request)
+    subject = _csrf_subject(request)
+    new_anon_id = None
+    if subject is None:
+        new_anon_id = secrets.token_urlsafe(24)
+        subject = f'anon:{new_anon_id}'
+    csrf_token = create_csrf_token(subject)
+    template = TEMPLATE_ENV.get_template(template_name)
+    if user is None and context is None:
+        # anonymous form pages (login, register) are the same for every visitor but the token:
+        # render once per template (a reload yields a new template object, hence a new key)
+        key = ('csrf-page', template, request.url.path)
+        page = FRAGMENTS.get(key)
+        if page is None:
+            page = template.render({'request': request, 'user': None, 'csrf_token': CSRF_PLACEHOLDER})
+            FRAGMENTS.set(key, page)
+        body = page.replace(CSRF_PLACEHOLDER, csrf_token)
+    else:
+        payload = {'request': request, 'user': user}
+        if context:
+            payload.update(context)
+        payload['csrf_token'] = csrf_token
+        body = template.render(payload)
+    response = _revalidated_html(request, body)
+    if new_anon_id:
+        response.set_cookie(ANON_COOKIE, new_anon_id, httponly=True, samesite='lax', secure=is_secure_cookie_enabled(), max_age=ANON_COOKIE_MAX_AGE)
     return response
 
 
+def _revalidated_html(request: Request, body: str) -> Response:
+    """HTML with a content ETag; a repeat view within one token step gets an empty 304."""
+    encoded = body.encode()
+    etag = '"' + hashlib.sha256(encoded).hexdigest()[:32] + '"'
+    # private: the page embeds a token bound to this visitor
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(encoded, headers=headers)
+
+
 class CaseCreatePayload(BaseModel):
     title: str = Field(min_length=3, max_length=180)
     case_type: str = Field(min_length=2, max_length=80)
@@ -132,21 +275,87 @@ class PaymentActionPayload(BaseModel):
     notes: str | None = Field(default=None, max_length=1000)
 
 
+class PaymentBatchItem(PaymentActionPayload):
+    payment_id: int
+    action: Literal['process', 'release', 'refund']
+
+
+class PaymentBatchPayload(BaseModel):
+    items: list[PaymentBatchItem] = Field(min_length=1, max_length=BATCH_MAX_ITEMS)
+
+
+class LawyerReviewBatchItem(LawyerReviewPayload):
+    request_id: int
+
+
+class LawyerReviewBatchPayload(BaseModel):
+    items: list[LawyerReviewBatchItem] = Field(min_length=1, max_length=BATCH_MAX_ITEMS)
+
+
 class MessagePayload(BaseModel):
     case_id: int
     receiver_user_id: int
     content: str = Field(min_length=1, max_length=3000)
 
 
+class ProfileUpdatePayload(BaseModel):
+    full_name: str | None = Field(default=None, min_length=2, max_length=120)
+    bio: str | None = Field(default=None, max_length=2000)
+    governorate: str | None = Field(default=None, max_length=80)
+    city: str | None = Field(default=None, max_length=80)
+    min_consultation_fee: int | None = Field(default=None, ge=0)
+
+
+class ProfilingSettingsPayload(BaseModel):
+    sample_rate: float = Field(ge=0, le=1)
+    path_prefix: str | None = Field(default=None, max_length=200)
+
+
+class MaintenanceRunPayload(BaseModel):
+    full: bool = True
+    vacuum_budget_ms: float = Field(default=VACUUM_BUDGET_MS, gt=0, le=60_000)
+
+
+class ProfileTokenPayload(BaseModel):
+    ttl_seconds: int = Field(default=600, ge=1, le=TOKEN_MAX_TTL_SECONDS)
+
+
 class AIAssistPayload(BaseModel):
     question: str = Field(min_length=5, max_length=3000)
     policy_rules: list[str] | None = None
+    defer: bool = False
+
+
+@app.exception_handler(TransitionError)
+def transition_error_handler(request: Request, exc: TransitionError):
+    content = {'detail': exc.detail}
+    if exc.current is not None:
+        content['current'] = exc.current
+    return JSONResponse(content, status_code=exc.status_code)
 
 
 @app.on_event('startup')
 def startup() -> None:
-    get_secret_key()
-    init_db()
+    if STARTUP_REPORT['ready_at']:
+        return
+    with startup_phase('secret_key'):
+        get_secret_key()
+    with startup_phase('schema'):
+        STARTUP_REPORT['schema_applied'] = ensure_schema(fast=FAST_START)
+    with startup_phase('templates'):
+        precompile_templates()
+    with startup_phase('connections'):
+        warm_connections()
+    with startup_phase('recurring_jobs'):
+        ensure_recurring_jobs()
+    if RUNNER.workers > 0:
+        RUNNER.start()
+    mark_ready()
+
+
+@app.on_event('shutdown')
+def shutdown() -> None:
+    RUNNER.stop()
 
 
 @app.get('/', response_class=HTMLResponse)
@@ -191,10 +400,11 @@ def register(
         user_id = cur.lastrowid
 
         if user_type == 'lawyer':
-            conn.execute(
-                'INSERT INTO lawyers (user_id, bar_registration_number) VALUES (?, ?)',
-                (user_id, bar_registration_number.strip()),
-            )
+            with facets_maintained(conn, [user_id]):
+                conn.execute(
+                    'INSERT INTO lawyers (user_id, bar_registration_number) VALUES (?, ?)',
+                    (user_id, bar_registration_number.strip()),
+                )
             conn.execute(
                 'INSERT INTO lawyer_verification_requests (lawyer_user_id, bar_registration_number) VALUES (?, ?)',
                 (user_id, bar_registration_number.strip() or 'PENDING'),
@@ -244,7 +454,6 @@ def logout(request: Request):
     user = current_user(request)
     response = RedirectResponse('/', status_code=303)
     response.delete_cookie('hq_session')
-    response.delete_cookie('hq_csrf')
     if user:
         log_action(user['user_id'], 'user.logout', 'user', user['user_id'])
     return response
@@ -255,25 +464,63 @@ def dashboard(request: Request):
     user = require_user(request, ['client', 'lawyer', 'admin'])
     with get_conn() as conn:
         me = conn.execute('SELECT id, full_name, email, user_type, is_verified FROM users WHERE id = ?', (user['user_id'],)).fetchone()
-        cases = conn.execute(
-            'SELECT * FROM cases WHERE client_user_id = ? OR lawyer_user_id = ? ORDER BY id DESC LIMIT 20',
-            (user['user_id'], user['user_id']),
-        ).fetchall()
-    return templates.TemplateResponse('dashboard.html', {'request': request, 'user': dict(me), 'cases': [dict(x) for x in cases]})
+        cases = load_inbox(conn, user['user_id'], limit=20)
+    return templates.TemplateResponse('dashboard.html', {
+        'request': request,
+        'user': dict(me),
+        'cases': cases,
+        'unread_total': sum(c['unread_count'] for c in cases),
+    })
 
 
 @app.get('/search', response_class=HTMLResponse)
-def search_page(request: Request):
+def search_page(request: Request, governorate: str | None = None, city: str | None = None, verified: str | None = None, fee: str | None = None):
+    where = ["u.user_type = 'lawyer'", 'u.is_active = 1']
+    params: list = []
+    if governorate:
+        where.append('trim(l.governorate) = ?')
+        params.append(governorate.strip())
+    if city:
+        where.append('trim(l.city) = ?')
+        params.append(city.strip())
+    if verified in ('0', '1'):
+        where.append('u.is_verified = ?')
+        params.append(int(verified))
+    bounds = fee_bucket_bounds(fee) if fee else None
+    if bounds:
+        where.append(f'COALESCE(l.min_consultation_fee, {DEFAULT_FEE}) >= ?')
+        params.append(bounds[0])
+        if bounds[1] is not None:
+            where.append(f'COALESCE(l.min_consultation_fee, {DEFAULT_FEE}) <= ?')
+            params.append(bounds[1])
+
     with get_conn() as conn:
+        # read before the rows: a concurrent write then re-keys the cards instead of caching stale ones
+        cards_version = data_version(conn, 'users', 'lawyers')
         lawyers = conn.execute(
-            '''
+            f'''
             SELECT u.id, u.full_name, l.bar_registration_number, l.min_consultation_fee, l.city, l.governorate, u.is_verified
             FROM users u JOIN lawyers l ON l.user_id = u.id
-            WHERE u.user_type = 'lawyer' AND u.is_active = 1
+            WHERE {' AND '.join(where)}
             ORDER BY u.is_verified DESC, u.id DESC
-            '''
+            ''',
+            params,
         ).fetchall()
-    return templates.TemplateResponse('search.html', {'request': request, 'lawyers': [dict(x) for x in lawyers], 'user': current_user(request)})
+        facets = load_facets(conn)
+    return templates.TemplateResponse('search.html', {
+        'cards_version': cards_version,
+        'request': request,
+        'lawyers': [dict(x) for x in lawyers],
+        'user': current_user(request),
+        'facets': facets,
+        'selected': {'governorate': governorate, 'city': city, 'verified': verified, 'fee': fee if bounds else None},
+    })
+
+
+@app.get('/api/lawyers/facets')
+def lawyer_facets():
+    with get_conn() as conn:
+        return {'success': True, 'data': load_facets(conn)}
 
 
 @app.get('/api/health')
@@ -294,6 +541,7 @@ def config_health(request: Request):
         'data': {
             'cookie_secure': is_secure_cookie_enabled(),
             'db_path': os.getenv('APP_DB_PATH', 'hoqouqi.db'),
+            'db_paths': DB_PATHS,
             'ai_configured': bool(os.getenv('GEMINI_API_KEY')),
             'secret_loaded': bool(get_secret_key()),
             'viewer': user,
@@ -326,44 +574,73 @@ def list_cases(request: Request):
     user = require_user(request, ['client', 'lawyer', 'admin'])
     with get_conn() as conn:
         if user['user_type'] == 'admin':
-            rows = conn.execute('SELECT * FROM cases ORDER BY id DESC LIMIT 100').fetchall()
+            rows = fetch_records(conn, f'SELECT {CASE_COLUMNS} FROM cases ORDER BY id DESC LIMIT 100')
         else:
-            rows = conn.execute(
-                'SELECT * FROM cases WHERE client_user_id = ? OR lawyer_user_id = ? ORDER BY id DESC LIMIT 100',
+            rows = fetch_records(
+                conn,
+                f'SELECT {CASE_COLUMNS} FROM cases WHERE client_user_id = ? OR lawyer_user_id = ? ORDER BY id DESC LIMIT 100',
                 (user['user_id'], user['user_id']),
-            ).fetchall()
-    return {'success': True, 'data': [dict(x) for x in rows]}
+            )
+    return FastJSONResponse({'success': True, 'data': rows})
+
+
+@app.get('/api/search/cases')
+def search_my_cases(request: Request, q: str, limit: int = 20):
+    user = require_user(request, ['client', 'lawyer', 'admin'])
+    if not 1 <= len(q.strip()) <= 200:
+        raise HTTPException(status_code=400, detail='Invalid search query')
+    with get_conn() as conn:
+        rows = search_cases(conn, user['user_id'], q, min(max(limit, 1), SEARCH_MAX))
+    return {'success': True, 'data': rows}
 
 
 @app.post('/api/cases/{case_id}/assign')
 def assign_case(request: Request, case_id: int, payload: CaseAssignPayload):
     user = require_user(request, ['admin'])
-    with get_conn() as conn:
-        case = conn.execute('SELECT * FROM cases WHERE id = ?', (case_id,)).fetchone()
+    with get_conn(immediate=True) as conn:
         lawyer = conn.execute('SELECT id, user_type, is_active, is_verified FROM users WHERE id = ?', (payload.lawyer_user_id,)).fetchone()
-        if not case:
-            raise HTTPException(status_code=404, detail='Case not found')
         if not lawyer or lawyer['user_type'] != 'lawyer' or lawyer['is_active'] != 1:
             raise HTTPException(status_code=400, detail='Invalid lawyer')
 
-        conn.execute('UPDATE cases SET lawyer_user_id = ?, status = ? WHERE id = ?', (payload.lawyer_user_id, 'accepted', case_id))
+        previous = conn.execute('SELECT lawyer_user_id FROM cases WHERE id = ?', (case_id,)).fetchone()
+        assign_case_lawyer(conn, case_id, payload.lawyer_user_id)
 
+    LAWYER_INDEX.refresh_lawyers([payload.lawyer_user_id, previous['lawyer_user_id'] if previous else None])
     log_action(user['user_id'], 'case.assigned', 'case', case_id, {'lawyer_user_id': payload.lawyer_user_id})
     return {'success': True, 'message': 'Case assigned'}
 
 
+@app.get('/api/cases/{case_id}/lawyer-recommendations')
+def case_lawyer_recommendations(request: Request, case_id: int, governorate: str | None = None, city: str | None = None, max_fee: int | None = None, limit: int = 10):
+    user = require_user(request, ['client', 'admin'])
+    with get_conn() as conn:
+        case = conn.execute('SELECT client_user_id, lawyer_user_id, case_type FROM cases WHERE id = ?', (case_id,)).fetchone()
+    if not case:
+        raise HTTPException(status_code=404, detail='Case not found')
+    if user['user_type'] != 'admin' and case['client_user_id'] != user['user_id']:
+        raise HTTPException(status_code=403, detail='Forbidden')
+    exclude = (case['lawyer_user_id'],) if case['lawyer_user_id'] else ()
+    rows = LAWYER_INDEX.recommend(case['case_type'], governorate, city, max_fee, limit, exclude=exclude)
+    return {'success': True, 'data': rows}
+
+
+@app.get('/api/lawyers/recommendations')
+def lawyer_recommendations(request: Request, case_type: str, governorate: str | None = None, city: str | None = None, max_fee: int | None = None, limit: int = 10):
+    require_user(request, ['client', 'admin'])
+    if not 2 <= len(case_type.strip()) <= 80:
+        raise HTTPException(status_code=400, detail='Invalid case type')
+    rows = LAWYER_INDEX.recommend(case_type, governorate, city, max_fee, min(limit, RECOMMEND_MAX))
+    return {'success': True, 'data': rows}
+
+
 @app.post('/api/cases/{case_id}/status')
 def update_case_status(request: Request, case_id: int, payload: CaseStatusPayload):
     user = require_user(request, ['client', 'lawyer', 'admin'])
-    with get_conn() as conn:
-        case = conn.execute('SELECT * FROM cases WHERE id = ?', (case_id,)).fetchone()
-        if not case:
-            raise HTTPException(status_code=404, detail='Case not found')
+    participant_user_id = None if user['user_type'] == 'admin' else user['user_id']
+    with get_conn(immediate=True) as conn:
+        case = transition_case_status(conn, case_id, payload.status, participant_user_id)
 
-        if user['user_type'] != 'admin' and user['user_id'] not in {case['client_user_id'], case['lawyer_user_id']}:
-            raise HTTPException(status_code=403, detail='Forbidden')
-
-        conn.execute('UPDATE cases SET status = ? WHERE id = ?', (payload.status, case_id))
+    LAWYER_INDEX.refresh_lawyers([case['lawyer_user_id']])
 
     log_action(user['user_id'], 'case.status_updated', 'case', case_id, {'status': payload.status})
     return {'success': True, 'message': 'Case status updated'}
@@ -397,27 +674,20 @@ def list_payments(request: Request):
     user = require_user(request, ['client', 'lawyer', 'admin'])
     with get_conn() as conn:
         if user['user_type'] == 'admin':
-            rows = conn.execute('SELECT * FROM payments ORDER BY id DESC LIMIT 100').fetchall()
+            rows = fetch_records(conn, f'SELECT {PAYMENT_COLUMNS} FROM payments ORDER BY id DESC LIMIT 100')
         elif user['user_type'] == 'client':
-            rows = conn.execute('SELECT * FROM payments WHERE client_user_id = ? ORDER BY id DESC LIMIT 100', (user['user_id'],)).fetchall()
+            rows = fetch_records(conn, f'SELECT {PAYMENT_COLUMNS} FROM payments WHERE client_user_id = ? ORDER BY id DESC LIMIT 100', (user['user_id'],))
         else:
-            rows = conn.execute('SELECT * FROM payments WHERE lawyer_user_id = ? ORDER BY id DESC LIMIT 100', (user['user_id'],)).fetchall()
-    return {'success': True, 'data': [dict(x) for x in rows]}
+            rows = fetch_records(conn, f'SELECT {PAYMENT_COLUMNS} FROM payments WHERE lawyer_user_id = ? ORDER BY id DESC LIMIT 100', (user['user_id'],))
+    return FastJSONResponse({'success': True, 'data': rows})
 
 
 @app.post('/api/payments/{payment_id}/process')
 def process_payment(request: Request, payment_id: int, payload: PaymentActionPayload):
     user = require_user(request, ['admin'])
-    with get_conn() as conn:
-        payment = conn.execute('SELECT * FROM payments WHERE id = ?', (payment_id,)).fetchone()
-        if not payment:
-            raise HTTPException(status_code=404, detail='Payment not found')
-
-        txn_ref = payload.transaction_ref or f'TXN-{payment_id}-{int(time.time())}'
-        conn.execute(
-            'UPDATE payments SET status = ?, transaction_ref = ?, notes = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
-            ('paid', txn_ref, payload.notes, payment_id),
-        )
+    txn_ref = payload.transaction_ref or f'TXN-{payment_id}-{int(time.time())}'
+    with get_conn(immediate=True) as conn:
+        transition_payment(conn, payment_id, 'process', txn_ref, payload.notes)
 
     log_action(user['user_id'], 'payment.processed', 'payment', payment_id, {'transaction_ref': payload.transaction_ref})
     return {'success': True, 'message': 'Payment processed'}
@@ -426,17 +696,8 @@ def process_payment(request: Request, payment_id: int, payload: PaymentActionPay
 @app.post('/api/payments/{payment_id}/release')
 def release_payment(request: Request, payment_id: int, payload: PaymentActionPayload):
     user = require_user(request, ['admin'])
-    with get_conn() as conn:
-        payment = conn.execute('SELECT * FROM payments WHERE id = ?', (payment_id,)).fetchone()
-        if not payment:
-            raise HTTPException(status_code=404, detail='Payment not found')
-        if payment['status'] != 'paid':
-            raise HTTPException(status_code=400, detail='Only paid payments can be released')
-
-        conn.execute(
-            'UPDATE payments SET escrow_status = ?, notes = COALESCE(?, notes), updated_at = CURRENT_TIMESTAMP WHERE id = ?',
-            ('released', payload.notes, payment_id),
-        )
+    with get_conn(immediate=True) as conn:
+        transition_payment(conn, payment_id, 'release', notes=payload.notes)
 
     log_action(user['user_id'], 'payment.released', 'payment', payment_id)
     return {'success': True, 'message': 'Payment released to lawyer'}
@@ -445,20 +706,44 @@ def release_payment(request: Request, payment_id: int, payload: PaymentActionPay
 @app.post('/api/payments/{payment_id}/refund')
 def refund_payment(request: Request, payment_id: int, payload: PaymentActionPayload):
     user = require_user(request, ['admin'])
-    with get_conn() as conn:
-        payment = conn.execute('SELECT * FROM payments WHERE id = ?', (payment_id,)).fetchone()
-        if not payment:
-            raise HTTPException(status_code=404, detail='Payment not found')
-
-        conn.execute(
-            'UPDATE payments SET status = ?, escrow_status = ?, notes = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
-            ('refunded', 'returned', payload.notes, payment_id),
-        )
+    with get_conn(immediate=True) as conn:
+        transition_payment(conn, payment_id, 'refund', notes=payload.notes)
 
     log_action(user['user_id'], 'payment.refunded', 'payment', payment_id)
     return {'success': True, 'message': 'Payment refunded'}
 
 
+@app.post('/api/admin/payments/batch')
+def batch_payment_actions(request: Request, payload: PaymentBatchPayload):
+    admin = require_user(request, ['admin'])
+    results = []
+    audit_entries = []
+    audit_actions = {'process': 'payment.processed', 'release': 'payment.released', 'refund': 'payment.refunded'}
+
+    with get_conn(immediate=True) as conn:
+        for item in payload.items:
+            txn_ref = None
+            if item.action == 'process':
+                txn_ref = item.transaction_ref or f'TXN-{item.payment_id}-{int(time.time())}'
+            try:
+                row = transition_payment(conn, item.payment_id, item.action, txn_ref, item.notes)
+            except TransitionError as exc:
+                results.append({'payment_id': item.payment_id, 'action': item.action, 'success': False, 'error': exc.detail, 'current': exc.current})
+                continue
+            metadata = {'batch': True}
+            if item.action == 'process':
+                metadata['transaction_ref'] = item.transaction_ref
+            audit_entries.append((admin['user_id'], audit_actions[item.action], 'payment', item.payment_id, metadata))
+            results.append({'payment_id': item.payment_id, 'action': item.action, 'success': True, 'status': row['status'], 'escrow_status': row['escrow_status']})
+
+    if audit_entries:
+        with get_conn(db='audit') as conn:
+            log_actions(conn, audit_entries)
+
+    applied = len(audit_entries)
+    return {'success': True, 'data': {'applied': applied, 'failed': len(results) - applied, 'results': results}}
+
+
 @app.post('/api/messages')
 def send_message(request: Request, payload: MessagePayload):
     user = require_user(request, ['client', 'lawyer', 'admin'])
@@ -474,13 +759,11 @@ def send_message(request: Request, payload: MessagePayload):
         if user['user_type'] != 'admin' and payload.receiver_user_id not in {case['client_user_id'], case['lawyer_user_id']}:
             raise HTTPException(status_code=400, detail='Receiver must be case participant')
 
-        cur = conn.execute(
-            'INSERT INTO messages (case_id, sender_user_id, receiver_user_id, content) VALUES (?, ?, ?, ?)',
-            (payload.case_id, user['user_id'], payload.receiver_user_id, payload.content.strip()),
-        )
-        msg_id = cur.lastrowid
-
-    log_action(user['user_id'], 'message.sent', 'message', msg_id, {'case_id': payload.case_id})
+    # group-committed with other concurrent sends; returns once durable, with the audit row
+    # in the same transaction unless audit_logs has its own file
+    msg_id = MESSAGE_WRITER.submit((payload.case_id, user['user_id'], payload.receiver_user_id, payload.content.strip()))
+    if not AUDIT_WITH_MESSAGES:
+        AUDIT_WRITER.submit((user['user_id'], 'message.sent', 'message', msg_id, {'case_id': payload.case_id}))
     return JSONResponse({'success': True, 'data': {'message_id': msg_id}}, status_code=201)
 
 
@@ -490,11 +773,29 @@ def list_messages(request: Request, case_id: int):
     with get_conn() as conn:
         if user['user_type'] != 'admin' and not is_case_participant(conn, case_id, user['user_id']):
             raise HTTPException(status_code=403, detail='Forbidden')
-        rows = conn.execute(
-            'SELECT * FROM messages WHERE case_id = ? ORDER BY id ASC LIMIT 500',
-            (case_id,),
-        ).fetchall()
-    return {'success': True, 'data': [dict(x) for x in rows]}
+        rows = fetch_records(conn, f'SELECT {MESSAGE_COLUMNS} FROM messages WHERE case_id = ? ORDER BY id ASC LIMIT 500', (case_id,))
+        unread = conn.execute('SELECT unread_count FROM case_read_state WHERE user_id = ? AND case_id = ?', (user['user_id'], case_id)).fetchone()
+    # polls with nothing unread stay read-only and never take the messages write lock
+    if unread and unread['unread_count']:
+        with get_conn(db='messages') as conn:
+            mark_read(conn, user['user_id'], case_id)
+    return FastJSONResponse({'success': True, 'data': rows})
+
+
+@app.post('/api/messages/{case_id}/read')
+def mark_messages_read(request: Request, case_id: int):
+    user = require_user(request, ['client', 'lawyer', 'admin'])
+    with get_conn(db='messages') as conn:
+        changed = mark_read(conn, user['user_id'], case_id)
+    return {'success': True, 'data': {'marked_read': changed}}
+
+
+@app.get('/api/inbox')
+def inbox(request: Request, limit: int = 100):
+    user = require_user(request, ['client', 'lawyer', 'admin'])
+    with get_conn() as conn:
+        rows = load_inbox(conn, user['user_id'], limit=min(max(limit, 1), 200))
+    return {'success': True, 'data': rows, 'unread_total': sum(r['unread_count'] for r in rows)}
 
 
 @app.get('/api/admin/lawyer-verifications')
@@ -532,12 +833,58 @@ def review_verification(request: Request, request_id: int, payload: LawyerReview
             (payload.decision, payload.notes, admin['user_id'], request_id),
         )
         verified = 1 if payload.decision == 'approved' else 0
-        conn.execute('UPDATE users SET is_verified = ? WHERE id = ?', (verified, req['lawyer_user_id']))
+        with facets_maintained(conn, [req['lawyer_user_id']]):
+            conn.execute('UPDATE users SET is_verified = ? WHERE id = ?', (verified, req['lawyer_user_id']))
 
+    LAWYER_INDEX.refresh_lawyers([req['lawyer_user_id']])
     log_action(admin['user_id'], 'lawyer.verification.reviewed', 'verification_request', request_id, {'decision': payload.decision})
     return {'success': True, 'message': 'Review saved'}
 
 
+@app.post('/api/admin/lawyer-verifications/batch')
+def batch_review_verifications(request: Request, payload: LawyerReviewBatchPayload):
+    admin = require_user(request, ['admin'])
+    ids = sorted({item.request_id for item in payload.items})
+    results = []
+    reviews = []
+    verified_flags = []
+    audit_entries = []
+
+    with get_conn(immediate=True) as conn:
+        placeholders = ','.join('?' * len(ids))
+        rows = conn.execute(f'SELECT id, lawyer_user_id FROM lawyer_verification_requests WHERE id IN ({placeholders})', ids).fetchall()
+        lawyer_by_request = {row['id']: row['lawyer_user_id'] for row in rows}
+
+        for item in payload.items:
+            lawyer_user_id = lawyer_by_request.get(item.request_id)
+            if lawyer_user_id is None:
+                results.append({'request_id': item.request_id, 'success': False, 'error': 'Request not found'})
+                continue
+            reviews.append((item.decision, item.notes, admin['user_id'], item.request_id))
+            verified_flags.append((1 if item.decision == 'approved' else 0, lawyer_user_id))
+            audit_entries.append((admin['user_id'], 'lawyer.verification.reviewed', 'verification_request', item.request_id, {'decision': item.decision, 'batch': True}))
+            results.append({'request_id': item.request_id, 'success': True})
+
+        if reviews:
+            conn.executemany(
+                '''
+                UPDATE lawyer_verification_requests
+                SET status = ?, review_notes = ?, reviewed_by_user_id = ?, reviewed_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+                ''',
+                reviews,
+            )
+            with facets_maintained(conn, [lawyer_user_id for _, lawyer_user_id in verified_flags]):
+                conn.executemany('UPDATE users SET is_verified = ? WHERE id = ?', verified_flags)
+
+    LAWYER_INDEX.refresh_lawyers(lawyer_user_id for _, lawyer_user_id in verified_flags)
+    if audit_entries:
+        with get_conn(db='audit') as conn:
+            log_actions(conn, audit_entries)
+
+    return {'success': True, 'data': {'applied': len(reviews), 'failed': len(results) - len(reviews), 'results': results}}
+
+
 @app.get('/api/admin/overview')
 def admin_overview(request: Request):
     require_user(request, ['admin'])
@@ -557,16 +904,276 @@ def admin_overview(request: Request):
     }
 
 
+@app.get('/api/admin/write-batching')
+def admin_write_batching(request: Request):
+    require_user(request, ['admin'])
+    return {'success': True, 'data': [MESSAGE_WRITER.stats(), AUDIT_WRITER.stats()]}
+
+
+@app.get('/api/admin/jobs')
+def admin_jobs(request: Request):
+    require_user(request, ['admin'])
+    return {'success': True, 'data': queue_stats()}
+
+
+@app.get('/api/admin/load-shedding')
+def admin_load_shedding(request: Request):
+    require_user(request, ['admin'])
+    return {'success': True, 'data': load_shedding_stats()}
+
+
+@app.get('/api/admin/maintenance')
+def admin_maintenance(request: Request, limit: int = 20):
+    require_user(request, ['admin'])
+    return {'success': True, 'data': {'databases': database_status(), 'runs': recent_runs(max(1, min(limit, 200)))}}
+
+
+@app.post('/api/admin/maintenance/run')
+def admin_maintenance_run(request: Request, payload: MaintenanceRunPayload):
+    admin = require_user(request, ['admin'])
+    run = run_maintenance(full=payload.full, trigger='admin', vacuum_budget_ms=payload.vacuum_budget_ms)
+    log_action(admin['user_id'], 'maintenance.run', 'system', None, {'run_id': run['id'], 'full': run['full'], 'duration_ms': run['duration_ms']})
+    return {'success': True, 'data': run}
+
+
+@app.get('/api/admin/backups')
+def admin_backups(request: Request):
+    require_user(request, ['admin'])
+    return {'success': True, 'data': {'settings': backup_settings(), 'snapshots': list_backups()}}
+
+
+@app.post('/api/admin/backups', status_code=202)
+def admin_create_backup(request: Request):
+    admin = require_user(request, ['admin'])
+    # runs on a job worker: a paced copy of a large file outlasts any request deadline;
+    # a kind of its own, so it does not re-queue and start a second scheduled chain
+    job_id = enqueue('db.backup.manual', priority=10, max_attempts=1)
+    log_action(admin['user_id'], 'backup.requested', 'system', None, {'job_id': job_id})
+    return {'success': True, 'data': {'job_id': job_id}}
+
+
+@app.get('/api/admin/backups/jobs/{job_id}')
+def admin_backup_job(request: Request, job_id: int):
+    require_user(request, ['admin'])
+    job = get_job(job_id)
+    if not job or job['kind'] not in ('db.backup', 'db.backup.manual'):
+        raise HTTPException(status_code=404, detail='Job not found')
+    return {'success': True, 'data': {'job_id': job['id'], 'status': job['status'], 'result': job['result'], 'error': job['last_error']}}
+
+
+@app.post('/api/admin/backups/{name}/verify')
+def admin_verify_backup(request: Request, name: str):
+    admin = require_user(request, ['admin'])
+    result = verify_backup(name)
+    if result is None:
+        raise HTTPException(status_code=404, detail='Backup not found')
+    log_action(admin['user_id'], 'backup.verified', 'system', None, {'name': name, 'ok': result['ok']})
+    return {'success': True, 'data': result}
+
+
+@app.get('/api/admin/startup')
+def admin_startup(request: Request):
+    require_user(request, ['admin'])
+    return {'success': True, 'data': STARTUP_REPORT}
+
+
+@app.get('/api/admin/template-cache')
+def admin_template_cache(request: Request):
+    require_user(request, ['admin'])
+    return {'success': True, 'data': template_cache_stats()}
+
+
+@app.get('/api/admin/profiling')
+def admin_profiling(request: Request):
+    require_user(request, ['admin'])
+    return {'success': True, 'data': profiling_settings()}
+
+
+@app.put('/api/admin/profiling')
+def admin_update_profiling(request: Request, payload: ProfilingSettingsPayload):
+    admin = require_user(request, ['admin'])
+    PROFILING_SETTINGS.update(sample_rate=payload.sample_rate, path_prefix=payload.path_prefix or None)
+    log_action(admin['user_id'], 'profiling.updated', 'system', None, payload.model_dump())
+    return {'success': True, 'data': profiling_settings()}
+
+
+@app.post('/api/admin/profiling/token')
+def admin_profiling_token(request: Request, payload: ProfileTokenPayload):
+    admin = require_user(request, ['admin'])
+    token, expires = issue_profile_token(payload.ttl_seconds)
+    log_action(admin['user_id'], 'profiling.token_issued', 'system', None, {'expires': expires})
+    return {'success': True, 'data': {'header': 'X-Profile-Token', 'token': token, 'expires': expires}}
+
+
+@app.get('/api/admin/profiles')
+def admin_profiles(request: Request):
+    require_user(request, ['admin'])
+    return {'success': True, 'data': list_profiles()}
+
+
+@app.get('/api/admin/profiles/merged')
+def admin_profiles_merged(request: Request, route: str | None = None):
+    require_user(request, ['admin'])
+    merged = merge_profiles(route)
+    if not merged['profiles']:
+        raise HTTPException(status_code=404, detail='No stored profiles match')
+    return PlainTextResponse(
+        folded_stacks(merged),
+        headers={'Content-Disposition': 'attachment; filename="profiles-merged.folded"', 'X-Profile-Count': str(merged['profiles'])},
+    )
+
+
+@app.get('/api/admin/profiles/{profile_id}')
+def admin_profile_download(request: Request, profile_id: str, format: Literal['folded', 'json'] = 'folded'):
+    require_user(request, ['admin'])
+    record = load_profile(profile_id)
+    if not record:
+        raise HTTPException(status_code=404, detail='Profile not found')
+    if format == 'json':
+        return {'success': True, 'data': record}
+    return PlainTextResponse(
+        folded_stacks(record),
+        headers={'Content-Disposition': f'attachment; filename="profile-{profile_id}.folded"'},
+    )
+
+
+@app.get('/api/admin/matching')
+def admin_matching(request: Request):
+    require_user(request, ['admin'])
+    return {'success': True, 'data': LAWYER_INDEX.stats()}
+
+
+@app.post('/api/admin/matching/rebuild')
+def admin_matching_rebuild(request: Request):
+    admin = require_user(request, ['admin'])
+    result = LAWYER_INDEX.rebuild()
+    log_action(admin['user_id'], 'matching.rebuilt', 'system', None, {'lawyers': result['lawyers']})
+    return {'success': True, 'data': result}
+
+
+@app.get('/api/admin/ai/breaker')
+def admin_ai_breaker(request: Request):
+    require_user(request, ['admin'])
+    return {'success': True, 'data': AI_BREAKER.snapshot()}
+
+
+@app.get('/api/admin/ai/coalescing')
+def admin_ai_coalescing(request: Request):
+    require_user(request, ['admin'])
+    return {'success': True, 'data': AI_SINGLE_FLIGHT.stats()}
+
+
+def _audit_log_filters(
+    actor_user_id: int | str | None,
+    action: str | None,
+    target_type: str | None,
+    target_id: int | str | None,
+    since: str | None,
+    until: str | None,
+) -> dict:
+    # the admin page's filter form submits empty strings for unused fields
+    try:
+        actor_user_id = int(actor_user_id) if actor_user_id not in (None, '') else None
+        target_id = int(target_id) if target_id not in (None, '') else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail='actor_user_id/target_id must be integers')
+    try:
+        since_ts, until_ts = parse_timestamp(since), parse_timestamp(until)
+    except ValueError:
+        raise HTTPException(status_code=400, detail='since/until must be ISO dates or datetimes')
+    return {
+        'actor_user_id': actor_user_id,
+        'action': action or None,
+        'target_type': target_type or None,
+        'target_id': target_id,
+        'since': since_ts,
+        'until': until_ts,
+    }
+
+
 @app.get('/api/admin/audit-logs')
-def admin_audit_logs(request: Request, limit: int = 100):
+def admin_audit_logs(
+    request: Request,
+    limit: int = 100,
+    actor_user_id: int | None = None,
+    action: str | None = None,
+    target_type: str | None = None,
+    target_id: int | None = None,
+    since: str | None = None,
+    until: str | None = None,
+    before_id: int | None = None,
+):
     require_user(request, ['admin'])
-    safe_limit = min(max(limit, 1), 500)
-    with get_conn() as conn:
-        rows = conn.execute(
-            'SELECT * FROM audit_logs ORDER BY id DESC LIMIT ?',
-            (safe_limit,),
-        ).fetchall()
-    return {'success': True, 'data': [dict(x) for x in rows]}
+    filters = _audit_log_filters(actor_user_id, action, target_type, target_id, since, until)
+    rows, next_before_id = query_audit_logs(**filters, before_id=before_id, limit=limit)
+    return FastJSONResponse({'success': True, 'data': rows, 'paging': {'next_before_id': next_before_id}})
+
+
+@app.post('/api/admin/audit-logs/rollover')
+def admin_audit_rollover(request: Request):
+    admin = require_user(request, ['admin'])
+    summary = rollover_audit_logs()
+    log_action(admin['user_id'], 'audit.rollover', 'audit_logs', None, summary)
+    return {'success': True, 'data': summary}
+
+
+def _export_response(admin: dict, name: str, fmt: str, filters: dict, since: str | None, until: str | None, after_id: int):
+    # admin-only: loaded on the first export rather than by every worker at startup
+    from app.exports import MEDIA_TYPES, stream_export
+
+    if fmt not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail='format must be csv or ndjson')
+    try:
+        since_ts, until_ts = parse_timestamp(since), parse_timestamp(until)
+    except ValueError:
+        raise HTTPException(status_code=400, detail='since/until must be ISO dates or datetimes')
+    log_action(admin['user_id'], 'export.started', name, None, {'format': fmt, 'filters': filters, 'since': since_ts, 'until': until_ts, 'after_id': after_id})
+    return StreamingResponse(
+        stream_export(name, fmt, filters, since_ts, until_ts, after_id),
+        media_type=MEDIA_TYPES[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{name}-after-{after_id}.{fmt}"'},
+    )
+
+
+@app.get('/api/admin/export/payments')
+def export_payments(request: Request, format: str = 'csv', status: str | None = None, escrow_status: str | None = None, since: str | None = None, until: str | None = None, after_id: int = 0):
+    admin = require_user(request, ['admin'])
+    return _export_response(admin, 'payments', format, {'status': status, 'escrow_status': escrow_status}, since, until, after_id)
+
+
+@app.get('/api/admin/export/cases')
+def export_cases(request: Request, format: str = 'csv', status: str | None = None, case_type: str | None = None, since: str | None = None, until: str | None = None, after_id: int = 0):
+    admin = require_user(request, ['admin'])
+    return _export_response(admin, 'cases', format, {'status': status, 'case_type': case_type}, since, until, after_id)
+
+
+@app.get('/api/admin/export/audit-logs')
+def export_audit_logs(request: Request, format: str = 'csv', action: str | None = None, actor_user_id: int | None = None, target_type: str | None = None, since: str | None = None, until: str | None = None, after_id: int = 0):
+    admin = require_user(request, ['admin'])
+    return _export_response(admin, 'audit_logs', format, {'action': action, 'actor_user_id': actor_user_id, 'target_type': target_type}, since, until, after_id)
+
+
+@job_handler('audit.rollover', every_s=AUDIT_ROLLOVER_INTERVAL_SECONDS)
+def audit_rollover_job(payload: dict) -> dict:
+    return rollover_audit_logs()
+
+
+@job_handler('matching.rebuild', every_s=MATCHING_REBUILD_INTERVAL_SECONDS)
+def matching_rebuild_job(payload: dict) -> dict:
+    return LAWYER_INDEX.rebuild()
+
+
+@job_handler('db.backup.manual')
+@job_handler('db.backup', every_s=BACKUP_INTERVAL_SECONDS or None)
+def db_backup_job(payload: dict) -> dict:
+    manifest = create_backup()
+    return {'name': manifest['name'], 'ok': manifest['ok'], 'bytes': manifest['bytes'], 'duration_ms': manifest['duration_ms']}
+
+
+@job_handler('db.maintenance', every_s=MAINTENANCE_INTERVAL_SECONDS)
+def db_maintenance_job(payload: dict) -> dict:
+    run = run_maintenance()
+    return {'id': run['id'], 'full': run['full'], 'duration_ms': run['duration_ms']}
 
 
 def _load_ai_policy_rules(extra_rules: list[str] | None) -> list[str]:
@@ -587,13 +1194,25 @@ def _generate_ai_text(question: str, policy_rules: list[str]) -> str:
     model = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash')
 
     if not api_key:
-        return (
-            'تنبيه: هذه معلومات عامة وليست استشارة قانونية نهائية. '
-            'لا يوجد مفتاح AI مفعّل حالياً، لذا تم تطبيق إرشاد قائم على اللوائح المحددة فقط.\n\n'
-            + '\n'.join([f'- {r}' for r in policy_rules])
-            + '\n\nسؤالك: '
-            + question
-        )
+        # the key went away after _answer_ai_question checked it; this text is shared, so no question in it
+        return _ai_fallback_text(policy_rules, 'AI provider is not configured')
+
+    if not AI_CALL_SLOTS.acquire(blocking=False):
+        # local saturation, not a provider failure: the breaker is not told
+        return _ai_fallback_text(policy_rules, 'AI assistant is busy, please retry shortly')
+    submitted = False
+    try:
+        if not AI_BREAKER.allow():
+            return _ai_fallback_text(policy_rules, 'circuit open: AI provider temporarily disabled after repeated failures')
+        submitted = True
+        return _call_ai_provider(question, policy_rules, api_key, model)
+    finally:
+        if not submitted:
+            AI_CALL_SLOTS.release()
+
+
+def _call_ai_provider(question: str, policy_rules: list[str], api_key: str, model: str) -> str:
+    """Run one provider call on a free ``AI_CALL_POOL`` worker (slot already held) and record it in the breaker."""
 
     policy_block = '\n'.join([f'{i+1}) {r}' for i, r in enumerate(policy_rules)])
     prompt = (
@@ -610,29 +1229,75 @@ def _generate_ai_text(question: str, policy_rules: list[str]) -> str:
         'generationConfig': {'temperature': 0.2, 'maxOutputTokens': 500},
     }
 
+    # deferred: urllib.request pulls in http.client/email (~25 ms of cold start) and only this call needs it
+    import urllib.error
+    import urllib.request
+
     req = urllib.request.Request(
         url=f'https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}',
         data=json.dumps(body).encode('utf-8'),
         headers={'Content-Type': 'application/json'},
         method='POST',
     )
+    started = time.monotonic()
     try:
-        with urllib.request.urlopen(req, timeout=20) as response:
-            payload = json.loads(response.read().decode('utf-8'))
-            candidates = payload.get('candidates', [])
-            if not candidates:
-                raise RuntimeError('No candidates from AI provider')
-            text = candidates[0].get('content', {}).get('parts', [{}])[0].get('text', '').strip()
-            if not text:
-                raise RuntimeError('Empty AI response')
-            return text
-    except (urllib.error.URLError, RuntimeError, KeyError, json.JSONDecodeError) as exc:
-        return (
-            'تعذّر الوصول إلى مزود الذكاء الاصطناعي الآن. '\
-            'هذه إرشادات عامة وفق سياسة المنصة فقط:\n'
-            + '\n'.join([f'- {r}' for r in policy_rules])
-            + f'\n\nتفاصيل فنية: {str(exc)}'
-        )
+        future = AI_CALL_POOL.submit(_fetch_ai_text, req, started + AI_REQUEST_DEADLINE_SECONDS)
+    except RuntimeError:
+        # pool shut down: nothing will hand the slot back
+        AI_CALL_SLOTS.release()
+        raise
+    future.add_done_callback(lambda _: AI_CALL_SLOTS.release())
+    try:
+        text = future.result(timeout=AI_REQUEST_DEADLINE_SECONDS)
+    except TimeoutError:
+        # also covers the socket timeouts; either way the provider overran its deadline
+        AI_BREAKER.record(False, time.monotonic() - started)
+        return _ai_fallback_text(policy_rules, f'AI provider did not answer within {AI_REQUEST_DEADLINE_SECONDS:g}s')
+    except (urllib.error.URLError, OSError, RuntimeError, KeyError, json.JSONDecodeError) as exc:
+        AI_BREAKER.record(False, time.monotonic() - started)
+        return _ai_fallback_text(policy_rules, str(exc))
+    AI_BREAKER.record(True, time.monotonic() - started)
+    return text
+
+
+def _fetch_ai_text(req, deadline: float) -> str:
+    """POST to the provider and return the answer text, giving up once ``deadline`` (monotonic) passes."""
+    import urllib.request
+
+    # the urlopen timeout bounds each socket operation; the deadline check bounds a trickled body
+    with urllib.request.urlopen(req, timeout=max(deadline - time.monotonic(), 0.1)) as response:
+        chunks = []
+        while chunk := response.read1(65536):
+            chunks.append(chunk)
+            if time.monotonic() > deadline:
+                raise TimeoutError('AI provider response exceeded the request deadline')
+    payload = json.loads(b''.join(chunks).decode('utf-8'))
+    candidates = payload.get('candidates', [])
+    if not candidates:
+        raise RuntimeError('No candidates from AI provider')
+    text = candidates[0].get('content', {}).get('parts', [{}])[0].get('text', '').strip()
+    if not text:
+        raise RuntimeError('Empty AI response')
+    return text
+
+
+def _ai_offline_text(question: str, policy_rules: list[str]) -> str:
+    return (
+        'تنبيه: هذه معلومات عامة وليست استشارة قانونية نهائية. '
+        'لا يوجد مفتاح AI مفعّل حالياً، لذا تم تطبيق إرشاد قائم على اللوائح المحددة فقط.\n\n'
+        + '\n'.join([f'- {r}' for r in policy_rules])
+        + '\n\nسؤالك: '
+        + question
+    )
+
+
+def _ai_fallback_text(policy_rules: list[str], detail: str) -> str:
+    return (
+        'تعذّر الوصول إلى مزود الذكاء الاصطناعي الآن. '\
+        'هذه إرشادات عامة وفق سياسة المنصة فقط:\n'
+        + '\n'.join([f'- {r}' for r in policy_rules])
+        + f'\n\nتفاصيل فنية: {detail}'
+    )
 
 
 @app.post('/api/ai/assist')
@@ -641,13 +1306,47 @@ def ai_assist(request: Request, payload: AIAssistPayload):
     _check_rate_limit(f"ai:{user['user_id']}", limit=20, window_s=60)
 
     policy_rules = _load_ai_policy_rules(payload.policy_rules)
-    answer = _generate_ai_text(payload.question, policy_rules)
+    if payload.defer:
+        job_id = enqueue('ai.assist', {'user_id': user['user_id'], 'question': payload.question, 'policy_rules': policy_rules}, priority=10)
+        return JSONResponse({'success': True, 'data': {'job_id': job_id, 'status': 'queued'}}, status_code=202)
+
+    answer = _answer_ai_question(user['user_id'], payload.question, policy_rules)
+    return {'success': True, 'data': {'answer': answer, 'policy_rules': policy_rules}}
+
+
+def _ai_question_key(question: str, policy_rules: list[str]) -> str:
+    normalized = ' '.join(question.split()).casefold().strip('?؟!.، ')
+    return hashlib.sha256('\x1f'.join([normalized, *policy_rules]).encode()).hexdigest()
+
+
+def _answer_ai_question(user_id: int, question: str, policy_rules: list[str]) -> str:
+    if not os.getenv('GEMINI_API_KEY', '').strip():
+        # nothing to share without a provider, and this text echoes the caller's own question
+        answer = _ai_offline_text(question, policy_rules)
+    else:
+        # identical questions in flight at the same moment share one provider call
+        answer = AI_SINGLE_FLIGHT.do(_ai_question_key(question, policy_rules), _generate_ai_text, question, policy_rules)
 
     if 'ليست استشارة' not in answer:
         answer = f'تنبيه: هذه المعلومات عامة وليست استشارة قانونية نهائية.\n\n{answer}'
 
-    log_action(user['user_id'], 'ai.assist.used', 'ai', None, {'question_length': len(payload.question), 'rules_count': len(policy_rules)})
-    return {'success': True, 'data': {'answer': answer, 'policy_rules': policy_rules}}
+    log_action(user_id, 'ai.assist.used', 'ai', None, {'question_length': len(question), 'rules_count': len(policy_rules)})
+    return answer
+
+
+@job_handler('ai.assist')
+def ai_assist_job(payload: dict) -> dict:
+    answer = _answer_ai_question(payload['user_id'], payload['question'], payload['policy_rules'])
+    return {'answer': answer, 'policy_rules': payload['policy_rules']}
+
+
+@app.get('/api/ai/assist/jobs/{job_id}')
+def ai_assist_job_status(request: Request, job_id: int):
+    user = require_user(request, ['client', 'lawyer', 'admin'])
+    job = get_job(job_id)
+    if not job or job['kind'] != 'ai.assist' or job['payload'].get('user_id') != user['user_id']:
+        raise HTTPException(status_code=404, detail='Job not found')
+    return {'success': True, 'data': {'job_id': job['id'], 'status': job['status'], 'result': job['result'], 'error': job['last_error']}}
 
 
 # =====================================================
@@ -685,6 +1384,7 @@ def create_case_form(
         )
         case_id = cur.lastrowid
     
+    LAWYER_INDEX.refresh_lawyers([lawyer_id])
     log_action(user['user_id'], 'case.created', 'case', case_id)
     return RedirectResponse(f'/cases/{case_id}', status_code=303)
 
@@ -694,29 +1394,22 @@ def case_detail_page(request: Request, case_id: int):
     user = require_user(request, ['client', 'lawyer', 'admin'])
     
     with get_conn() as conn:
-        case = conn.execute('SELECT * FROM cases WHERE id = ?', (case_id,)).fetchone()
-        if not case:
-            raise HTTPException(status_code=404, detail='Case not found')
-        
-        if user['user_type'] != 'admin' and user['user_id'] not in {case['client_user_id'], case['lawyer_user_id']}:
-            raise HTTPException(status_code=403, detail='Forbidden')
-        
-        client = conn.execute('SELECT * FROM users WHERE id = ?', (case['client_user_id'],)).fetchone()
-        lawyer = None
-        if case['lawyer_user_id']:
-            lawyer = conn.execute('SELECT * FROM users WHERE id = ?', (case['lawyer_user_id'],)).fetchone()
-        
-        payments = conn.execute('SELECT * FROM payments WHERE case_id = ? ORDER BY id DESC', (case_id,)).fetchall()
-        has_payment = len(payments) > 0
+        view = load_case_view(conn, case_id, include_payments=True)
+    if not view:
+        raise HTTPException(status_code=404, detail='Case not found')
+
+    case = view['case']
+    if user['user_type'] != 'admin' and user['user_id'] not in {case['client_user_id'], case['lawyer_user_id']}:
+        raise HTTPException(status_code=403, detail='Forbidden')
     
     return templates.TemplateResponse('case_detail.html', {
         'request': request,
         'user': user,
-        'case': dict(case),
-        'client': dict(client) if client else None,
-        'lawyer': dict(lawyer) if lawyer else None,
-        'payments': [dict(p) for p in payments],
-        'has_payment': has_payment,
+        'case': case,
+        'client': view['client'],
+        'lawyer': view['lawyer'],
+        'payments': view['payments'],
+        'has_payment': bool(view['payments']),
     })
 
 
@@ -725,29 +1418,28 @@ def case_messages_page(request: Request, case_id: int):
     user = require_user(request, ['client', 'lawyer', 'admin'])
     
     with get_conn() as conn:
-        case = conn.execute('SELECT * FROM cases WHERE id = ?', (case_id,)).fetchone()
-        if not case:
-            raise HTTPException(status_code=404, detail='Case not found')
-        
-        if user['user_type'] != 'admin' and user['user_id'] not in {case['client_user_id'], case['lawyer_user_id']}:
-            raise HTTPException(status_code=403, detail='Forbidden')
-        
-        messages = conn.execute('SELECT * FROM messages WHERE case_id = ? ORDER BY id ASC', (case_id,)).fetchall()
-        
-        # Determine other party
-        if user['user_id'] == case['client_user_id']:
-            other_party_id = case['lawyer_user_id']
-        else:
-            other_party_id = case['client_user_id']
-        
-        other_party = None
-        if other_party_id:
-            other_party = conn.execute('SELECT * FROM users WHERE id = ?', (other_party_id,)).fetchone()
+        view = load_case_view(conn, case_id, message_limit=MESSAGE_WINDOW, reader_user_id=user['user_id'])
+    if not view:
+        raise HTTPException(status_code=404, detail='Case not found')
+
+    case = view['case']
+    if user['user_type'] != 'admin' and user['user_id'] not in {case['client_user_id'], case['lawyer_user_id']}:
+        raise HTTPException(status_code=403, detail='Forbidden')
+
+    if view['unread_count']:
+        with get_conn(db='messages') as conn:
+            mark_read(conn, user['user_id'], case_id)
+    
+    # Determine other party
+    if user['user_id'] == case['client_user_id']:
+        other_party_id, other_party = case['lawyer_user_id'], view['lawyer']
+    else:
+        other_party_id, other_party = case['client_user_id'], view['client']
     
     return _render_with_csrf('messages.html', request, {
-        'case': dict(case),
-        'messages': [dict(m) for m in messages],
-        'other_party': dict(other_party) if other_party else None,
+        'case': case,
+        'messages': view['messages'],
+        'other_party': other_party,
         'other_party_id': other_party_id,
         'current_user_id': user['user_id'],
     })
@@ -836,15 +1528,13 @@ def profile_page(request: Request):
 
 
 @app.post('/profile/update')
-def update_profile(request: Request):
+def update_profile(request: Request, payload: ProfileUpdatePayload):
     user = require_user(request, ['client', 'lawyer', 'admin'])
-    
-    import json as json_lib
-    body = json_lib.loads(request._body.decode() if hasattr(request, '_body') else '{}')
+    body = payload.model_dump(exclude_unset=True)
     
     with get_conn() as conn:
         # Update user info
-        if 'full_name' in body:
+        if body.get('full_name'):
             conn.execute('UPDATE users SET full_name = ? WHERE id = ?', (body['full_name'].strip(), user['user_id']))
         
         # Update lawyer info
@@ -858,8 +1548,11 @@ def update_profile(request: Request):
             
             if updates:
                 params.append(user['user_id'])
-                conn.execute(f"UPDATE lawyers SET {', '.join(updates)} WHERE user_id = ?", params)
+                with facets_maintained(conn, [user['user_id']]):
+                    conn.execute(f"UPDATE lawyers SET {', '.join(updates)} WHERE user_id = ?", params)
     
+    if user['user_type'] == 'lawyer':
+        LAWYER_INDEX.refresh_lawyers([user['user_id']])
     log_action(user['user_id'], 'profile.updated', 'user', user['user_id'])
     return {'success': True, 'message': 'Profile updated'}
 
@@ -978,11 +1671,21 @@ def admin_payments_page(request: Request):
 
 
 @app.get('/admin/audit-logs', response_class=HTMLResponse)
-def admin_audit_logs_page(request: Request):
+def admin_audit_logs_page(
+    request: Request,
+    actor_user_id: str | None = None,
+    action: str | None = None,
+    target_type: str | None = None,
+    target_id: str | None = None,
+    since: str | None = None,
+    until: str | None = None,
+    before_id: int | None = None,
+):
     user = require_user(request, ['admin'])
+    filters = _audit_log_filters(actor_user_id, action, target_type, target_id, since, until)
+    audit_logs, next_before_id = query_audit_logs(**filters, before_id=before_id, limit=200)
     
     with get_conn() as conn:
-        audit_logs = conn.execute('SELECT * FROM audit_logs ORDER BY id DESC LIMIT 200').fetchall()
         pending_verifications = conn.execute("SELECT COUNT(*) c FROM lawyer_verification_requests WHERE status IN ('submitted','under_review')").fetchone()['c']
     
     return templates.TemplateResponse('admin.html', {
@@ -993,6 +1696,8 @@ def admin_audit_logs_page(request: Request):
         'verifications': [],
         'cases': [],
         'payments': [],
-        'audit_logs': [dict(log) for log in audit_logs],
+        'audit_logs': audit_logs,
+        'audit_filters': {'actor_user_id': actor_user_id, 'action': action, 'target_type': target_type, 'target_id': target_id, 'since': since, 'until': until},
+        'next_before_id': next_before_id,
         'pending_verifications': pending_verifications,
     })
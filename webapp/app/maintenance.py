@@ -0,0 +1,201 @@
+"""Scheduled SQLite maintenance.
+
+Each run goes over every database file (main plus split messages/audit files):
+
+- ``PRAGMA optimize`` on every run: cheap, and re-analyzes only the tables whose
+  statistics the planner has found lacking;
+- a full ``ANALYZE`` and ``incremental_vacuum`` only on full runs, which happen
+  inside the quiet hours window (``APP_MAINTENANCE_QUIET_HOURS``, UTC) or when an
+  admin asks. The vacuum frees pages in small chunks, each its own short write
+  transaction, and stops at ``APP_VACUUM_BUDGET_MS``. The full-text indexes
+  (``cases_fts``, ``messages_fts``) get their segments merged the same way under
+  the same budget, since every trigger-driven insert adds a small segment;
+- ``wal_checkpoint(TRUNCATE)`` when the file is in WAL mode;
+- finished background jobs older than ``APP_JOB_RETENTION_DAYS`` are deleted, and so
+  are recommendation-index change rows older than a day.
+
+``incremental_vacuum`` needs ``auto_vacuum = INCREMENTAL``. New databases get it from
+``init_db``; an existing file is converted once with
+``python -m app.maintenance --enable-incremental-vacuum`` (a full VACUUM, so run it
+while the site is idle). Every run is recorded in ``maintenance_runs`` with the
+duration and outcome of each step.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+from app.db import DB_PATHS, get_conn, is_split
+from app.jobs import purge_finished_jobs
+from app.matching import purge_matching_changes
+
+MAINTENANCE_INTERVAL_SECONDS = float(os.getenv('APP_MAINTENANCE_INTERVAL_SECONDS', '3600'))
+VACUUM_BUDGET_MS = float(os.getenv('APP_VACUUM_BUDGET_MS', '2000'))
+VACUUM_CHUNK_PAGES = 128
+FTS_TABLES = ('cases_fts', 'messages_fts')
+FTS_MERGE_PAGES = 64
+RUNS_KEPT = 200
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+
+def _quiet_hours() -> tuple[int, int]:
+    start, end = os.getenv('APP_MAINTENANCE_QUIET_HOURS', '2-5').split('-')
+    return int(start), int(end)
+
+
+def in_quiet_hours(now: float | None = None) -> bool:
+    start, end = _quiet_hours()
+    hour = time.gmtime(now if now is not None else time.time()).tm_hour
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+
+def _maintained_dbs() -> list[str]:
+    return [db for db in DB_PATHS if db == 'main' or is_split(db)]
+
+
+def _timed(steps: list, db: str, name: str, fn) -> None:
+    started = time.perf_counter()
+    try:
+        detail = fn()
+        status = 'skipped' if 'skipped' in detail else 'ok'
+    except sqlite3.Error as exc:
+        detail, status = {'error': str(exc)}, 'error'
+    steps.append({'db': db, 'step': name, 'status': status, 'ms': round((time.perf_counter() - started) * 1000, 2), **detail})
+
+
+def _optimize(conn) -> dict:
+    conn.execute('PRAGMA main.optimize').fetchall()
+    return {}
+
+
+def _analyze(conn) -> dict:
+    conn.execute('ANALYZE main')
+    return {'indexes': conn.execute('SELECT COUNT(*) FROM main.sqlite_stat1').fetchone()[0]}
+
+
+def _incremental_vacuum(conn, budget_ms: float) -> dict:
+    if conn.execute('PRAGMA main.auto_vacuum').fetchone()[0] != 2:
+        free = conn.execute('PRAGMA main.freelist_count').fetchone()[0]
+        return {'skipped': 'auto_vacuum is not incremental', 'free_pages': free}
+    deadline = time.perf_counter() + budget_ms / 1000
+    before = conn.execute('PRAGMA main.freelist_count').fetchone()[0]
+    remaining = before
+    while remaining and time.perf_counter() < deadline:
+        # executescript steps the pragma to completion; execute() would free a single page
+        conn.executescript(f'PRAGMA main.incremental_vacuum({VACUUM_CHUNK_PAGES})')
+        remaining = conn.execute('PRAGMA main.freelist_count').fetchone()[0]
+    return {'freed_pages': before - remaining, 'free_pages': remaining, 'budget_exhausted': bool(remaining)}
+
+
+def _fts_merge(conn, budget_ms: float) -> dict:
+    placeholders = ', '.join('?' for _ in FTS_TABLES)
+    tables = [row[0] for row in conn.execute(f"SELECT name FROM main.sqlite_master WHERE type = 'table' AND name IN ({placeholders})", FTS_TABLES)]
+    if not tables:
+        return {'skipped': 'no full-text index in this file'}
+    deadline = time.perf_counter() + budget_ms / 1000
+    merged = {}
+    for table in tables:
+        rounds = 0
+        while time.perf_counter() < deadline:
+            before = conn.total_changes
+            # a negative page count merges every segment, like 'optimize' but in bounded steps
+            conn.execute(f"INSERT INTO main.{table} ({table}, rank) VALUES ('merge', ?)", (-FTS_MERGE_PAGES,))
+            conn.commit()
+            rounds += 1
+            # fewer than two changed rows means there was nothing left to merge
+            if conn.total_changes - before < 2:
+                break
+        merged[table] = rounds
+    return {'merge_rounds': merged, 'budget_exhausted': time.perf_counter() >= deadline}
+
+
+def _wal_checkpoint(conn) -> dict:
+    mode = conn.execute('PRAGMA main.journal_mode').fetchone()[0]
+    if mode != 'wal':
+        return {'skipped': f'journal_mode is {mode}'}
+    busy, log_frames, checkpointed = conn.execute('PRAGMA main.wal_checkpoint(TRUNCATE)').fetchone()
+    return {'busy': bool(busy), 'log_frames': log_frames, 'checkpointed_frames': checkpointed}
+
+
+def run_maintenance(full: bool | None = None, trigger: str = 'schedule', vacuum_budget_ms: float = VACUUM_BUDGET_MS) -> dict:
+    """Run one maintenance pass; ``full=None`` means full only inside the quiet hours."""
+    if full is None:
+        full = in_quiet_hours()
+    started_at = time.time()
+    steps: list[dict] = []
+    for db in _maintained_dbs():
+        # split files are opened on their own so ANALYZE/vacuum touch exactly one file
+        with get_conn(db=db) as conn:
+            _timed(steps, db, 'optimize', lambda: _optimize(conn))
+            if full:
+                _timed(steps, db, 'analyze', lambda: _analyze(conn))
+                _timed(steps, db, 'incremental_vacuum', lambda: _incremental_vacuum(conn, vacuum_budget_ms))
+                _timed(steps, db, 'fts_merge', lambda: _fts_merge(conn, vacuum_budget_ms))
+            _timed(steps, db, 'wal_checkpoint', lambda: _wal_checkpoint(conn))
+    _timed(steps, 'main', 'jobs_purge', lambda: {'deleted': purge_finished_jobs()})
+    _timed(steps, 'main', 'matching_changes_purge', lambda: {'deleted': purge_matching_changes()})
+    duration_ms = round((time.time() - started_at) * 1000, 2)
+    with get_conn() as conn:
+        run_id = conn.execute(
+            'INSERT INTO maintenance_runs (trigger, full, started_at, duration_ms, steps) VALUES (?, ?, ?, ?, ?)',
+            (trigger, int(full), started_at, duration_ms, json.dumps(steps)),
+        ).lastrowid
+        conn.execute('DELETE FROM maintenance_runs WHERE id <= ?', (run_id - RUNS_KEPT,))
+    return {'id': run_id, 'trigger': trigger, 'full': full, 'started_at': started_at, 'duration_ms': duration_ms, 'steps': steps}
+
+
+def database_status() -> dict:
+    status = {}
+    for db in _maintained_dbs():
+        with get_conn(db=db) as conn:
+            page_size = conn.execute('PRAGMA main.page_size').fetchone()[0]
+            page_count = conn.execute('PRAGMA main.page_count').fetchone()[0]
+            free_pages = conn.execute('PRAGMA main.freelist_count').fetchone()[0]
+            status[db] = {
+                'path': DB_PATHS[db],
+                'size_bytes': page_size * page_count,
+                'free_bytes': page_size * free_pages,
+                'auto_vacuum': AUTO_VACUUM_MODES.get(conn.execute('PRAGMA main.auto_vacuum').fetchone()[0]),
+                'journal_mode': conn.execute('PRAGMA main.journal_mode').fetchone()[0],
+                'analyzed': bool(conn.execute("SELECT 1 FROM main.sqlite_master WHERE name = 'sqlite_stat1'").fetchone()),
+            }
+    return status
+
+
+def recent_runs(limit: int = 20) -> list[dict]:
+    with get_conn() as conn:
+        rows = conn.execute(
+            'SELECT id, trigger, full, started_at, duration_ms, steps FROM maintenance_runs ORDER BY id DESC LIMIT ?', (limit,)
+        ).fetchall()
+    return [{**dict(row), 'full': bool(row['full']), 'steps': json.loads(row['steps'])} for row in rows]
+
+
+def enable_incremental_vacuum() -> dict:
+    """Switch every file to ``auto_vacuum = INCREMENTAL``; rewrites each file with VACUUM."""
+    converted = {}
+    for db in _maintained_dbs():
+        conn = sqlite3.connect(DB_PATHS[db], isolation_level=None)
+        try:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                conn.execute('VACUUM')
+            converted[db] = AUTO_VACUUM_MODES[conn.execute('PRAGMA auto_vacuum').fetchone()[0]]
+        finally:
+            conn.close()
+    return converted
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description='Run SQLite maintenance against the configured databases.')
+    parser.add_argument('--full', action='store_true', help='run ANALYZE and incremental_vacuum regardless of the quiet hours')
+    parser.add_argument('--budget-ms', type=float, default=VACUUM_BUDGET_MS, help='time budget for incremental_vacuum')
+    parser.add_argument('--enable-incremental-vacuum', action='store_true', help='convert the files to auto_vacuum=INCREMENTAL first (full VACUUM)')
+    args = parser.parse_args(argv)
+    if args.enable_incremental_vacuum:
+        print(json.dumps({'auto_vacuum': enable_incremental_vacuum()}))
+    print(json.dumps(run_maintenance(full=args.full or None, trigger='cli', vacuum_budget_ms=args.budget_ms), indent=2))
+
+
+if __name__ == '__main__':
+    main()
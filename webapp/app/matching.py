@@ -0,0 +1,358 @@
+"""In-memory lawyer recommendation index.
+
+Verified, active lawyers are held in memory in ranked lists, one per scope (all
+lawyers, a governorate, a city) and per case type within each scope, each kept
+sorted by the part of the score that does not depend on the query: experience
+with that case type, completion rate and current open-case load. Each of those
+lists is further split by fee band, so a ``max_fee`` query merges only the bands
+at or below its cap and skips no more than the part of one band above it. A
+query walks only the heads of the few lists for its scope until it has ``limit``
+lawyers that pass its filters, so ranking cost depends on ``limit`` rather than
+on directory size.
+
+The index is built lazily on first use and patched per lawyer by ``refresh_lawyers``
+whenever a profile, verification or case assignment changes. Each worker process
+holds its own copy, so writes are also logged to ``matching_changes`` by triggers;
+before ranking, ``sync`` replays the rows past the process's cursor, and rebuilds
+instead when it is too far behind or the rows it needs were purged. The
+``matching.rebuild`` recurring job still rebuilds in full to pick up anything else.
+"""
+import heapq
+import sqlite3
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+
+from app.db import DB_PATHS, get_conn
+
+OPEN_STATUSES = ('pending', 'accepted', 'in_progress')
+INACTIVE_STATUSES = ('rejected', 'cancelled')
+RECOMMEND_MAX = 50
+SAME_CITY_BOOST = 3.0
+# behind by more changes than this, a full rebuild is cheaper than refreshing each lawyer
+SYNC_MAX_CHANGES = 2000
+CHANGE_RETENTION_SECONDS = 24 * 3600
+# lower bounds of the fee bands (EGP); narrow enough that the one band straddling a
+# fee cap rarely holds many lawyers above it
+FEE_BANDS = (0, 100, 150, 200, 300, 400, 500, 750, 1000, 1500, 2000, 3000, 5000, 7500, 10000, 20000, 50000)
+
+_LAWYERS_SQL = '''
+    SELECT u.id, u.full_name, l.governorate, l.city, l.min_consultation_fee
+    FROM users u JOIN lawyers l ON l.user_id = u.id
+    WHERE u.user_type = 'lawyer' AND u.is_active = 1 AND u.is_verified = 1
+'''
+_HISTORY_SQL = '''
+    SELECT lawyer_user_id, case_type, status, COUNT(*) n
+    FROM cases
+    WHERE lawyer_user_id IS NOT NULL
+'''
+
+
+def _norm(value) -> str:
+    return (value or '').strip().casefold()
+
+
+def _base_score(entry: dict) -> float:
+    completion = entry['completed'] / entry['handled'] if entry['handled'] else 0.0
+    return completion - 0.1 * min(entry['open'], 20)
+
+
+def _experience_score(handled: int) -> float:
+    return 1 + 4 * min(handled, 20) / 20
+
+
+def _rankings(entry: dict):
+    """Yield ``(list_key, static_score)`` for every ranked list the lawyer belongs to."""
+    base = _base_score(entry)
+    scopes = [('all',)]
+    if entry['governorate']:
+        scopes.append(('governorate', entry['governorate']))
+    if entry['city']:
+        scopes.append(('city', entry['city']))
+    band = _fee_band(entry['fee'])
+    for scope in scopes:
+        yield scope + (None, band), base
+        for case_type, handled in entry['case_types'].items():
+            yield scope + (case_type, band), base + _experience_score(handled)
+
+
+def _fee_band(fee) -> int:
+    return FEE_BANDS[max(bisect_right(FEE_BANDS, fee) - 1, 0)]
+
+
+def _fee_bands(max_fee: int | None) -> tuple[int, ...]:
+    """The bands holding every lawyer whose fee is within ``max_fee``."""
+    return FEE_BANDS if max_fee is None else FEE_BANDS[:bisect_right(FEE_BANDS, max_fee)]
+
+
+class _Rankings:
+    def __init__(self):
+        self.lawyers: dict[int, dict] = {}
+        # list key -> [(-static_score, user_id), ...] ascending, i.e. best first
+        self.lists: dict[tuple, list[tuple[float, int]]] = {}
+
+    def load(self, entries: list[dict]) -> None:
+        for entry in entries:
+            self.lawyers[entry['user_id']] = entry
+            for key, score in _rankings(entry):
+                self.lists.setdefault(key, []).append((-score, entry['user_id']))
+        for ranked in self.lists.values():
+            ranked.sort()
+
+    def add(self, entry: dict) -> None:
+        self.remove(entry['user_id'])
+        self.lawyers[entry['user_id']] = entry
+        for key, score in _rankings(entry):
+            insort(self.lists.setdefault(key, []), (-score, entry['user_id']))
+
+    def remove(self, user_id: int) -> None:
+        entry = self.lawyers.pop(user_id, None)
+        if entry is None:
+            return
+        for key, score in _rankings(entry):
+            ranked = self.lists[key]
+            del ranked[bisect_left(ranked, (-score, user_id))]
+            if not ranked:
+                del self.lists[key]
+
+    def head(self, key: tuple, bands, limit: int, accept) -> list[int]:
+        """The first ``limit`` lawyers of a ranked list, merged across fee bands, that ``accept`` lets through."""
+        found = []
+        ranked = [self.lists[key + (band,)] for band in bands if key + (band,) in self.lists]
+        for _, uid in heapq.merge(*ranked):
+            if accept(uid):
+                found.append(uid)
+                if len(found) == limit:
+                    break
+        return found
+
+
+def _last_change_id(conn) -> int:
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'matching_changes'").fetchone()
+    return row['seq'] if row else 0
+
+
+def purge_matching_changes(max_age_s: float = CHANGE_RETENTION_SECONDS) -> int:
+    """Drop change rows every live index has long applied; a process further behind rebuilds."""
+    with get_conn(immediate=True) as conn:
+        return conn.execute(
+            "DELETE FROM matching_changes WHERE changed_at < datetime('now', ?)",
+            (f'-{int(max_age_s)} seconds',),
+        ).rowcount
+
+
+def _load(conn, user_ids: list[int] | None = None) -> list[dict]:
+    """Read index entries for every eligible lawyer, or just those in ``user_ids``."""
+    lawyers_sql, history_sql, params = _LAWYERS_SQL, _HISTORY_SQL, []
+    if user_ids is not None:
+        placeholders = ','.join('?' * len(user_ids))
+        lawyers_sql += f' AND u.id IN ({placeholders})'
+        history_sql += f' AND lawyer_user_id IN ({placeholders})'
+        params = list(user_ids)
+    entries = {}
+    for row in conn.execute(lawyers_sql, params):
+        entries[row['id']] = {
+            'user_id': row['id'],
+            'full_name': row['full_name'],
+            'governorate': _norm(row['governorate']),
+            'city': _norm(row['city']),
+            'display_governorate': row['governorate'],
+            'display_city': row['city'],
+            'fee': row['min_consultation_fee'] if row['min_consultation_fee'] is not None else 0,
+            'case_types': {},
+            'handled': 0,
+            'completed': 0,
+            'open': 0,
+        }
+    for row in conn.execute(history_sql + ' GROUP BY lawyer_user_id, case_type, status', params):
+        entry = entries.get(row['lawyer_user_id'])
+        if entry is None or row['status'] in INACTIVE_STATUSES:
+            continue
+        case_type = _norm(row['case_type'])
+        entry['case_types'][case_type] = entry['case_types'].get(case_type, 0) + row['n']
+        entry['handled'] += row['n']
+        if row['status'] == 'completed':
+            entry['completed'] += row['n']
+        elif row['status'] in OPEN_STATUSES:
+            entry['open'] += row['n']
+    return list(entries.values())
+
+
+def _score(entry: dict, case_type: str, city: str) -> tuple[float, list[str]]:
+    score = _base_score(entry)
+    reasons = []
+    handled = entry['case_types'].get(case_type, 0)
+    if handled:
+        score += _experience_score(handled)
+        reasons.append(f'handled {handled} {case_type} case(s)')
+    if city and entry['city'] == city:
+        score += SAME_CITY_BOOST
+        reasons.append('same city')
+    return score, reasons
+
+
+class LawyerIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        # last ``matching_changes`` id applied to this process's rankings
+        self._change_cursor = 0
+        # kept open for ``sync`` (used under ``_sync_lock``): opening a connection per
+        # query would cost more than the ranking itself
+        self._sync_conn: sqlite3.Connection | None = None
+        self._sync_conn_path: str | None = None
+        self._rankings: _Rankings | None = None
+        # ids refreshed while a full rebuild is reading, replayed once it swaps in
+        self._pending: set[int] | None = None
+        self.built_at: float | None = None
+        self.build_ms = 0.0
+        self.refreshes = 0
+
+    def rebuild(self) -> dict:
+        with self._build_lock:
+            with self._lock:
+                self._pending = set()
+            started = time.perf_counter()
+            rankings = _Rankings()
+            with get_conn() as conn:
+                # read first: a change committed during the load is replayed, never skipped
+                cursor = _last_change_id(conn)
+                rankings.load(_load(conn))
+            with self._lock:
+                self._rankings = rankings
+                self._change_cursor = max(self._change_cursor, cursor)
+                pending, self._pending = self._pending, None
+                self.built_at = time.time()
+                self.build_ms = (time.perf_counter() - started) * 1000
+        if pending:
+            self.refresh_lawyers(pending)
+        return self.stats()
+
+    def _ensure_built(self) -> None:
+        if self._rankings is None:
+            self.rebuild()
+        else:
+            self.sync()
+
+    def sync(self) -> None:
+        """Apply the lawyer changes committed by any process since this index last looked."""
+        if not self._sync_lock.acquire(blocking=False):
+            # another request is already catching up
+            return
+        try:
+            cursor = self._change_cursor
+            rows = self._changes_conn().execute(
+                'SELECT id, lawyer_user_id FROM matching_changes WHERE id > ? ORDER BY id LIMIT ?',
+                (cursor, SYNC_MAX_CHANGES + 1),
+            ).fetchall()
+            if not rows:
+                return
+            # ids are AUTOINCREMENT and committed in order, so a gap means the rows were purged
+            if len(rows) > SYNC_MAX_CHANGES or rows[0][0] != cursor + 1:
+                self.rebuild()
+                return
+            self.refresh_lawyers(user_id for _, user_id in rows)
+            with self._lock:
+                self._change_cursor = max(self._change_cursor, rows[-1][0])
+        finally:
+            self._sync_lock.release()
+
+    def _changes_conn(self) -> sqlite3.Connection:
+        path = DB_PATHS['main']
+        if self._sync_conn is None or self._sync_conn_path != path:
+            if self._sync_conn is not None:
+                self._sync_conn.close()
+            # autocommit reads, so each poll sees the latest commit from any process
+            self._sync_conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._sync_conn_path = path
+        return self._sync_conn
+
+    def refresh_lawyers(self, user_ids) -> None:
+        """Re-read these lawyers after a write; a lawyer who is no longer eligible drops out."""
+        user_ids = sorted({uid for uid in user_ids if uid is not None})
+        if not user_ids or (self._rankings is None and self._pending is None):
+            return
+        with get_conn() as conn:
+            entries = _load(conn, user_ids)
+        with self._lock:
+            if self._pending is not None:
+                self._pending.update(user_ids)
+            if self._rankings is None:
+                return
+            for uid in user_ids:
+                self._rankings.remove(uid)
+            for entry in entries:
+                self._rankings.add(entry)
+            self.refreshes += 1
+
+    def recommend(
+        self,
+        case_type: str,
+        governorate: str | None = None,
+        city: str | None = None,
+        max_fee: int | None = None,
+        limit: int = 10,
+        exclude: tuple[int, ...] = (),
+    ) -> list[dict]:
+        """Rank eligible lawyers for a case.
+
+        ``governorate`` and ``max_fee`` are filters; ``city`` boosts same-city lawyers and
+        only filters when no governorate is given.
+        """
+        self._ensure_built()
+        case_type, governorate, city = _norm(case_type), _norm(governorate), _norm(city)
+        limit = min(max(limit, 1), RECOMMEND_MAX)
+        scope = ('governorate', governorate) if governorate else ('city', city) if city else ('all',)
+
+        with self._lock:
+            r = self._rankings
+            lawyers = r.lawyers
+
+            def accept(uid: int) -> bool:
+                entry = lawyers[uid]
+                if uid in exclude or (max_fee is not None and entry['fee'] > max_fee):
+                    return False
+                return not governorate or entry['governorate'] == governorate
+
+            # each list is exact for its own members, so the overall top ``limit`` is among the
+            # heads of: experienced lawyers in scope, everyone in scope, and (with the same-city
+            # boost on top) the same two lists for the requested city, each merged across the fee
+            # bands under the cap
+            keys = [scope + (case_type,), scope + (None,)]
+            if city and scope[0] != 'city':
+                keys += [('city', city, case_type), ('city', city, None)]
+            bands = _fee_bands(max_fee)
+            candidates = {uid for key in keys for uid in r.head(key, bands, limit, accept)}
+            scored = [(*_score(lawyers[uid], case_type, city), uid) for uid in candidates]
+            best = heapq.nlargest(limit, scored, key=lambda item: (item[0], -item[2]))
+            return [
+                {
+                    'lawyer_user_id': uid,
+                    'full_name': lawyers[uid]['full_name'],
+                    'governorate': lawyers[uid]['display_governorate'],
+                    'city': lawyers[uid]['display_city'],
+                    'min_consultation_fee': lawyers[uid]['fee'],
+                    'open_cases': lawyers[uid]['open'],
+                    'score': round(score, 3),
+                    'reasons': reasons,
+                }
+                for score, reasons, uid in best
+            ]
+
+    def stats(self) -> dict:
+        with self._lock:
+            r = self._rankings
+            return {
+                'built': r is not None,
+                'lawyers': len(r.lawyers) if r else 0,
+                'ranked_lists': len(r.lists) if r else 0,
+                'ranked_entries': sum(len(x) for x in r.lists.values()) if r else 0,
+                'built_at': self.built_at,
+                'build_ms': round(self.build_ms, 1),
+                'refreshes': self.refreshes,
+                'change_cursor': self._change_cursor,
+            }
+
+
+LAWYER_INDEX = LawyerIndex()
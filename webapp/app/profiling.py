@@ -0,0 +1,336 @@
+"""On-demand sampling profiler for live requests.
+
+A request is profiled when it falls in the admin-configured sample (``sample_rate``,
+optionally limited to a ``path_prefix``) or carries an ``X-Profile-Token`` header
+signed with the app secret. While a profile is open, a single background thread
+reads the stacks of the request's threads (the event loop thread plus the threadpool
+thread running a sync endpoint for it, for the whole endpoint call; see
+``ProfiledRoute``) every ``APP_PROFILE_INTERVAL_MS`` and
+counts them as folded stacks. Nothing is traced per call, so unprofiled requests pay
+only a random draw and profiled ones a few percent.
+
+Finished profiles, with route, status, wall time and the SQL statements run, are
+written to ``APP_PROFILE_DIR``, which keeps the newest ``APP_PROFILE_RING_SIZE``.
+``folded_stacks`` renders one in the ``frame;frame;frame count`` format read by
+flamegraph.pl, speedscope and inferno.
+"""
+import asyncio
+import functools
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from fastapi.routing import APIRoute
+
+from app.auth import get_secret_key
+from app.db import track_queries
+
+logger = logging.getLogger('hoqouqi.profiling')
+
+PROFILE_DIR = os.getenv('APP_PROFILE_DIR', '.profiles')
+PROFILE_RING_SIZE = int(os.getenv('APP_PROFILE_RING_SIZE', '50'))
+PROFILE_INTERVAL_MS = float(os.getenv('APP_PROFILE_INTERVAL_MS', '5'))
+MAX_CONCURRENT_PROFILES = 4
+PROFILE_HEADER = 'x-profile-token'
+TOKEN_MAX_TTL_SECONDS = 3600
+SQL_TOP = 20
+# the profiler's own admin routes are never profiled
+EXCLUDED_PREFIX = '/api/admin/profil'
+# leaf frames of a thread parked between requests
+IDLE_LEAVES = {('selectors.py', 'select'), ('threading.py', 'wait'), ('queue.py', 'get')}
+# the threads of the profile open in this request's context, if any
+_profile_threads: ContextVar[set | None] = ContextVar('profile_threads', default=None)
+_PROFILE_ID = re.compile(r'\d{13}-[0-9a-f]{8}')
+
+SETTINGS = {
+    'sample_rate': float(os.getenv('APP_PROFILE_SAMPLE_RATE', '0')),
+    'path_prefix': None,
+}
+
+
+class Profile:
+    def __init__(self, method: str, path: str, trigger: str):
+        self.id = f'{int(time.time() * 1000):013d}-{secrets.token_hex(4)}'
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.started_at = time.time()
+        self.threads: set[int] = set()
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.idle_samples = 0
+
+
+_label_cache: dict = {}
+
+
+def _frame_label(code) -> str:
+    label = _label_cache.get(code)
+    if label is None:
+        filename = code.co_filename
+        cwd = os.getcwd() + os.sep
+        if filename.startswith(cwd):
+            filename = filename[len(cwd):]
+        else:
+            filename = '/'.join(filename.split(os.sep)[-2:])
+        label = f'{code.co_name} ({filename}:{code.co_firstlineno})'.replace(';', ':')
+        _label_cache[code] = label
+    return label
+
+
+class Sampler:
+    """One thread samples every open profile; it parks on an event while none are open."""
+
+    def __init__(self, interval_s: float):
+        self.interval_s = interval_s
+        self._lock = threading.Lock()
+        self._profiles: list[Profile] = []
+        self._wake = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def open(self, profile: Profile) -> bool:
+        with self._lock:
+            if len(self._profiles) >= MAX_CONCURRENT_PROFILES:
+                return False
+            self._profiles.append(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return True
+
+    def close(self, profile: Profile) -> None:
+        with self._lock:
+            if profile in self._profiles:
+                self._profiles.remove(profile)
+
+    @property
+    def active(self) -> int:
+        return len(self._profiles)
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait()
+            # jittered, and before the first sample, so samples are not phase-locked to request starts
+            time.sleep(self.interval_s * random.uniform(0.5, 1.5))
+            with self._lock:
+                profiles = list(self._profiles)
+                if not profiles:
+                    self._wake.clear()
+                    continue
+            frames = sys._current_frames()
+            for profile in profiles:
+                for ident in list(profile.threads):
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        self._sample(profile, frame)
+            del frames
+
+    @staticmethod
+    def _sample(profile: Profile, frame) -> None:
+        leaf = frame.f_code
+        if (os.path.basename(leaf.co_filename), leaf.co_name) in IDLE_LEAVES:
+            profile.idle_samples += 1
+            return
+        stack = []
+        while frame is not None:
+            stack.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        stack.reverse()
+        profile.stacks[';'.join(stack)] += 1
+        profile.samples += 1
+
+
+SAMPLER = Sampler(PROFILE_INTERVAL_MS / 1000)
+
+
+def issue_profile_token(ttl_seconds: int) -> tuple[str, int]:
+    expires = int(time.time()) + min(max(ttl_seconds, 1), TOKEN_MAX_TTL_SECONDS)
+    sig = hmac.new(get_secret_key().encode(), f'profile:{expires}'.encode(), hashlib.sha256).hexdigest()
+    return f'{expires}.{sig}', expires
+
+
+def verify_profile_token(token: str) -> bool:
+    try:
+        expires, sig = token.split('.', 1)
+        expected = hmac.new(get_secret_key().encode(), f'profile:{int(expires)}'.encode(), hashlib.sha256).hexdigest()
+    except (ValueError, RuntimeError):
+        return False
+    return hmac.compare_digest(sig, expected) and int(expires) >= time.time()
+
+
+def _trigger(method: str, path: str, headers: list) -> str | None:
+    if path.startswith(EXCLUDED_PREFIX):
+        return None
+    for name, value in headers:
+        if name == PROFILE_HEADER.encode():
+            return 'header' if verify_profile_token(value.decode('latin-1')) else None
+    rate = SETTINGS['sample_rate']
+    if rate <= 0:
+        return None
+    prefix = SETTINGS['path_prefix']
+    if prefix and not path.startswith(prefix):
+        return None
+    return 'sampled' if random.random() < rate else None
+
+
+def _profile_path(profile_id: str) -> str | None:
+    if not _PROFILE_ID.fullmatch(profile_id):
+        return None
+    return os.path.join(PROFILE_DIR, f'{profile_id}.json')
+
+
+def save_profile(record: dict) -> None:
+    """Write a finished profile and drop the oldest ones beyond the ring size."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = _profile_path(record['id'])
+    with open(path + '.tmp', 'w', encoding='utf-8') as fh:
+        json.dump(record, fh, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+    names = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith('.json'))
+    for name in names[:-max(PROFILE_RING_SIZE, 1)]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except FileNotFoundError:
+            pass
+
+
+def load_profile(profile_id: str) -> dict | None:
+    path = _profile_path(profile_id)
+    if path is None:
+        return None
+    try:
+        with open(path, encoding='utf-8') as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
+def list_profiles() -> list[dict]:
+    """Stored profiles, newest first, without their stacks."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    summaries = []
+    for name in sorted((n for n in os.listdir(PROFILE_DIR) if n.endswith('.json')), reverse=True):
+        record = load_profile(name[:-5])
+        if record is not None:
+            record.pop('stacks', None)
+            summaries.append(record)
+    return summaries
+
+
+def merge_profiles(route: str | None = None) -> dict:
+    """Sum the stacks of every stored profile (of one route), for requests too short to sample well alone."""
+    stacks: Counter = Counter()
+    merged = 0
+    for summary in list_profiles():
+        if route is not None and summary['route'] != route:
+            continue
+        record = load_profile(summary['id'])
+        if record is not None:
+            stacks.update(record['stacks'])
+            merged += 1
+    return {'route': route, 'profiles': merged, 'stacks': dict(stacks)}
+
+
+def folded_stacks(record: dict) -> str:
+    return ''.join(f'{stack} {count}\n' for stack, count in sorted(record['stacks'].items()))
+
+
+def profiling_settings() -> dict:
+    return {**SETTINGS, 'interval_ms': PROFILE_INTERVAL_MS, 'ring_size': PROFILE_RING_SIZE, 'active': SAMPLER.active}
+
+
+def _record(profile: Profile, route: str | None, status: int | None, duration_s: float, statements: list[str]) -> dict:
+    return {
+        'id': profile.id,
+        'method': profile.method,
+        'path': profile.path,
+        'route': route,
+        'status': status,
+        'trigger': profile.trigger,
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(profile.started_at)),
+        'duration_ms': round(duration_s * 1000, 2),
+        'interval_ms': PROFILE_INTERVAL_MS,
+        'samples': profile.samples,
+        'idle_samples': profile.idle_samples,
+        'sql_count': len(statements),
+        'sql': [{'statement': sql, 'count': n} for sql, n in Counter(' '.join(s.split()) for s in statements).most_common(SQL_TOP)],
+        'stacks': dict(profile.stacks),
+    }
+
+
+class ProfilingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        trigger = _trigger(scope['method'], scope['path'], scope['headers']) if scope['type'] == 'http' else None
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+        profile = Profile(scope['method'], scope['path'], trigger)
+        if not SAMPLER.open(profile):
+            await self.app(scope, receive, send)
+            return
+        status = None
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                message.setdefault('headers', []).append((b'x-profile-id', profile.id.encode()))
+            await send(message)
+
+        # the event loop thread; a sync endpoint's threadpool thread joins for its call
+        profile.threads.add(threading.get_ident())
+        token = _profile_threads.set(profile.threads)
+        started = time.perf_counter()
+        try:
+            with track_queries() as statements:
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            _profile_threads.reset(token)
+            duration = time.perf_counter() - started
+            SAMPLER.close(profile)
+            record = _record(profile, getattr(scope.get('route'), 'path', None), status, duration, statements)
+            try:
+                await asyncio.to_thread(save_profile, record)
+            except OSError as exc:
+                logger.warning('could not store profile %s: %s', profile.id, exc)
+
+
+def _joins_profile(endpoint):
+    """Wrap a sync endpoint so its threadpool thread is sampled while it runs."""
+    @functools.wraps(endpoint)
+    def run(*args, **kwargs):
+        threads = _profile_threads.get()
+        ident = threading.get_ident()
+        if threads is None or ident in threads:
+            return endpoint(*args, **kwargs)
+        # and leaves afterwards: the pool thread goes on to serve other requests
+        threads.add(ident)
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            threads.discard(ident)
+    return run
+
+
+class ProfiledRoute(APIRoute):
+    """Route class whose sync endpoints join the open profile, rendering and hashing included."""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if not asyncio.iscoroutinefunction(endpoint):
+            endpoint = _joins_profile(endpoint)
+        super().__init__(path, endpoint, **kwargs)
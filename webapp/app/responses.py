@@ -0,0 +1,39 @@
+"""Lean JSON responses for list endpoints.
+
+List handlers read rows as plain tuples (no ``sqlite3.Row``), zip them with the
+column names once, and hand the result to ``FastJSONResponse``, which encodes it
+straight to bytes. Returning a ``Response`` skips FastAPI's ``jsonable_encoder``,
+which would otherwise walk and copy every row again. Encoding uses ``orjson``
+(pinned in requirements.txt); the stdlib encoder only covers environments that
+were installed without it.
+"""
+import json
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # not installed from requirements.txt
+    orjson = None
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONResponse(Response):
+    media_type = 'application/json'
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def fetch_records(conn, sql: str, params=()) -> list[dict]:
+    """Run ``sql`` and return its rows as dicts keyed by the selected column names."""
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute(sql, params)
+    columns = tuple(d[0] for d in cur.description)
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
@@ -0,0 +1,177 @@
+"""Full-text search over case titles, descriptions and messages (SQLite FTS5).
+
+``unicode61`` alone splits Arabic words at every haraka and treats أ/ا or ة/ه as
+different letters, so both the index and the queries go through the same
+normalisation: harakat and tatweel are dropped and alef/yaa/taa-marbuta variants
+are folded (case folding is left to the tokenizer). The triggers apply it in SQL
+(nested ``replace``), so rows written by any connection (migrations, the sqlite3
+shell) are indexed the same way.
+
+The FTS tables use external content: ``cases_fts`` (main file) and ``messages_fts``
+(the messages file, next to its table) read their text back from views of the
+normalised columns, so text is not stored twice and snippets come from the
+normalised form. Access control is part of the index: a case document carries
+``u<user_id>`` tokens for its client and lawyer, and a message document carries a
+``c<case_id>`` token. A search ANDs the caller's tokens into the match, so FTS
+intersects posting lists instead of visiting every document that contains a
+common word.
+
+Cases are ranked by ``bm25`` with title hits weighted over the description.
+Message hits come newest first: ``bm25`` counts each term's documents over the
+whole index, which at millions of messages costs more than the search itself.
+A case matched only through its messages ranks after the cases matched by title
+or description.
+"""
+import html
+import re
+
+# harakat (fathatan .. sukun), superscript alef, tatweel
+_STRIP = [chr(c) for c in range(0x064B, 0x0653)] + ['ٰ', 'ـ']
+_FOLD = {'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ى': 'ي', 'ة': 'ه'}
+_TRANSLATE = str.maketrans({**{ch: None for ch in _STRIP}, **_FOLD})
+# attached prefixes a query word may carry in the text: "ايجار" also finds "الايجار", "بالايجار", ...
+ARTICLE_PREFIXES = ('ال', 'وال', 'بال', 'فال', 'كال')
+MAX_QUERY_TERMS = 8
+SEARCH_MAX = 50
+_HIT_START, _HIT_END = '\x02', '\x03'
+
+
+def normalize_arabic(text: str) -> str:
+    return text.translate(_TRANSLATE)
+
+
+def _normalized_sql(expr: str) -> str:
+    """The SQL equivalent of ``normalize_arabic`` for use inside views and triggers."""
+    for ch in _STRIP:
+        expr = f"replace({expr}, '{ch}', '')"
+    for src, dst in _FOLD.items():
+        expr = f"replace({expr}, '{src}', '{dst}')"
+    return expr
+
+
+_TITLE = _normalized_sql('{row}.title')
+_DESCRIPTION = _normalized_sql("COALESCE({row}.description, '')")
+_CONTENT = _normalized_sql('{row}.content')
+_PARTIES = "'u' || {row}.client_user_id || COALESCE(' u' || {row}.lawyer_user_id, '')"
+
+CASES_FTS_SCHEMA = f'''
+CREATE VIEW IF NOT EXISTS cases_fts_source AS
+  SELECT c.id, {_TITLE.format(row='c')} AS title, {_DESCRIPTION.format(row='c')} AS description, {_PARTIES.format(row='c')} AS parties
+  FROM cases c;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS cases_fts USING fts5(
+  title, description, parties, content='cases_fts_source', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_cases_fts_insert AFTER INSERT ON cases BEGIN
+  INSERT INTO cases_fts (rowid, title, description, parties) VALUES (new.id, {_TITLE.format(row='new')}, {_DESCRIPTION.format(row='new')}, {_PARTIES.format(row='new')});
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_cases_fts_delete AFTER DELETE ON cases BEGIN
+  INSERT INTO cases_fts (cases_fts, rowid, title, description, parties) VALUES ('delete', old.id, {_TITLE.format(row='old')}, {_DESCRIPTION.format(row='old')}, {_PARTIES.format(row='old')});
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_cases_fts_update AFTER UPDATE OF title, description, client_user_id, lawyer_user_id ON cases BEGIN
+  INSERT INTO cases_fts (cases_fts, rowid, title, description, parties) VALUES ('delete', old.id, {_TITLE.format(row='old')}, {_DESCRIPTION.format(row='old')}, {_PARTIES.format(row='old')});
+  INSERT INTO cases_fts (rowid, title, description, parties) VALUES (new.id, {_TITLE.format(row='new')}, {_DESCRIPTION.format(row='new')}, {_PARTIES.format(row='new')});
+END;
+'''
+
+MESSAGES_FTS_SCHEMA = f'''
+CREATE VIEW IF NOT EXISTS messages_fts_source AS
+  SELECT m.id, 'c' || m.case_id AS case_key, {_CONTENT.format(row='m')} AS content FROM messages m;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+  case_key, content, content='messages_fts_source', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS trg_messages_fts_insert AFTER INSERT ON messages BEGIN
+  INSERT INTO messages_fts (rowid, case_key, content) VALUES (new.id, 'c' || new.case_id, {_CONTENT.format(row='new')});
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_messages_fts_delete AFTER DELETE ON messages BEGIN
+  INSERT INTO messages_fts (messages_fts, rowid, case_key, content) VALUES ('delete', old.id, 'c' || old.case_id, {_CONTENT.format(row='old')});
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_messages_fts_update AFTER UPDATE OF case_id, content ON messages BEGIN
+  INSERT INTO messages_fts (messages_fts, rowid, case_key, content) VALUES ('delete', old.id, 'c' || old.case_id, {_CONTENT.format(row='old')});
+  INSERT INTO messages_fts (rowid, case_key, content) VALUES (new.id, 'c' || new.case_id, {_CONTENT.format(row='new')});
+END;
+'''
+
+
+def backfill_fts(conn, fts: str, source: str) -> None:
+    """Index rows written before the FTS table existed (first start after the upgrade)."""
+    if conn.execute(f'SELECT 1 FROM {source} LIMIT 1').fetchone() and not conn.execute(f'SELECT 1 FROM {fts}_docsize LIMIT 1').fetchone():
+        conn.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+
+def build_match(query: str) -> str | None:
+    """Turn free text into an FTS5 expression: every word must match, in any of its prefixed forms."""
+    words = re.findall(r'\w+', normalize_arabic(query))[:MAX_QUERY_TERMS]
+    if not words:
+        return None
+    groups = []
+    for word in words:
+        forms = [word]
+        if re.match(r'[\u0600-\u06ff]', word):
+            base = next((word[len(p):] for p in ARTICLE_PREFIXES if word.startswith(p) and len(word) - len(p) >= 2), word)
+            # ل + ال contracts to لل
+            forms = [base, *(p + base for p in ARTICLE_PREFIXES), 'لل' + base]
+        groups.append('(' + ' OR '.join(f'"{form}"' for form in dict.fromkeys(forms)) + ')')
+    return ' AND '.join(groups)
+
+
+def _snippet_html(text: str) -> str:
+    return html.escape(text).replace(_HIT_START, '<mark>').replace(_HIT_END, '</mark>')
+
+
+def search_cases(conn, user_id: int, query: str, limit: int = 20) -> list[dict]:
+    """Cases the user is a party to that match ``query``, best first, with highlighted snippets."""
+    match = build_match(query)
+    if match is None:
+        return []
+    snippet_args = f"'{_HIT_START}', '{_HIT_END}', '…', 16"
+    hits: dict[int, dict] = {}
+    case_rows = conn.execute(
+        f'''
+        SELECT rowid, bm25(cases_fts, 4.0, 1.0, 0.0) AS rank,
+               highlight(cases_fts, 0, '{_HIT_START}', '{_HIT_END}') AS title, snippet(cases_fts, 1, {snippet_args}) AS snippet
+        FROM cases_fts WHERE cases_fts MATCH ? ORDER BY rank LIMIT ?
+        ''',
+        (f'parties : u{user_id} AND {{title description}} : ({match})', limit),
+    ).fetchall()
+    for row in case_rows:
+        hits[row['rowid']] = {
+            'rank': round(row['rank'], 4),
+            'snippets': [{'source': 'case', 'title_html': _snippet_html(row['title']), 'html': _snippet_html(row['snippet'])}],
+        }
+
+    case_ids = [row[0] for row in conn.execute('SELECT id FROM cases WHERE client_user_id = ? OR lawyer_user_id = ?', (user_id, user_id))]
+    if case_ids:
+        case_keys = ' OR '.join(f'c{case_id}' for case_id in case_ids)
+        message_rows = conn.execute(
+            f'''
+            SELECT f.rowid, m.case_id, snippet(messages_fts, 1, {snippet_args}) AS snippet
+            FROM messages_fts f JOIN messages m ON m.id = f.rowid
+            WHERE messages_fts MATCH ? ORDER BY f.rowid DESC LIMIT ?
+            ''',
+            (f'case_key : ({case_keys}) AND content : ({match})', limit * 3),
+        ).fetchall()
+        for row in message_rows:
+            hit = hits.setdefault(row['case_id'], {'rank': None, 'snippets': []})
+            if len(hit['snippets']) < 3:
+                hit['snippets'].append({'source': 'message', 'message_id': row['rowid'], 'html': _snippet_html(row['snippet'])})
+
+    # dicts keep insertion order: bm25-ranked case hits first, then message-only hits newest first
+    ranked = list(hits.items())[:limit]
+    if not ranked:
+        return []
+    placeholders = ', '.join('?' for _ in ranked)
+    cases = {
+        row['case_id']: row for row in conn.execute(
+            f'SELECT id AS case_id, title, case_type, status, created_at FROM cases WHERE id IN ({placeholders})',
+            [case_id for case_id, _ in ranked],
+        )
+    }
+    return [{**dict(cases[case_id]), **hit} for case_id, hit in ranked if case_id in cases]
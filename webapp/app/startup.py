@@ -0,0 +1,40 @@
+"""Cold-start bookkeeping for worker processes.
+
+``startup_phase`` times each step of bringing a worker up (module import when the
+entrypoint records it, schema check, template warm-up, ...) into ``STARTUP_REPORT``,
+which is logged once the worker is ready and served at ``/api/admin/startup``.
+
+With ``APP_FAST_START`` on (the default), a worker whose database files already carry
+the current schema version skips the schema and migration script entirely.
+"""
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger('hoqouqi.startup')
+
+FAST_START = os.getenv('APP_FAST_START', 'true').lower() == 'true'
+
+STARTUP_REPORT: dict = {'fast_start': FAST_START, 'pid': os.getpid(), 'phases': {}, 'ready_at': None}
+
+
+def record_phase(name: str, seconds: float) -> None:
+    STARTUP_REPORT['phases'][name] = round(seconds * 1000, 2)
+
+
+@contextmanager
+def startup_phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - started)
+
+
+def mark_ready() -> dict:
+    STARTUP_REPORT['pid'] = os.getpid()
+    STARTUP_REPORT['ready_at'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    STARTUP_REPORT['total_ms'] = round(sum(STARTUP_REPORT['phases'].values()), 2)
+    logger.info('worker %s ready in %.1f ms: %s', STARTUP_REPORT['pid'], STARTUP_REPORT['total_ms'], STARTUP_REPORT['phases'])
+    return STARTUP_REPORT
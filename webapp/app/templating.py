@@ -0,0 +1,154 @@
+"""Jinja environment with a persistent bytecode cache and a fragment cache tag.
+
+Compiled template bytecode is written to ``APP_TEMPLATE_CACHE_DIR`` so a fresh worker
+loads it instead of re-parsing every template, and ``precompile_templates`` loads
+them all at startup so no request pays the compile cost.
+
+``{% cache 'name', key, ... %}...{% endcache %}`` stores the rendered block in a
+bounded in-process LRU keyed by its arguments. Callers put a data version in the
+key (see ``data_version``): the ``data_versions`` rows are bumped by triggers on
+every write to the underlying tables, so a changed row yields a new key rather
+than a stale fragment, across worker processes too.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, nodes, select_autoescape
+from jinja2.ext import Extension
+
+logger = logging.getLogger('hoqouqi.templating')
+
+TEMPLATE_DIR = 'templates'
+TEMPLATE_CACHE_DIR = os.getenv('APP_TEMPLATE_CACHE_DIR', '.template-cache')
+TEMPLATE_AUTO_RELOAD = os.getenv('APP_TEMPLATE_AUTO_RELOAD', 'true').lower() == 'true'
+FRAGMENT_CACHE_MAX_BYTES = int(os.getenv('APP_FRAGMENT_CACHE_MAX_BYTES', str(8 * 1024 * 1024)))
+
+
+class FragmentCache:
+    """LRU of rendered fragments, bounded by the total size of the cached text."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: tuple, value: str) -> None:
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old)
+            self._entries[key] = value
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'evictions': self.evictions,
+            }
+
+
+FRAGMENTS = FragmentCache(FRAGMENT_CACHE_MAX_BYTES)
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render_cached', [nodes.List(key)]), [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, key: list, caller):
+        key = tuple(key)
+        rendered = FRAGMENTS.get(key)
+        if rendered is None:
+            rendered = caller()
+            FRAGMENTS.set(key, rendered)
+        return rendered
+
+
+def _bytecode_cache() -> FileSystemBytecodeCache | None:
+    if not TEMPLATE_CACHE_DIR:
+        return None
+    try:
+        os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+    except OSError as exc:
+        logger.warning('template bytecode cache disabled: %s', exc)
+        return None
+    return FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+
+
+TEMPLATE_ENV = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    autoescape=select_autoescape(),
+    auto_reload=TEMPLATE_AUTO_RELOAD,
+    bytecode_cache=_bytecode_cache(),
+    extensions=[FragmentCacheExtension],
+)
+
+PRECOMPILE_STATS: dict = {}
+
+
+def precompile_templates() -> dict:
+    """Load every template into the environment's cache (from bytecode when available)."""
+    started = time.perf_counter()
+    names = TEMPLATE_ENV.list_templates(extensions=('html',))
+    for name in names:
+        TEMPLATE_ENV.get_template(name)
+    PRECOMPILE_STATS.update({'templates': len(names), 'ms': round((time.perf_counter() - started) * 1000, 1)})
+    return PRECOMPILE_STATS
+
+
+def data_version(conn, *names: str) -> str:
+    """A key part that changes whenever any of the named tables is written."""
+    placeholders = ','.join('?' * len(names))
+    rows = dict(conn.execute(f'SELECT name, version FROM data_versions WHERE name IN ({placeholders})', names).fetchall())
+    return '/'.join(f'{name}:{rows.get(name, 0)}' for name in names)
+
+
+def template_cache_stats() -> dict:
+    return {
+        'precompiled': PRECOMPILE_STATS,
+        'bytecode_cache_dir': TEMPLATE_CACHE_DIR if TEMPLATE_ENV.bytecode_cache else None,
+        'auto_reload': TEMPLATE_ENV.auto_reload,
+        'fragments': FRAGMENTS.stats(),
+    }
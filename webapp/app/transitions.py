@@ -0,0 +1,115 @@
+"""Guarded state transitions for payments and cases.
+
+Each transition is one ``UPDATE ... WHERE id = ? AND <state guard> RETURNING *``,
+so a handler's read-check-write collapses into a single statement. Run these on
+``get_conn(immediate=True)`` so the write lock is taken before the statement
+rather than upgraded from a shared lock mid-transaction.
+"""
+import sqlite3
+
+PAYMENT_TRANSITIONS = {
+    'process': {
+        'guard': {'status': ('pending',)},
+        'set': {'status': 'paid'},
+        'conflict': 'Only pending payments can be processed',
+    },
+    'release': {
+        'guard': {'status': ('paid',), 'escrow_status': ('held',)},
+        'set': {'escrow_status': 'released'},
+        'conflict': 'Only paid payments can be released',
+    },
+    'refund': {
+        'guard': {'status': ('pending', 'paid'), 'escrow_status': ('held',)},
+        'set': {'status': 'refunded', 'escrow_status': 'returned'},
+        'conflict': 'Only payments still held in escrow can be refunded',
+    },
+}
+
+# target status -> statuses it may be entered from
+CASE_STATUS_TRANSITIONS = {
+    'pending': ('rejected',),
+    'accepted': ('pending',),
+    'rejected': ('pending', 'accepted'),
+    'in_progress': ('accepted',),
+    'completed': ('in_progress',),
+    'cancelled': ('pending', 'accepted', 'in_progress'),
+}
+CASE_ASSIGNABLE_STATUSES = ('pending', 'accepted')
+
+
+class TransitionError(Exception):
+    """Raised when a guarded update matched no row; ``current`` holds the row's state, if any."""
+
+    def __init__(self, status_code: int, detail: str, current: dict | None = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.current = current
+
+
+def _guarded_update(conn, table: str, row_id: int, assignments: list[tuple[str, tuple]], guard: dict, scope: tuple[str, tuple] | None = None) -> sqlite3.Row | None:
+    set_sql = ', '.join(fragment for fragment, _ in assignments)
+    params = [p for _, values in assignments for p in values]
+    where = ['id = ?']
+    params.append(row_id)
+    for column, allowed in guard.items():
+        where.append(f"{column} IN ({','.join('?' * len(allowed))})")
+        params.extend(allowed)
+    if scope:
+        where.append(scope[0])
+        params.extend(scope[1])
+    sql = f"UPDATE {table} SET {set_sql} WHERE {' AND '.join(where)} RETURNING *"
+    return conn.execute(sql, params).fetchone()
+
+
+def _failure(conn, table: str, row_id: int, label: str, columns: tuple[str, ...], detail: str) -> TransitionError:
+    # only reached when the guarded update missed, so the happy path stays one statement
+    current = conn.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE id = ?", (row_id,)).fetchone()
+    if not current:
+        return TransitionError(404, f'{label} not found')
+    return TransitionError(409, detail, dict(current))
+
+
+def transition_payment(conn, payment_id: int, action: str, transaction_ref: str | None = None, notes: str | None = None) -> sqlite3.Row:
+    rule = PAYMENT_TRANSITIONS[action]
+    assignments = [(f'{column} = ?', (value,)) for column, value in rule['set'].items()]
+    if action == 'process':
+        assignments.append(('transaction_ref = ?', (transaction_ref,)))
+        assignments.append(('notes = ?', (notes,)))
+    elif action == 'release':
+        assignments.append(('notes = COALESCE(?, notes)', (notes,)))
+    else:
+        assignments.append(('notes = ?', (notes,)))
+    assignments.append(('updated_at = CURRENT_TIMESTAMP', ()))
+
+    row = _guarded_update(conn, 'payments', payment_id, assignments, rule['guard'])
+    if row is None:
+        raise _failure(conn, 'payments', payment_id, 'Payment', ('id', 'status', 'escrow_status'), rule['conflict'])
+    return row
+
+
+def transition_case_status(conn, case_id: int, status: str, participant_user_id: int | None = None) -> sqlite3.Row:
+    """Move a case to ``status``; ``participant_user_id`` restricts the update to that user's cases."""
+    scope = None
+    if participant_user_id is not None:
+        scope = ('(client_user_id = ? OR lawyer_user_id = ?)', (participant_user_id, participant_user_id))
+    row = _guarded_update(conn, 'cases', case_id, [('status = ?', (status,))], {'status': CASE_STATUS_TRANSITIONS[status]}, scope)
+    if row is None:
+        error = _failure(conn, 'cases', case_id, 'Case', ('id', 'status', 'client_user_id', 'lawyer_user_id'), f'Case cannot move to {status} from its current status')
+        if error.current and participant_user_id is not None and participant_user_id not in {error.current['client_user_id'], error.current['lawyer_user_id']}:
+            raise TransitionError(403, 'Forbidden')
+        raise error
+    return row
+
+
+def assign_case_lawyer(conn, case_id: int, lawyer_user_id: int) -> sqlite3.Row:
+    row = _guarded_update(
+        conn,
+        'cases',
+        case_id,
+        [('lawyer_user_id = ?', (lawyer_user_id,)), ('status = ?', ('accepted',))],
+        {'status': CASE_ASSIGNABLE_STATUSES},
+    )
+    if row is None:
+        raise _failure(conn, 'cases', case_id, 'Case', ('id', 'status', 'lawyer_user_id'), 'Only pending or accepted cases can be assigned')
+    return row
@@ -0,0 +1,565 @@
+"""Local micro-benchmarks for hot paths.
+
+Runs the app in-process against a throwaway SQLite file:
+
+    python bench.py            # all benchmarks
+    python bench.py batch      # only benchmarks whose name contains "batch"
+    python bench.py --split    # put messages/audit_logs in their own database files
+"""
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+_tmpdir = tempfile.mkdtemp(prefix='hq-bench-')
+os.environ.setdefault('APP_SECRET_KEY', 'bench-secret-key')
+os.environ.setdefault('APP_COOKIE_SECURE', 'false')
+os.environ['APP_DB_PATH'] = os.path.join(_tmpdir, 'bench.db')
+os.environ['APP_JOB_WORKERS'] = '0'
+os.environ['APP_PROFILE_DIR'] = os.path.join(_tmpdir, 'profiles')
+os.environ['APP_BACKUP_DIR'] = os.path.join(_tmpdir, 'backups')
+if '--split' in sys.argv:
+    sys.argv.remove('--split')
+    os.environ['APP_MESSAGES_DB_PATH'] = os.path.join(_tmpdir, 'bench-messages.db')
+    os.environ['APP_AUDIT_DB_PATH'] = os.path.join(_tmpdir, 'bench-audit.db')
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.auth import create_csrf_token, create_session_token, hash_password  # noqa: E402
+from app.backups import create_backup  # noqa: E402
+from app.db import get_conn, init_db  # noqa: E402
+from app.main import MESSAGE_WRITER, _insert_message, app, log_action  # noqa: E402
+from app.maintenance import run_maintenance  # noqa: E402
+from app.load_shedding import LIMITERS  # noqa: E402
+from app.matching import LAWYER_INDEX  # noqa: E402
+from app.profiling import SETTINGS as PROFILING_SETTINGS, merge_profiles  # noqa: E402
+from app.search import search_cases  # noqa: E402
+from app.templating import FRAGMENTS, TEMPLATE_DIR, TEMPLATE_ENV, FragmentCacheExtension  # noqa: E402
+from app.transitions import transition_payment  # noqa: E402
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+def _seed_users():
+    pw = hash_password('bench-password')
+    with get_conn() as conn:
+        ids = {}
+        for user_type in ('admin', 'client', 'lawyer'):
+            cur = conn.execute(
+                'INSERT INTO users (email, password_hash, user_type, full_name, is_verified) VALUES (?, ?, ?, ?, 1)',
+                (f'{user_type}@bench.local', pw, user_type, f'Bench {user_type}'),
+            )
+            ids[user_type] = cur.lastrowid
+        conn.execute('INSERT INTO lawyers (user_id, bar_registration_number) VALUES (?, ?)', (ids['lawyer'], 'BENCH-1'))
+    return ids
+
+
+def _seed_payments(ids, count):
+    with get_conn() as conn:
+        cur = conn.execute(
+            'INSERT INTO cases (client_user_id, lawyer_user_id, title, case_type, description, status) VALUES (?, ?, ?, ?, ?, ?)',
+            (ids['client'], ids['lawyer'], 'Bench case', 'civil', 'Bench case description', 'accepted'),
+        )
+        case_id = cur.lastrowid
+        first = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM payments').fetchone()[0]
+        conn.executemany(
+            'INSERT INTO payments (case_id, client_user_id, lawyer_user_id, amount) VALUES (?, ?, ?, ?)',
+            [(case_id, ids['client'], ids['lawyer'], 500) for _ in range(count)],
+        )
+    return list(range(first, first + count))
+
+
+def _client_for(user_id, user_type):
+    client = TestClient(app)
+    client.cookies.set('hq_session', create_session_token(user_id, user_type))
+    return client
+
+
+def _report(name, ops, elapsed):
+    print(f'{name:<40} {ops:>8} ops  {elapsed * 1000:>9.1f} ms  {ops / elapsed:>10.0f} ops/s')
+
+
+@benchmark('payments.single_requests')
+def bench_payments_single(ids, n=200):
+    client = _client_for(ids['admin'], 'admin')
+    payment_ids = _seed_payments(ids, n)
+    start = time.perf_counter()
+    for pid in payment_ids:
+        client.post(f'/api/payments/{pid}/process', json={})
+        client.post(f'/api/payments/{pid}/release', json={})
+    _report('payments.single_requests', n * 2, time.perf_counter() - start)
+
+
+@benchmark('payments.batch')
+def bench_payments_batch(ids, n=200):
+    client = _client_for(ids['admin'], 'admin')
+    payment_ids = _seed_payments(ids, n)
+    items = [{'payment_id': pid, 'action': 'process'} for pid in payment_ids]
+    items += [{'payment_id': pid, 'action': 'release'} for pid in payment_ids]
+    start = time.perf_counter()
+    res = client.post('/api/admin/payments/batch', json={'items': items})
+    assert res.status_code == 200 and res.json()['data']['failed'] == 0, res.text
+    _report('payments.batch', len(items), time.perf_counter() - start)
+
+
+@benchmark('cases.detail_and_messages_pages')
+def bench_case_pages(ids, n=200, thread_size=2000):
+    client = _client_for(ids['client'], 'client')
+    _seed_payments(ids, 5)
+    case_id = client.get('/api/cases').json()['data'][0]['id']
+    with get_conn() as conn:
+        conn.executemany(
+            'INSERT INTO messages (case_id, sender_user_id, receiver_user_id, content) VALUES (?, ?, ?, ?)',
+            [(case_id, ids['client'], ids['lawyer'], f'message {i}') for i in range(thread_size)],
+        )
+
+    # the one-query-per-page guarantee is checked in tests/test_case_pages.py
+    start = time.perf_counter()
+    for _ in range(n):
+        client.get(f'/cases/{case_id}')
+        client.get(f'/cases/{case_id}/messages')
+    _report('cases.detail_and_messages_pages', n * 2, time.perf_counter() - start)
+
+
+@benchmark('writes.mixed_messages_payments')
+def bench_mixed_writes(ids, seconds=3.0, message_writers=4, payment_writers=2):
+    """Concurrent chat inserts and payment transitions, each followed by an audit row (as the handlers do)."""
+    payment_ids = _seed_payments(ids, 20000)
+    with get_conn() as conn:
+        case_id = conn.execute('SELECT MAX(id) FROM cases').fetchone()[0]
+    counts = {'messages': 0, 'payments': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+    payment_iter = iter(payment_ids)
+
+    def send_messages():
+        while time.perf_counter() < deadline:
+            try:
+                with get_conn(db='messages') as conn:
+                    msg_id = conn.execute(
+                        'INSERT INTO messages (case_id, sender_user_id, receiver_user_id, content) VALUES (?, ?, ?, ?)',
+                        (case_id, ids['client'], ids['lawyer'], 'bench message'),
+                    ).lastrowid
+                log_action(ids['client'], 'message.sent', 'message', msg_id)
+                key = 'messages'
+            except Exception:
+                key = 'errors'
+            with lock:
+                counts[key] += 1
+
+    def process_payments():
+        while time.perf_counter() < deadline:
+            with lock:
+                pid = next(payment_iter)
+            try:
+                with get_conn(immediate=True) as conn:
+                    transition_payment(conn, pid, 'process', f'BENCH-{pid}')
+                log_action(ids['admin'], 'payment.processed', 'payment', pid)
+                key = 'payments'
+            except Exception:
+                key = 'errors'
+            with lock:
+                counts[key] += 1
+
+    threads = [threading.Thread(target=send_messages) for _ in range(message_writers)]
+    threads += [threading.Thread(target=process_payments) for _ in range(payment_writers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    layout = 'split' if os.getenv('APP_MESSAGES_DB_PATH') else 'single-file'
+    _report(f'writes.mixed[{layout}].messages', counts['messages'], elapsed)
+    _report(f'writes.mixed[{layout}].payments', counts['payments'], elapsed)
+    if counts['errors']:
+        print(f'  ({counts["errors"]} writes failed with lock timeouts)')
+
+
+@benchmark('messages.concurrent_inserts')
+def bench_message_inserts(ids, writers=16, per_writer=100):
+    _seed_payments(ids, 1)  # makes sure a case exists
+    with get_conn() as conn:
+        case_id = conn.execute('SELECT MAX(id) FROM cases').fetchone()[0]
+    row = (case_id, ids['client'], ids['lawyer'], 'bench message')
+
+    def commit_each():
+        for _ in range(per_writer):
+            with get_conn(db='messages') as conn:
+                _insert_message(conn, row)
+
+    def group_commit():
+        for _ in range(per_writer):
+            MESSAGE_WRITER.submit(row)
+
+    for label, fn in (('commit_each', commit_each), ('group_commit', group_commit)):
+        threads = [threading.Thread(target=fn) for _ in range(writers)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        _report(f'messages.concurrent_inserts[{label}]', writers * per_writer, time.perf_counter() - start)
+    stats = MESSAGE_WRITER.stats()
+    print(f"  avg batch {stats['avg_batch_size']}, avg commit {stats['avg_commit_ms']} ms, max commit {stats['max_commit_ms']} ms")
+
+
+@benchmark('backup.online')
+def bench_online_backup(ids, cases=20000):
+    """Message insert latency alone and while an online backup of a ~25 MB file runs."""
+    with get_conn() as conn:
+        conn.executemany(
+            'INSERT INTO cases (client_user_id, title, case_type, description) VALUES (?, ?, ?, ?)',
+            [(ids['client'], f'Backup case {i}', 'civil', 'padding ' * 120) for i in range(cases)],
+        )
+        case_id = conn.execute('SELECT MAX(id) FROM cases').fetchone()[0]
+    row = (case_id, ids['client'], ids['lawyer'], 'bench message')
+
+    def write_while(busy):
+        latencies = []
+        while busy():
+            start = time.perf_counter()
+            with get_conn(db='messages') as conn:
+                _insert_message(conn, row)
+            latencies.append(time.perf_counter() - start)
+            time.sleep(0.005)
+        latencies.sort()
+        return latencies
+
+    deadline = time.perf_counter() + 1.0
+    alone = write_while(lambda: time.perf_counter() < deadline)
+    done = threading.Event()
+    result = {}
+    backup = threading.Thread(target=lambda: (result.update(create_backup()), done.set()))
+    backup.start()
+    during = write_while(lambda: not done.is_set())
+    backup.join()
+    for label, latencies in (('alone', alone), ('during_backup', during)):
+        print(f'  message insert {label}: p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, max {latencies[-1] * 1000:.2f} ms ({len(latencies)} writes)')
+    for db, info in result['files'].items():
+        _report(f'backup.online[{db}]', info['steps'], info['duration_ms'] / 1000)
+        print(f"  {info['bytes'] / 1_048_576:.1f} MB at {info['throughput_mb_s']} MB/s, {info['restarts']} restarts, integrity {info['integrity']}")
+
+
+@benchmark('api.list_endpoints')
+def bench_list_endpoints(ids, n=300, rows=100):
+    """JSON list endpoints at their full page size (100 rows each)."""
+    payment_ids = _seed_payments(ids, rows)
+    with get_conn() as conn:
+        case_id = conn.execute('SELECT MAX(id) FROM cases').fetchone()[0]
+        conn.executemany(
+            'INSERT INTO cases (client_user_id, lawyer_user_id, title, case_type, description, status) VALUES (?, ?, ?, ?, ?, ?)',
+            [(ids['client'], ids['lawyer'], f'Bench case {i}', 'civil', 'Bench case description ' * 8, 'accepted') for i in range(rows)],
+        )
+        conn.executemany(
+            'INSERT INTO messages (case_id, sender_user_id, receiver_user_id, content) VALUES (?, ?, ?, ?)',
+            [(case_id, ids['client'], ids['lawyer'], f'bench message {i} ' * 6) for i in range(rows)],
+        )
+    with get_conn(db='audit') as conn:
+        conn.executemany(
+            'INSERT INTO audit_logs (actor_user_id, action, target_type, target_id, metadata) VALUES (?, ?, ?, ?, ?)',
+            [(ids['admin'], 'payment.processed', 'payment', pid, '{"batch": true}') for pid in payment_ids],
+        )
+
+    admin = _client_for(ids['admin'], 'admin')
+    client = _client_for(ids['client'], 'client')
+    endpoints = (
+        ('cases', client, '/api/cases'),
+        ('payments', client, '/api/payments'),
+        ('messages', client, f'/api/messages/{case_id}'),
+        ('audit-logs', admin, '/api/admin/audit-logs'),
+    )
+    for label, http, path in endpoints:
+        res = http.get(path)
+        assert res.status_code == 200 and len(res.json()['data']) >= rows, (path, res.text[:200])
+        start = time.perf_counter()
+        for _ in range(n):
+            http.get(path)
+        _report(f'api.list[{label}]', n, time.perf_counter() - start)
+
+
+@benchmark('load.login_spike')
+def bench_login_spike(ids, attackers=24, seconds=3.0):
+    """Health-check latency while a flood of PBKDF2 logins runs, with and without the auth limit."""
+    auth = LIMITERS['auth']
+    configured = auth.max_concurrent, auth.max_queue
+
+    def run(label):
+        stop = threading.Event()
+        outcomes = {}
+        lock = threading.Lock()
+        counter = iter(range(10**9))
+
+        def attack():
+            client = TestClient(app)
+            client.cookies.set('hq_anon', 'bench-visitor')
+            csrf_token = create_csrf_token('anon:bench-visitor')
+            while not stop.is_set():
+                res = client.post(
+                    '/login',
+                    data={'csrf_token': csrf_token, 'email': 'admin@bench.local', 'password': 'wrong-password'},
+                    headers={'x-forwarded-for': f'10.0.{next(counter) % 250}.{next(counter) % 250}'},
+                    follow_redirects=False,
+                )
+                with lock:
+                    outcomes[res.status_code] = outcomes.get(res.status_code, 0) + 1
+
+        threads = [threading.Thread(target=attack) for _ in range(attackers)]
+        for t in threads:
+            t.start()
+        health = TestClient(app)
+        latencies = []
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            health.get('/api/health')
+            latencies.append(time.perf_counter() - start)
+        stop.set()
+        for t in threads:
+            t.join()
+        latencies.sort()
+        _report(f'load.login_spike[{label}].health', len(latencies), sum(latencies))
+        print(f'  health p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms; login outcomes {dict(sorted(outcomes.items()))}')
+
+    auth.max_concurrent, auth.max_queue = 10**6, 10**6
+    run('unlimited')
+    auth.max_concurrent, auth.max_queue = configured
+    run(f'limit={auth.max_concurrent}')
+
+
+_COLD_START_SCRIPT = '''
+import json, time, wsgiref.util
+started = time.perf_counter()
+import wsgi
+from app.startup import STARTUP_REPORT
+ready = time.perf_counter()
+environ = {'PATH_INFO': '/api/health'}
+wsgiref.util.setup_testing_defaults(environ)
+b''.join(wsgi.application(environ, lambda status, headers, exc_info=None: None))
+print(json.dumps({'ready': ready - started, 'first_request': time.perf_counter() - ready, 'phases': STARTUP_REPORT['phases']}))
+'''
+
+
+@benchmark('startup.cold_start')
+def bench_cold_start(ids, runs=5):
+    """Fresh worker processes through wsgi.py, with the full schema script vs fast start."""
+    for label, fast in (('full_schema', 'false'), ('fast_start', 'true')):
+        results = []
+        for _ in range(runs):
+            out = subprocess.run(
+                [sys.executable, '-c', _COLD_START_SCRIPT],
+                env={**os.environ, 'APP_FAST_START': fast},
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                capture_output=True, text=True, check=True,
+            )
+            results.append(json.loads(out.stdout.splitlines()[-1]))
+        _report(f'startup.ready[{label}]', runs, sum(r['ready'] for r in results))
+        _report(f'startup.first_request[{label}]', runs, sum(r['first_request'] for r in results))
+        phases = {name: round(sum(r['phases'][name] for r in results) / runs, 1) for name in results[0]['phases']}
+        print(f'  mean phase ms: {phases}')
+
+
+@benchmark('profiling.overhead')
+def bench_profiling_overhead(ids, n=200, rows=2000):
+    """/admin/cases with profiling off vs every request profiled."""
+    with get_conn() as conn:
+        conn.executemany(
+            'INSERT INTO cases (client_user_id, lawyer_user_id, title, case_type, description) VALUES (?, ?, ?, ?, ?)',
+            [(ids['client'], ids['lawyer'], f'Profiled case {i}', 'civil', 'description ' * 8) for i in range(rows)],
+        )
+    admin = _client_for(ids['admin'], 'admin')
+    for label, rate in (('off', 0.0), ('every_request', 1.0)):
+        PROFILING_SETTINGS.update(sample_rate=rate, path_prefix='/admin/cases')
+        FRAGMENTS.clear()
+        admin.get('/admin/cases')
+        start = time.perf_counter()
+        for _ in range(n):
+            FRAGMENTS.clear()
+            admin.get('/admin/cases')
+        _report(f'profiling.admin_cases[{label}]', n, time.perf_counter() - start)
+    PROFILING_SETTINGS.update(sample_rate=0.0, path_prefix=None)
+    merged = merge_profiles('/admin/cases')
+    print(f"  stored: {merged['profiles']} profiles, {sum(merged['stacks'].values())} samples, {len(merged['stacks'])} distinct stacks")
+
+
+@benchmark('templates.compile_and_render')
+def bench_templates(ids, lawyers=2000, n=20):
+    from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+    names = TEMPLATE_ENV.list_templates(extensions=('html',))
+    bytecode_dir = os.path.join(_tmpdir, 'template-cache')
+    os.makedirs(bytecode_dir, exist_ok=True)
+
+    def load_all(bytecode_cache):
+        env = Environment(loader=FileSystemLoader(TEMPLATE_DIR), autoescape=True, bytecode_cache=bytecode_cache, extensions=[FragmentCacheExtension])
+        start = time.perf_counter()
+        for name in names:
+            env.get_template(name)
+        return time.perf_counter() - start
+
+    load_all(FileSystemBytecodeCache(bytecode_dir))  # populate
+    _report('templates.cold_load[compile]', len(names), load_all(None))
+    _report('templates.cold_load[bytecode]', len(names), load_all(FileSystemBytecodeCache(bytecode_dir)))
+
+    with get_conn() as conn:
+        first = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM users').fetchone()[0]
+        conn.executemany(
+            "INSERT INTO users (id, email, password_hash, user_type, full_name, is_verified) VALUES (?, ?, 'x', 'lawyer', ?, 1)",
+            [(first + i, f'card{i}@bench.local', f'Card Lawyer {i}') for i in range(lawyers)],
+        )
+        conn.executemany(
+            "INSERT INTO lawyers (user_id, bar_registration_number, governorate, city) VALUES (?, ?, 'Cairo', 'Nasr City')",
+            [(first + i, f'BENCH-C{i}') for i in range(lawyers)],
+        )
+    client = TestClient(app)
+    for label, warm in (('uncached', False), ('fragment_cache', True)):
+        client.get('/search')
+        start = time.perf_counter()
+        for _ in range(n):
+            if not warm:
+                FRAGMENTS.clear()
+            client.get('/search')
+        _report(f'templates.search_page[{label}]', n, time.perf_counter() - start)
+    print(f"  fragment cache: {FRAGMENTS.stats()}")
+
+
+@benchmark('pages.form_csrf')
+def bench_form_pages(ids, visitors=200):
+    """Form pages with stateless CSRF tokens: new visitors, repeat views and conditional revalidation."""
+    for path in ('/login', '/register'):
+        clients = [TestClient(app) for _ in range(visitors)]
+        start = time.perf_counter()
+        first = [client.get(path) for client in clients]
+        _report(f'pages.form_csrf[{path}:first_view]', visitors, time.perf_counter() - start)
+        start = time.perf_counter()
+        repeat = [client.get(path) for client in clients]
+        _report(f'pages.form_csrf[{path}:repeat_view]', visitors, time.perf_counter() - start)
+        start = time.perf_counter()
+        revalidated = [client.get(path, headers={'if-none-match': res.headers['etag']}) for client, res in zip(clients, repeat)]
+        _report(f'pages.form_csrf[{path}:revalidate]', visitors, time.perf_counter() - start)
+        cookies = sum('set-cookie' in res.headers for res in first + repeat)
+        print(f'  {len(repeat[0].content)} B per view, {sum(res.status_code == 304 for res in revalidated)} x 304 ({len(revalidated[0].content)} B), Set-Cookie on {cookies} of {2 * visitors} views')
+
+
+@benchmark('matching.recommend')
+def bench_matching(ids, lawyers=100_000, cases=300_000, queries=2000):
+    rng = random.Random(37)
+    governorates = [f'Governorate {i}' for i in range(27)]
+    case_types = ['civil', 'criminal', 'family', 'labor', 'commercial', 'real_estate', 'administrative', 'tax']
+    with get_conn() as conn:
+        first = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM users').fetchone()[0]
+        conn.executemany(
+            "INSERT INTO users (id, email, password_hash, user_type, full_name, is_verified) VALUES (?, ?, 'x', 'lawyer', ?, ?)",
+            [(first + i, f'lawyer{i}@bench.local', f'Lawyer {i}', 1 if rng.random() < 0.8 else 0) for i in range(lawyers)],
+        )
+        conn.executemany(
+            'INSERT INTO lawyers (user_id, bar_registration_number, governorate, city, min_consultation_fee) VALUES (?, ?, ?, ?, ?)',
+            [
+                (first + i, f'BENCH-L{i}', gov, f'{gov} city {rng.randrange(6)}', rng.choice((200, 400, 600, 900, 1500, 3000, 7000)))
+                for i, gov in ((i, rng.choice(governorates)) for i in range(lawyers))
+            ],
+        )
+        conn.executemany(
+            'INSERT INTO cases (client_user_id, lawyer_user_id, title, case_type, description, status) VALUES (?, ?, ?, ?, ?, ?)',
+            [
+                (ids['client'], first + rng.randrange(lawyers), 'Bench case', rng.choice(case_types), 'Bench case description',
+                 rng.choice(('completed', 'completed', 'in_progress', 'accepted', 'cancelled')))
+                for _ in range(cases)
+            ],
+        )
+
+    stats = LAWYER_INDEX.rebuild()
+    print(f"  index: {stats['lawyers']} lawyers in {stats['ranked_lists']} ranked lists, built in {stats['build_ms']} ms")
+
+    shapes = {
+        'governorate': lambda: {'governorate': rng.choice(governorates)},
+        'governorate+city+fee': lambda: {'governorate': (g := rng.choice(governorates)), 'city': f'{g} city 1', 'max_fee': 1000},
+        'case_type_only': lambda: {},
+        'fee_only': lambda: {'max_fee': 400},
+        'fee_below_everyone': lambda: {'max_fee': 150},
+    }
+    for shape, make in shapes.items():
+        latencies = []
+        for _ in range(queries):
+            kwargs = make()
+            start = time.perf_counter()
+            LAWYER_INDEX.recommend(rng.choice(case_types), **kwargs)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        _report(f'matching.recommend[{shape}]', queries, sum(latencies))
+        print(f'  p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms')
+
+    lawyer_ids = [first + rng.randrange(lawyers) for _ in range(200)]
+    start = time.perf_counter()
+    for uid in lawyer_ids:
+        LAWYER_INDEX.refresh_lawyers([uid])
+    _report('matching.refresh_lawyer', len(lawyer_ids), time.perf_counter() - start)
+
+
+@benchmark('search.fulltext')
+def bench_search(ids, cases=20_000, messages=1_000_000, queries=100):
+    """Participant-scoped search over a large message table: a client with 20 cases, a lawyer with 500."""
+    rng = random.Random(46)
+    words = ['عقد', 'الإيجار', 'المحكمة', 'جلسة', 'النفقة', 'حضانة', 'الميراث', 'شيك', 'تعويض', 'استئناف',
+             'موعد', 'المستندات', 'الأُجْرَة', 'توكيل', 'شهادة', 'الحكم', 'قضية', 'مذكرة', 'دفاع', 'غرامة']
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    with get_conn() as conn:
+        first = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM cases').fetchone()[0]
+        conn.executemany(
+            'INSERT INTO cases (id, client_user_id, lawyer_user_id, title, case_type, description) VALUES (?, ?, ?, ?, ?, ?)',
+            [
+                (first + i, ids['client'] if i < 20 else 10_000 + i, ids['lawyer'] if i < 500 else None,
+                 ' '.join(rng.choices(words, weights, k=4)), 'civil', ' '.join(rng.choices(words, weights, k=20)))
+                for i in range(cases)
+            ],
+        )
+    start = time.perf_counter()
+    with get_conn(db='messages') as conn:
+        for batch in range(0, messages, 50_000):
+            conn.executemany(
+                'INSERT INTO messages (case_id, sender_user_id, receiver_user_id, content) VALUES (?, ?, ?, ?)',
+                [
+                    (first + rng.randrange(cases), ids['client'], ids['lawyer'], ' '.join(rng.choices(words, weights, k=12)))
+                    for _ in range(min(50_000, messages - batch))
+                ],
+            )
+    _report('search.index_messages', messages, time.perf_counter() - start)
+    # what the nightly maintenance run leaves behind: merged FTS segments
+    merge = [step for step in run_maintenance(full=True, trigger='bench', vacuum_budget_ms=120_000)['steps'] if step['step'] == 'fts_merge']
+    print('  fts merge: ' + ', '.join(f"{step['db']} {step['ms']:.0f} ms" for step in merge if step['status'] == 'ok'))
+
+    shapes = {'common_word': 'عقد', 'rare_word': 'غرامة', 'two_words': 'حضانة شهادة', 'folded_article': 'اجره'}
+    for user_type in ('client', 'lawyer'):
+        for shape, query in shapes.items():
+            latencies = []
+            with get_conn() as conn:
+                for _ in range(queries):
+                    start = time.perf_counter()
+                    search_cases(conn, ids[user_type], query)
+                    latencies.append(time.perf_counter() - start)
+            latencies.sort()
+            _report(f'search.fulltext[{user_type}:{shape}]', queries, sum(latencies))
+            print(f'  p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms')
+
+
+def main(argv):
+    selected = [name for name in BENCHMARKS if not argv or any(arg in name for arg in argv)]
+    init_db()
+    ids = _seed_users()
+    for name in selected:
+        BENCHMARKS[name](ids)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
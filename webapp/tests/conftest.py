@@ -0,0 +1,65 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# settings are read when the app is imported, so they are fixed here for the whole session
+WEBAPP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = tempfile.mkdtemp(prefix='hoqouqi-tests-')
+os.environ['APP_SECRET_KEY'] = 'test-secret-key'
+os.environ['APP_COOKIE_SECURE'] = 'false'
+os.environ['APP_DB_PATH'] = os.path.join(DATA_DIR, 'hoqouqi.db')
+os.environ['APP_TEMPLATE_CACHE_DIR'] = ''
+sys.path.insert(0, WEBAPP_DIR)
+os.chdir(WEBAPP_DIR)
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app import db  # noqa: E402
+from app.auth import create_session_token, hash_password  # noqa: E402
+from app.main import app  # noqa: E402
+
+db.init_db()
+
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    """Point every database at new, empty single-file storage under ``tmp_path``."""
+    path = str(tmp_path / 'hoqouqi.db')
+    monkeypatch.setattr(db, 'DB_PATH', path)
+    for name in db.DB_PATHS:
+        monkeypatch.setitem(db.DB_PATHS, name, path)
+    db.init_db()
+    return tmp_path
+
+
+@pytest.fixture
+def make_user():
+    """``make_user(user_type)`` -> ``(user_id, client)`` with a signed-in ``TestClient``."""
+    def make(user_type: str):
+        with db.get_conn() as conn:
+            user_id = conn.execute(
+                'INSERT INTO users (email, password_hash, user_type, full_name) VALUES (?, ?, ?, ?)',
+                (f'{user_type}-{os.urandom(4).hex()}@example.com', hash_password('password1'), user_type, f'Test {user_type}'),
+            ).lastrowid
+            if user_type == 'lawyer':
+                conn.execute(
+                    'INSERT INTO lawyers (user_id, bar_registration_number, governorate, city) VALUES (?, ?, ?, ?)',
+                    (user_id, f'BAR-{user_id}', 'Cairo', 'Nasr City'),
+                )
+        client = TestClient(app)
+        client.cookies.set('hq_session', create_session_token(user_id, user_type))
+        return user_id, client
+    return make
+
+
+@pytest.fixture
+def make_case():
+    def make(client_user_id: int, lawyer_user_id: int | None = None, case_type: str = 'civil') -> int:
+        with db.get_conn() as conn:
+            return conn.execute(
+                'INSERT INTO cases (client_user_id, lawyer_user_id, title, case_type, description) VALUES (?, ?, ?, ?, ?)',
+                (client_user_id, lawyer_user_id, 'Test case', case_type, 'A test case description'),
+            ).lastrowid
+    return make
@@ -0,0 +1,81 @@
+import threading
+import time
+
+from app import main
+from app.circuit import CircuitBreaker
+
+
+def test_full_call_pool_is_rejected_without_tripping_the_breaker(monkeypatch):
+    breaker = CircuitBreaker('test', min_calls=1)
+    release = threading.Event()
+    started = threading.Semaphore(0)
+
+    def stuck_fetch(req, deadline):
+        started.release()
+        release.wait(10)
+        return 'late answer'
+
+    monkeypatch.setenv('GEMINI_API_KEY', 'test-key')
+    monkeypatch.setattr(main, 'AI_BREAKER', breaker)
+    monkeypatch.setattr(main, '_fetch_ai_text', stuck_fetch)
+    monkeypatch.setattr(main, 'AI_REQUEST_DEADLINE_SECONDS', 5.0)
+
+    callers = [threading.Thread(target=main._generate_ai_text, args=('q', ['rule'])) for _ in range(main.AI_CALL_WORKERS)]
+    for caller in callers:
+        caller.start()
+    try:
+        for _ in callers:
+            assert started.acquire(timeout=5)
+        text = main._generate_ai_text('q', ['rule'])
+        assert 'busy' in text
+        assert breaker.snapshot()['window_calls'] == 0
+        assert breaker.state == 'closed'
+    finally:
+        release.set()
+        for caller in callers:
+            caller.join(5)
+
+    assert breaker.snapshot()['window_calls'] == main.AI_CALL_WORKERS
+    # every slot comes back once the fetches end (the release runs just after the caller wakes)
+    deadline = time.monotonic() + 5
+    while main.AI_CALL_SLOTS._value < main.AI_CALL_WORKERS and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert main.AI_CALL_SLOTS._value == main.AI_CALL_WORKERS
+
+
+def test_offline_answer_never_echoes_another_callers_question(fresh_db, make_user, monkeypatch):
+    monkeypatch.delenv('GEMINI_API_KEY', raising=False)
+    generate = main._generate_ai_text
+    entered = threading.Event()
+    release = threading.Event()
+
+    def slow_generate(question, policy_rules):
+        entered.set()
+        release.wait(5)
+        return generate(question, policy_rules)
+
+    monkeypatch.setattr(main, '_generate_ai_text', slow_generate)
+    _, first = make_user('client')
+    _, second = make_user('client')
+    answers = {}
+
+    def ask(name, client, question):
+        answers[name] = client.post('/api/ai/assist', json={'question': question}).json()['data']['answer']
+
+    # same key after normalisation, different raw text
+    leader = threading.Thread(target=ask, args=('first', first, 'ما هو الإيجار؟ رقمي 0100'))
+    follower = threading.Thread(target=ask, args=('second', second, 'ما هو  الإيجار؟ رقمي 0100'))
+    coalesced = main.AI_SINGLE_FLIGHT.coalesced
+    leader.start()
+    entered.wait(0.5)
+    follower.start()
+    # hold the leader until the follower has either joined its call or answered on its own
+    deadline = time.monotonic() + 2
+    while main.AI_SINGLE_FLIGHT.coalesced == coalesced and follower.is_alive() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert answers['first'].endswith('سؤالك: ما هو الإيجار؟ رقمي 0100')
+    assert answers['second'].endswith('سؤالك: ما هو  الإيجار؟ رقمي 0100')
@@ -0,0 +1,58 @@
+import subprocess
+import sys
+import time
+
+import pytest
+
+from app import backups, jobs
+
+
+@pytest.fixture
+def backup_dir(fresh_db, monkeypatch):
+    path = fresh_db / 'backups'
+    monkeypatch.setattr(backups, 'BACKUP_DIR', str(path))
+    return path
+
+
+def test_backup_refused_while_another_process_holds_the_lock(backup_dir):
+    holder = subprocess.Popen(
+        [sys.executable, '-c', (
+            'import fcntl, os, sys, time\n'
+            f'os.makedirs({str(backup_dir)!r}, exist_ok=True)\n'
+            f'fh = open(os.path.join({str(backup_dir)!r}, {backups.LOCK_FILE!r}), "a")\n'
+            'fcntl.flock(fh, fcntl.LOCK_EX)\n'
+            'print("locked", flush=True)\n'
+            'time.sleep(30)\n'
+        )],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        assert holder.stdout.readline().strip() == 'locked'
+        assert backups.backup_settings()['running']
+        with pytest.raises(backups.BackupBusy):
+            backups.create_backup()
+    finally:
+        holder.kill()
+        holder.wait()
+    assert not backups.backup_settings()['running']
+    assert backups.create_backup()['ok']
+
+
+def test_backup_job_outliving_the_visibility_timeout_runs_once(backup_dir, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_VISIBILITY_SECONDS', 0.3)
+    monkeypatch.setattr(jobs, 'JOB_HEARTBEAT_SECONDS', 0.1)
+    sha256 = backups._sha256
+    competing_claims = []
+
+    def slow_sha256(path):
+        time.sleep(0.5)
+        competing_claims.append(jobs._claim_next())
+        return sha256(path)
+
+    monkeypatch.setattr(backups, '_sha256', slow_sha256)
+    job_id = jobs.enqueue('db.backup.manual', priority=10, max_attempts=1)
+    assert jobs.run_one()
+    assert competing_claims and not any(competing_claims)
+    assert jobs.get_job(job_id)['status'] == 'done'
+    assert len(backups.list_backups()) == 1
@@ -0,0 +1,49 @@
+import pytest
+
+from app import db, main
+from app.db import get_conn, track_queries
+
+
+@pytest.fixture(params=['single', 'split'])
+def layout(request, fresh_db, monkeypatch):
+    if request.param == 'split':
+        monkeypatch.setitem(db.DB_PATHS, 'messages', str(fresh_db / 'messages.db'))
+        monkeypatch.setattr(main, 'AUDIT_WITH_MESSAGES', False)
+        db.init_db()
+    return request.param
+
+
+@pytest.fixture
+def case_thread(layout, make_user, make_case):
+    client_id, client = make_user('client')
+    lawyer_id, lawyer = make_user('lawyer')
+    case_id = make_case(client_id, lawyer_id)
+    with get_conn() as conn:
+        conn.executemany(
+            'INSERT INTO payments (case_id, client_user_id, lawyer_user_id, amount) VALUES (?, ?, ?, ?)',
+            [(case_id, client_id, lawyer_id, 500 + i) for i in range(3)],
+        )
+    for i in range(5):
+        sent = client.post('/api/messages', json={'case_id': case_id, 'receiver_user_id': lawyer_id, 'content': f'message {i}'})
+        assert sent.status_code == 201
+    return case_id, client, lawyer
+
+
+def _statements(client, path):
+    with track_queries() as statements:
+        response = client.get(path)
+    assert response.status_code == 200, response.text
+    return statements
+
+
+@pytest.mark.parametrize('page', ['/cases/{id}', '/cases/{id}/messages'])
+def test_case_page_is_one_query(case_thread, page):
+    case_id, client, _ = case_thread
+    assert len(_statements(client, page.format(id=case_id))) == 1
+
+
+def test_unread_messages_page_adds_only_the_read_cursor_write(case_thread):
+    case_id, _, lawyer = case_thread
+    statements = _statements(lawyer, f'/cases/{case_id}/messages')
+    assert len(statements) == 2 and statements[1].lstrip().upper().startswith('UPDATE CASE_READ_STATE')
+    assert len(_statements(lawyer, f'/cases/{case_id}/messages')) == 1
@@ -0,0 +1,60 @@
+import time
+
+from app import jobs
+from app.db import get_conn
+
+
+def _register(monkeypatch, kind, handler, every_s=None):
+    monkeypatch.setitem(jobs.HANDLERS, kind, handler)
+    if every_s:
+        monkeypatch.setitem(jobs.RECURRING, kind, every_s)
+
+
+def _rows(kind):
+    with get_conn() as conn:
+        return [tuple(row) for row in conn.execute('SELECT status, attempts FROM jobs WHERE kind = ? ORDER BY id', (kind,))]
+
+
+def _expire_leases():
+    with get_conn() as conn:
+        conn.execute("UPDATE jobs SET locked_until = ? WHERE status = 'running'", (time.time() - 1,))
+
+
+def test_reclaimed_job_outcome_is_dropped_and_recurring_chain_stays_single(fresh_db, monkeypatch):
+    _register(monkeypatch, 'test.recurring', lambda payload: None, every_s=3600)
+    jobs.enqueue('test.recurring')
+    first = jobs._claim_next()
+    _expire_leases()
+    second = jobs._claim_next()
+    assert (first['id'], second['attempts']) == (second['id'], 2)
+
+    # the stale claim finishing late changes nothing
+    assert not jobs._finish(first, result='late')
+    assert _rows('test.recurring') == [('running', 2)]
+
+    assert jobs._finish(second, result='ok')
+    assert _rows('test.recurring') == [('done', 2), ('queued', 0)]
+    # a duplicate final outcome never starts a second chain
+    with get_conn() as conn:
+        conn.execute("UPDATE jobs SET status = 'running' WHERE id = ?", (second['id'],))
+    assert jobs._finish(second, result='again')
+    assert [status for status, _ in _rows('test.recurring')].count('queued') == 1
+
+
+def test_running_job_keeps_its_lease_past_the_visibility_timeout(fresh_db, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_VISIBILITY_SECONDS', 0.3)
+    monkeypatch.setattr(jobs, 'JOB_HEARTBEAT_SECONDS', 0.1)
+    reclaimed = []
+
+    def slow(payload):
+        time.sleep(1.0)
+        # another worker polling while this one runs must find nothing to take
+        reclaimed.append(jobs._claim_next())
+        return 'done'
+
+    _register(monkeypatch, 'test.slow', slow)
+    job_id = jobs.enqueue('test.slow', max_attempts=1)
+    assert jobs.run_one()
+    assert reclaimed == [None]
+    job = jobs.get_job(job_id)
+    assert (job['status'], job['attempts'], job['result']) == ('done', 1, 'done')
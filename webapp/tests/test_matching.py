@@ -0,0 +1,57 @@
+from app.db import get_conn
+from app.matching import LawyerIndex
+
+
+def _lawyer(make_user, fee=500, city='Nasr City'):
+    lawyer_id, _ = make_user('lawyer')
+    with get_conn() as conn:
+        conn.execute('UPDATE users SET is_verified = 1 WHERE id = ?', (lawyer_id,))
+        conn.execute('UPDATE lawyers SET min_consultation_fee = ?, city = ? WHERE user_id = ?', (fee, city, lawyer_id))
+    return lawyer_id
+
+
+def _ids(index, **filters):
+    return [row['lawyer_user_id'] for row in index.recommend('civil', **filters)]
+
+
+def test_write_through_one_index_is_seen_by_another(fresh_db, make_user):
+    writer, reader = LawyerIndex(), LawyerIndex()
+    kept, dropped, repriced = (_lawyer(make_user) for _ in range(3))
+    writer.rebuild()
+    reader.rebuild()
+    assert set(_ids(reader)) == {kept, dropped, repriced}
+
+    with get_conn() as conn:
+        conn.execute('UPDATE users SET is_verified = 0 WHERE id = ?', (dropped,))
+        conn.execute('UPDATE lawyers SET min_consultation_fee = 3000 WHERE user_id = ?', (repriced,))
+    writer.refresh_lawyers([dropped, repriced])
+
+    assert set(_ids(reader)) == {kept, repriced}
+    assert _ids(reader, max_fee=1000) == [kept]
+    assert _ids(reader, max_fee=5000, limit=5) == _ids(writer, max_fee=5000, limit=5)
+
+
+def test_case_history_from_another_process_changes_ranking(fresh_db, make_user, make_case):
+    client_id, _ = make_user('client')
+    first, second = _lawyer(make_user), _lawyer(make_user)
+    index = LawyerIndex()
+    index.rebuild()
+    leader, experienced = _ids(index)
+    assert {leader, experienced} == {first, second}
+
+    for _ in range(3):
+        case_id = make_case(client_id, experienced)
+        with get_conn() as conn:
+            conn.execute("UPDATE cases SET status = 'completed' WHERE id = ?", (case_id,))
+    assert _ids(index, limit=1) == [experienced]
+
+
+def test_purged_changes_force_a_rebuild(fresh_db, make_user):
+    index = LawyerIndex()
+    lawyer_id = _lawyer(make_user)
+    index.rebuild()
+    with get_conn() as conn:
+        conn.execute('UPDATE users SET is_active = 0 WHERE id = ?', (lawyer_id,))
+        conn.execute('DELETE FROM matching_changes')
+    _lawyer(make_user)  # a later change past the purged gap
+    assert lawyer_id not in _ids(index)
@@ -0,0 +1,53 @@
+import sqlite3
+
+from app import db, main
+
+
+def _send(client, case_id, receiver_id, content):
+    response = client.post('/api/messages', json={'case_id': case_id, 'receiver_user_id': receiver_id, 'content': content})
+    assert response.status_code == 201, response.text
+
+
+def _thread(client, case_id):
+    return next(row for row in client.get('/api/inbox').json()['data'] if row['id'] == case_id)
+
+
+def test_inbox_follows_new_messages_after_messages_db_split(fresh_db, monkeypatch, make_user, make_case):
+    client_id, client = make_user('client')
+    lawyer_id, lawyer = make_user('lawyer')
+    case_id = make_case(client_id, lawyer_id)
+    _send(client, case_id, lawyer_id, 'hello')
+    assert _thread(lawyer, case_id)['unread_count'] == 1
+
+    monkeypatch.setitem(db.DB_PATHS, 'messages', str(fresh_db / 'messages.db'))
+    monkeypatch.setattr(main, 'AUDIT_WITH_MESSAGES', False)
+    db.init_db()
+
+    with sqlite3.connect(db.DB_PATH) as conn:
+        left_in_main = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert not {'messages', 'case_read_state'} & left_in_main
+    # moved with its rows, not re-derived: the unread message is still unread
+    assert _thread(lawyer, case_id)['unread_count'] == 1
+
+    _send(client, case_id, lawyer_id, 'second message')
+    thread = _thread(lawyer, case_id)
+    assert thread['last_message_preview'] == 'second message'
+    assert thread['unread_count'] == 2
+
+    lawyer.get(f'/api/messages/{case_id}')
+    assert _thread(lawyer, case_id)['unread_count'] == 0
+
+
+def test_split_backfills_read_state_from_moved_messages(fresh_db, monkeypatch, make_user, make_case):
+    client_id, client = make_user('client')
+    lawyer_id, _ = make_user('lawyer')
+    case_id = make_case(client_id, lawyer_id)
+    _send(client, case_id, lawyer_id, 'written before read state existed')
+    with sqlite3.connect(db.DB_PATH) as conn:
+        conn.execute('DELETE FROM case_read_state')
+
+    monkeypatch.setitem(db.DB_PATHS, 'messages', str(fresh_db / 'messages.db'))
+    monkeypatch.setattr(main, 'AUDIT_WITH_MESSAGES', False)
+    db.init_db()
+
+    assert _thread(client, case_id)['last_message_preview'] == 'written before read state existed'
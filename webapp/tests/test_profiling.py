@@ -0,0 +1,54 @@
+import threading
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import profiling
+
+
+def _busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        sum(range(500))
+
+
+def _profiled_app():
+    app = FastAPI()
+    app.router.route_class = profiling.ProfiledRoute
+    app.add_middleware(profiling.ProfilingMiddleware)
+    seen = {}
+
+    @app.get('/render')
+    def render_without_db():
+        # stands in for template rendering / hashing after any connection has closed
+        seen['joined'] = threading.get_ident() in profiling._profile_threads.get()
+        seen['ident'] = threading.get_ident()
+        _busy(0.3)
+        return {'ok': True}
+
+    return app, seen
+
+
+def test_sync_endpoint_is_sampled_for_its_whole_call(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setitem(profiling.SETTINGS, 'sample_rate', 1.0)
+    monkeypatch.setitem(profiling.SETTINGS, 'path_prefix', None)
+    app, seen = _profiled_app()
+
+    response = TestClient(app).get('/render')
+
+    assert response.status_code == 200 and seen['joined']
+    record = profiling.load_profile(response.headers['x-profile-id'])
+    in_endpoint = sum(n for stack, n in record['stacks'].items() if 'render_without_db' in stack)
+    assert in_endpoint >= record['samples'] // 2 > 0
+
+
+def test_pool_thread_leaves_the_profile_after_the_call():
+    threads = set()
+    token = profiling._profile_threads.set(threads)
+    try:
+        during = profiling._joins_profile(lambda: set(threads))()
+    finally:
+        profiling._profile_threads.reset(token)
+    assert during == {threading.get_ident()} and threads == set()
@@ -2,8 +2,19 @@
 
 PythonAnywhere expects a WSGI callable named `application`.
 FastAPI is ASGI, so we adapt ASGI -> WSGI using a2wsgi.
+a2wsgi does not send ASGI lifespan events, so the app's startup runs here.
 """
-from a2wsgi import ASGIMiddleware
-from app.main import app
+import atexit
+import time
+
+_import_started = time.perf_counter()
+
+from a2wsgi import ASGIMiddleware  # noqa: E402
+from app.main import app, shutdown, startup  # noqa: E402
+from app.startup import record_phase  # noqa: E402
+
+record_phase('import', time.perf_counter() - _import_started)
+startup()
+atexit.register(shutdown)
 
 application = ASGIMiddleware(app)